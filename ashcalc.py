@@ -1,8 +1,35 @@
+import multiprocessing
 import sys
-from core import isopach
 from command_line import cli
+from core import memory, profiling
+from core.exceptions import MemoryLimitExceeded
 
 if __name__ == '__main__':
+    # Frozen executables must run worker processes' code rather than main
+    multiprocessing.freeze_support()
+
+    # The local fitting service has its own arguments
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        from command_line import server
+        server.main(sys.argv[2:])
+        sys.exit()
+
+    # As do parameter sweeps
+    if len(sys.argv) > 1 and sys.argv[1] == 'sweep':
+        from command_line import sweep
+        sys.exit(sweep.main(sys.argv[2:]))
+
+    # And synthetic deposit generation
+    if len(sys.argv) > 1 and sys.argv[1] == 'generate':
+        from command_line import generate
+        generate.main(sys.argv[2:])
+        sys.exit()
+
+    # And numerical equivalence checks of the fast engines
+    if len(sys.argv) > 1 and sys.argv[1] == 'verify':
+        from command_line import verify
+        sys.exit(verify.main(sys.argv[2:]))
+
     # Get and store command line arguments
     parser = cli.setup_parser()
     args = parser.parse_args()
@@ -17,13 +44,54 @@ if __name__ == '__main__':
     # Otherwise, prepare model settings then process the files
     model_settings = cli.ModelSettings()
     cli.set_model_settings_from_arguments(model_settings, args)
-    for filename in args.filelist:
-        isopachs, comments = isopach.read_isopach_file(filename)
-        results = cli.fit_isopachs(isopachs, model_settings)
-        if args.json:
-            cli.print_json_output(filename, results, model_settings, comments)
-        else:
-            cli.print_output(filename, results, model_settings, comments)
-        if args.plot:
-            cli.plot_results_figure(filename, results, model_settings,
-                                    comments)
+    if args.profile is not None:
+        profiling.enable()
+    cli.enable_memory_tracking(args)
+    output = 'json' if args.json else args.output
+    fields = cli.get_fields(parser, args)
+    if output == 'text':
+        # Text output always shows every result
+        fields = None
+    if output == 'csv':
+        cli.print_csv_header()
+
+    failures = 0
+    try:
+        for filename, results, comments, error in cli.process_files(
+                args.filelist, model_settings, plot=args.plot, jobs=args.jobs,
+                ordered=not args.unordered, cache=cli.get_result_cache(args),
+                seed=args.seed, fields=fields):
+            with profiling.span('output', deposit=filename):
+                if error is not None:
+                    cli.print_error(filename, error)
+                    if output == 'jsonl':
+                        cli.print_jsonl_error(filename, error)
+                    elif output == 'csv':
+                        cli.print_csv_error(filename, error)
+                    failures += 1
+                elif output == 'json':
+                    cli.print_json_output(filename, results, model_settings,
+                                          comments)
+                elif output == 'jsonl':
+                    cli.print_jsonl_output(filename, results,
+                                           model_settings, comments)
+                elif output == 'csv':
+                    cli.print_csv_output(filename, results, model_settings)
+                else:
+                    cli.print_output(filename, results, model_settings,
+                                     comments)
+            sys.stdout.flush()
+            memory.checkpoint('output')
+    except MemoryLimitExceeded as e:
+        # Stop cleanly, reporting what was allocated
+        print('Stopping: {}'.format(e), file=sys.stderr)
+        if args.profile is not None:
+            cli.write_profile_report(args)
+        cli.write_memory_report(args)
+        sys.exit(2)
+
+    if args.profile is not None:
+        cli.write_profile_report(args)
+    if args.memory is not None:
+        cli.write_memory_report(args)
+    sys.exit(1 if failures else 0)
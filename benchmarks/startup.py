@@ -0,0 +1,103 @@
+# -- coding: utf-8 --
+"""
+Benchmark of command line start up time.
+
+Fits a single small file through ashcalc.py in a fresh interpreter several
+times and reports the fastest and median wall times.  Also checks that modules
+which are slow to import are not loaded when they are not needed.  Exits with
+a non-zero status if either check fails, so it can guard against regressions.
+
+Run from the AshCalc directory with:
+
+    python -m benchmarks.startup
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_FILENAME = os.path.join(ROOT_DIRECTORY, 'test_isopachs.csv')
+
+# Modules that should only be imported when plotting or using the gui
+LAZY_MODULES = ['matplotlib', 'scipy', 'tkinter']
+
+DEFAULT_MAX_SECONDS = 1.0
+
+_MODULE_CHECK = """
+import json, runpy, sys
+modules = json.loads(sys.argv[2])
+sys.argv = ['ashcalc.py'] + json.loads(sys.argv[1])
+try:
+    runpy.run_path('ashcalc.py', run_name='__main__')
+except SystemExit:
+    pass
+loaded = [m for m in modules if m in sys.modules]
+sys.stderr.write(json.dumps(loaded))
+"""
+
+
+def time_cli(arguments, repeats):
+    """
+    Return list of wall times in seconds taken to run ashcalc.py with the
+    given arguments.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, 'ashcalc.py'] + arguments,
+                       cwd=ROOT_DIRECTORY, stdout=subprocess.DEVNULL,
+                       check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def find_loaded_lazy_modules(arguments):
+    """
+    Return list of the LAZY_MODULES imported while running ashcalc.py with the
+    given arguments.
+    """
+    process = subprocess.run(
+        [sys.executable, '-c', _MODULE_CHECK, json.dumps(arguments),
+         json.dumps(LAZY_MODULES)],
+        cwd=ROOT_DIRECTORY, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        check=True)
+    return json.loads(process.stderr.decode().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the start up time of the command line '
+                    'interface.')
+    parser.add_argument('--filename', type=str, default=DEFAULT_FILENAME,
+                        help='Isopach file to fit')
+    parser.add_argument('--repeats', type=int, default=10,
+                        help='Number of times to run the command line')
+    parser.add_argument('--max_seconds', type=float,
+                        default=DEFAULT_MAX_SECONDS,
+                        help='Fail if the fastest run takes longer than this')
+    args = parser.parse_args()
+
+    arguments = [args.filename, '--no-cache']
+    times = time_cli(arguments, args.repeats)
+    loaded = find_loaded_lazy_modules(arguments)
+
+    print('Fastest: {:.3f} s'.format(min(times)))
+    print('Median: {:.3f} s'.format(statistics.median(times)))
+    print('Slow modules imported: {}'.format(', '.join(loaded) or 'none'))
+
+    failed = False
+    if min(times) > args.max_seconds:
+        print('FAIL: start up took longer than {} s'.format(args.max_seconds))
+        failed = True
+    if loaded:
+        print('FAIL: slow modules imported when they were not needed')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
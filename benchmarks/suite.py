@@ -0,0 +1,267 @@
+# -- coding: utf-8 --
+"""
+Benchmark suite for the models, file reading and the command line.
+
+Times each case several times and records the fastest and median time per
+call.  The results can be written as json and compared against a baseline, in
+which case the suite exits with a non-zero status if any case has become
+slower than the baseline by more than the tolerance.
+
+Timings depend on the machine, so the baseline is not part of the repository.
+Record one on your machine, from the AshCalc directory, before making a
+change:
+
+    python -m benchmarks.suite --record
+
+and compare against it afterwards with:
+
+    python -m benchmarks.suite --baseline
+
+A baseline recorded on another machine, or with other versions of Python or
+numpy, is not compared against.
+"""
+import argparse
+import datetime
+import fnmatch
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+from collections import OrderedDict
+
+import numpy as np
+
+from core import synthetic
+from core.isopach import read_isopach_file
+from core.models.exponential import exponentialModelAnalysis
+from core.models.power_law import powerLawModelAnalysis
+from core.models.weibull import weibullModelAnalysis
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT_DIRECTORY, 'benchmarks', 'baseline.json')
+
+# Metadata that must match for timings to be comparable
+MACHINE_KEYS = ['python', 'numpy', 'platform', 'processor', 'cpu_count']
+
+# Fraction by which a case may be slower than the baseline before it fails
+DEFAULT_TOLERANCE = 0.25
+
+ISOPACH_COUNTS = [6, 12, 24]
+SEGMENT_COUNTS = [1, 2, 3]
+FILE_ISOPACH_COUNTS = [10, 100, 1000]
+WEIBULL_RUNS_AND_ITERATIONS = [(5, 100), (5, 1000), (20, 1000)]
+WEIBULL_LIMITS = ((0, 1000), (0, 2))
+
+# Parameters of the synthetic deposits the models are timed on
+EXPONENTIAL_PARAMETERS = {'segmentCoefficients': [5.0],
+                          'segmentExponents': [0.03],
+                          'segmentLimits': [0.0, float('inf')]}
+
+CLI_ARGUMENTS = OrderedDict([
+    ('exponential', ['--model', 'exponential']),
+    ('power_law', ['--model', 'power_law']),
+    ('weibull', ['--model', 'weibull', '--runs', '5',
+                 '--iterations_per_run', '500', '--lambda_lower', '0',
+                 '--lambda_upper', '1000', '--k_lower', '0',
+                 '--k_upper', '2', '--seed', '0']),
+])
+
+
+def make_isopachs(count, seed=0):
+    """
+    Return a list of count Isopachs following a noisy exponential decay, the
+    same for a given count and seed.
+    """
+    return synthetic.generateDeposit(
+        'exponential', parameters=EXPONENTIAL_PARAMETERS,
+        numberOfIsopachs=count, noise='uniform', noiseLevel=0.1,
+        spacing='linear', seed=seed).isopachs
+
+
+def get_cases(directory):
+    """
+    Return an ordered dictionary mapping the name of each benchmark case to a
+    function, taking no arguments, that runs it once.  Any files the cases
+    need are written to directory.
+    """
+    cases = OrderedDict()
+
+    for count in ISOPACH_COUNTS:
+        isopachs = make_isopachs(count)
+        for segments in SEGMENT_COUNTS:
+            name = 'exponential/isopachs={}/segments={}'.format(count,
+                                                                segments)
+            cases[name] = (lambda isopachs=isopachs, segments=segments:
+                           exponentialModelAnalysis(isopachs, segments)['mrse'])
+
+    for count in ISOPACH_COUNTS:
+        isopachs = make_isopachs(count)
+        name = 'power_law/isopachs={}'.format(count)
+        cases[name] = (lambda isopachs=isopachs:
+                       powerLawModelAnalysis(isopachs, 1, 300)['mrse'])
+
+    isopachs = make_isopachs(10)
+    for runs, iterations in WEIBULL_RUNS_AND_ITERATIONS:
+        name = 'weibull/runs={}/iterations={}'.format(runs, iterations)
+        cases[name] = (lambda runs=runs, iterations=iterations:
+                       weibullModelAnalysis(isopachs, runs, iterations,
+                                            WEIBULL_LIMITS)['mrse'])
+
+    for count in FILE_ISOPACH_COUNTS:
+        filename = os.path.join(directory, 'isopachs_{}.csv'.format(count))
+        synthetic.writeIsopachFile(filename, synthetic.generateDeposit(
+            'exponential', parameters=EXPONENTIAL_PARAMETERS,
+            numberOfIsopachs=count, seed=0))
+        name = 'read_isopach_file/isopachs={}'.format(count)
+        cases[name] = lambda filename=filename: read_isopach_file(filename)
+
+    filename = os.path.join(ROOT_DIRECTORY, 'test_isopachs.csv')
+    for model, arguments in CLI_ARGUMENTS.items():
+        command = ([sys.executable, 'ashcalc.py', filename, '--no-cache'] +
+                   arguments)
+        cases['cli/' + model] = (lambda command=command: subprocess.run(
+            command, cwd=ROOT_DIRECTORY, stdout=subprocess.DEVNULL,
+            check=True))
+
+    return cases
+
+
+def time_case(function, repeats):
+    """
+    Return a dictionary of the fastest and median time in seconds per call
+    of function, over repeats measurements.  Each measurement calls the
+    function enough times to take at least 0.2 seconds.
+    """
+    random.seed(0)
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    times = [time / number for time in timer.repeat(repeats, number)]
+    return {'min': min(times), 'median': statistics.median(times),
+            'repeats': repeats, 'number': number}
+
+
+def run_benchmarks(patterns=None, repeats=5):
+    """
+    Run the benchmark cases whose names match any of the shell style
+    patterns, or all of them, and return a dictionary of the results.
+    """
+    results = OrderedDict()
+    with tempfile.TemporaryDirectory() as directory:
+        for name, function in get_cases(directory).items():
+            if patterns and not any(fnmatch.fnmatch(name, pattern)
+                                    for pattern in patterns):
+                continue
+            results[name] = time_case(function, repeats)
+            print('{:<45}{:>12.6f} s'.format(name, results[name]['min']),
+                  file=sys.stderr, flush=True)
+    return {'metadata': get_metadata(), 'results': results}
+
+
+def get_metadata():
+    return {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+            'cpu_count': os.cpu_count()}
+
+
+def get_machine_differences(benchmarks, baseline):
+    """
+    Return a list of the MACHINE_KEYS whose values differ between the
+    metadata of benchmarks and baseline.
+    """
+    return [key for key in MACHINE_KEYS
+            if benchmarks['metadata'].get(key) !=
+            baseline['metadata'].get(key)]
+
+
+def compare_to_baseline(benchmarks, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Return a list of (name, baseline time, time, ratio, regressed) tuples for
+    each case in both benchmarks and baseline, comparing the fastest times.
+    """
+    comparisons = []
+    for name, result in benchmarks['results'].items():
+        if name not in baseline['results']:
+            continue
+        baseline_time = baseline['results'][name]['min']
+        ratio = result['min'] / baseline_time
+        comparisons.append((name, baseline_time, result['min'], ratio,
+                            ratio > 1 + tolerance))
+    return comparisons
+
+
+def print_comparison(comparisons):
+    print('{:<45}{:>12}{:>12}{:>8}'.format('Case', 'Baseline', 'Current',
+                                           'Ratio'))
+    for name, baseline_time, current_time, ratio, regressed in comparisons:
+        print('{:<45}{:>12.6f}{:>12.6f}{:>8.2f}{}'.format(
+            name, baseline_time, current_time, ratio,
+            '  SLOWER' if regressed else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the models, file reading and command line.')
+    parser.add_argument('--filter', type=str, action='append',
+                        help='Only run cases matching this shell style '
+                             'pattern, e.g. "weibull/*".  May be repeated.')
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='Number of measurements of each case')
+    parser.add_argument('--output', type=str,
+                        help='Write the results as json to this file')
+    parser.add_argument('--record', action='store_true',
+                        help='Write the results as the baseline for this '
+                             'machine')
+    parser.add_argument('--baseline', type=str, nargs='?',
+                        const=DEFAULT_BASELINE,
+                        help='Compare the results with this json file, by '
+                             'default the recorded baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Fail if a case is slower than the baseline by '
+                             'more than this fraction')
+    args = parser.parse_args()
+    if args.record:
+        if args.output is not None:
+            parser.error('--record and --output cannot be used together')
+        args.output = DEFAULT_BASELINE
+    if args.baseline is not None and not os.path.exists(args.baseline):
+        parser.error('No baseline at {}, record one with '
+                     '--record'.format(args.baseline))
+
+    benchmarks = run_benchmarks(args.filter, args.repeats)
+
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(benchmarks, output_file, indent=2)
+            output_file.write('\n')
+    elif args.baseline is None:
+        json.dump(benchmarks, sys.stdout, indent=2)
+        print()
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        differences = get_machine_differences(benchmarks, baseline)
+        if differences:
+            print('Not comparing with the baseline, which was recorded with '
+                  'a different {}.  Record a new one with '
+                  '--record'.format(', '.join(differences)))
+            return
+        comparisons = compare_to_baseline(benchmarks, baseline,
+                                          args.tolerance)
+        print_comparison(comparisons)
+        if any(regressed for *_, regressed in comparisons):
+            print('FAIL: some cases are more than {:.0%} slower than the '
+                  'baseline'.format(args.tolerance))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+# -- coding: utf-8 --
+"""
+Coroutine interface for fitting isopachs from asyncio applications.
+
+Fits are dispatched to threads or worker processes so that they do not block
+the event loop.  Cancelling the awaiting task stops the underlying
+calculation: Weibull fits in threads check a cancellation event every
+iteration, and worker processes are terminated and replaced.
+
+    fitter = AsyncFitter(executor='process', max_workers=4)
+    results = await fitter.fit(isopachs, model_settings)
+    async for index, results, error in fitter.fit_many(deposits):
+        ...
+    fitter.close()
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from command_line import cli
+from core.worker_process import WorkerProcess
+
+EXECUTORS = ['thread', 'process']
+
+
+class AsyncFitter(object):
+    """
+    Runs fits on a thread or process executor, with at most max_in_flight
+    fits admitted at once.  Further calls wait until a fit finishes.
+    """
+    def __init__(self, executor='thread', max_workers=None,
+                 max_in_flight=None):
+        if executor not in EXECUTORS:
+            raise ValueError('Executor must be one of: {}'.format(
+                             ' '.join(EXECUTORS)))
+        self.executor = executor
+        self.max_workers = max_workers or 1
+        self.max_in_flight = max_in_flight or self.max_workers
+
+        self._in_flight = None
+        self._thread_executor = None
+        self._idle_workers = None
+        self._workers = []
+
+    async def fit(self, isopachs, model_settings):
+        """
+        Fit the isopachs and return the results.  Raises CalculationCancelled
+        if the calculation is stopped because the task was cancelled.
+        """
+        if self._in_flight is None:
+            # Created here so that they belong to the running event loop
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        async with self._in_flight:
+            if self.executor == 'thread':
+                return await self._fit_in_thread(isopachs, model_settings)
+            else:
+                return await self._fit_in_process(isopachs, model_settings)
+
+    async def fit_many(self, deposits):
+        """
+        Asynchronous iterator that fits each (isopachs, model_settings) pair in
+        deposits, yielding (index, results, error) tuples as the fits finish.
+        A failed fit yields None results and the exception as the error,
+        rather than stopping the batch.  Only max_in_flight deposits are taken
+        from deposits at a time.
+        """
+        deposits = iter(enumerate(deposits))
+        pending = set()
+
+        def start_next():
+            try:
+                index, (isopachs, model_settings) = next(deposits)
+            except StopIteration:
+                return False
+            pending.add(asyncio.ensure_future(
+                self._fit_indexed(index, isopachs, model_settings)))
+            return True
+
+        try:
+            while len(pending) < self.max_in_flight and start_next():
+                pass
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.remove(task)
+                    start_next()
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+    def close(self):
+        """
+        Stop the executor's threads or worker processes.
+        """
+        if self._thread_executor is not None:
+            self._thread_executor.shutdown(wait=False)
+            self._thread_executor = None
+        for worker in self._workers:
+            worker.shutdown()
+        self._workers = []
+        self._idle_workers = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    async def _fit_indexed(self, index, isopachs, model_settings):
+        try:
+            return index, await self.fit(isopachs, model_settings), None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return index, None, e
+
+    async def _fit_in_thread(self, isopachs, model_settings):
+        if self._thread_executor is None:
+            self._thread_executor = ThreadPoolExecutor(self.max_workers)
+        loop = asyncio.get_running_loop()
+        cancel_event = threading.Event()
+        future = loop.run_in_executor(self._thread_executor, cli.fit_isopachs,
+                                      isopachs, model_settings, cancel_event)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Stop the calculation and wait for the thread to be free again
+            cancel_event.set()
+            try:
+                await future
+            except Exception:
+                pass
+            raise
+
+    async def _fit_in_process(self, isopachs, model_settings):
+        if self._idle_workers is None:
+            self._idle_workers = asyncio.Queue()
+            for _ in range(self.max_workers):
+                worker = WorkerProcess()
+                self._workers.append(worker)
+                self._idle_workers.put_nowait(worker)
+
+        worker = await self._idle_workers.get()
+        loop = asyncio.get_running_loop()
+        try:
+            worker.submit(cli.fit_isopachs, (isopachs, model_settings))
+            future = loop.run_in_executor(None, worker.receive)
+            try:
+                kind, value = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Terminating the process also ends the waiting receive
+                worker.terminate()
+                await future
+                raise
+        finally:
+            self._idle_workers.put_nowait(worker)
+
+        if kind == 'error':
+            raise value
+        return value
+
+
+async def fit_async(isopachs, model_settings, executor='thread'):
+    """
+    Fit the isopachs without blocking the event loop, using an AsyncFitter
+    that is closed once the fit is done.  Applications making many fits
+    should own an AsyncFitter instead, for example with
+    "async with AsyncFitter(executor) as fitter", so that its threads or
+    worker processes are reused.
+    """
+    async with AsyncFitter(executor) as fitter:
+        return await fitter.fit(isopachs, model_settings)
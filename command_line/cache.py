@@ -0,0 +1,137 @@
+# -- coding: utf-8 --
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+# Changed whenever the format of the cached results changes
+CACHE_VERSION = 3
+
+
+class ResultCache(object):
+    """
+    On-disk cache of fitted results, keyed by a hash of the isopach data, the
+    model settings and the random seed.  When the total size of the cache
+    exceeds max_size_bytes the least recently used results are removed.
+
+    The results are stored as pickles, and loading a pickle can run arbitrary
+    code, so the directory must only be writable by trusted users.  It is
+    created readable and writable only by its owner.
+    """
+    extension = '.pickle'
+
+    def __init__(self, directory, max_size_bytes):
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+
+    def get_key(self, isopachs, model_settings, seed=None):
+        """
+        Return the hex digest identifying a fit of the isopachs with the given
+        model settings and seed.
+        """
+        data = {'isopachs': [[isopach.thicknessM, isopach.sqrtAreaKM]
+                             for isopach in isopachs],
+                'settings': _normalise_numbers(model_settings.get_as_dict()),
+                'seed': seed,
+                'version': CACHE_VERSION}
+        encoded = json.dumps(data, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()
+
+    def get(self, key):
+        """
+        Return the results stored under key, or None if there are none or
+        they cannot be loaded, e.g. because they were stored by an older
+        version whose classes have since been renamed.
+        """
+        path = self._get_path(key)
+        try:
+            with open(path, 'rb') as f:
+                results = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError,
+                ImportError, IndexError, TypeError, ValueError):
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return results
+
+    def put(self, key, results):
+        """
+        Store results under key, then evict old results if the cache is too
+        large.
+        """
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+
+        # Write to a temporary file first so that concurrent readers never see
+        # a partially written file.
+        handle, temp_path = tempfile.mkstemp(dir=self.directory,
+                                             suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._get_path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        self._evict()
+
+    def clear(self):
+        """
+        Remove all cached results.
+        """
+        for path, _, _ in self._get_entries():
+            _remove_if_exists(path)
+
+    def _evict(self):
+        entries = self._get_entries()
+        total_size = sum(size for _, size, _ in entries)
+        entries.sort(key=lambda entry: entry[2])
+        for path, size, _ in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            _remove_if_exists(path)
+            total_size -= size
+
+    def _get_entries(self):
+        """
+        Return list of (path, size, last access time) for each cached result.
+        """
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(self.extension):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key + self.extension)
+
+
+def _normalise_numbers(settings):
+    """
+    Convert numeric settings to floats so that, for example, a bound of 1000
+    and 1000.0 produce the same key.
+    """
+    return {name: float(value) if isinstance(value, (int, float)) else value
+            for name, value in settings.items()}
+
+
+def _remove_if_exists(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -1,12 +1,31 @@
 # -- coding: utf-8 --
 import argparse
+import csv
 import json
+import random
+import sys
+from collections import namedtuple
+from concurrent.futures import as_completed
 from textwrap import dedent
 import numpy as np
-import matplotlib.pyplot as plt
+from command_line.cache import ResultCache
+from core import isopach, memory, profiling
+from core.exceptions import MemoryLimitExceeded
+from core.results import ModelResults
 from core.models import exponential, weibull, power_law
 import settings
 
+MODEL_NAMES = ['exponential', 'power_law', 'weibull']
+
+OUTPUT_FORMATS = ['text', 'json', 'jsonl', 'csv']
+
+CSV_FIELDS = ['filename', 'model', 'estimatedTotalVolume', 'mrse',
+              'numberOfSegments', 'segmentCoefficients', 'segmentExponents',
+              'segmentLimits', 'coefficient', 'exponent',
+              'suggestedProximalLimit', 'lambda', 'k', 'theta', 'error']
+
+FileResult = namedtuple('FileResult', 'filename results comments error')
+
 
 def setup_parser():
     parser = argparse.ArgumentParser(
@@ -14,8 +33,9 @@ def setup_parser():
                     'exponential, power law or Weibull models.')
     parser.add_argument(
         '--model', type=str, default='exponential',
-        choices=['exponential', 'power_law', 'weibull'],
-        help='Model used to fit root-area vs thickness curve.')
+        choices=MODEL_NAMES + ['all'],
+        help='Model used to fit root-area vs thickness curve.  "all" fits '
+             'every model and compares them.')
     # It is possible to set defaults for all the values here, but this is not
     # done as it is preferable to get them from the settings file.
     parser.add_argument(
@@ -48,15 +68,150 @@ def setup_parser():
     parser.add_argument(
         '--k_upper', type=float,
         help='k parameter upper bound.  Used with weibull model')
+    parser.add_argument(
+        '--telemetry', action='store_true',
+        help='Record the counters and traces of the weibull model\'s solver '
+             'and include them in json and jsonl output')
     parser.add_argument(
         '--plot', action='store_true',
         help='Plot the results as *filename_model.png*')
     parser.add_argument(
         '--json', action='store_true',
-        help='Print the results formatted as json')
+        help='Print the results formatted as json.  Same as --output json')
+    parser.add_argument(
+        '--output', type=str, default='text', choices=OUTPUT_FORMATS,
+        help='Output format.  jsonl prints one compact json record per file '
+             'and csv prints a summary table with one row per file and '
+             'model.  Both are written as each file completes.')
+    parser.add_argument(
+        '--fields', type=str,
+        help='Comma separated list of the results to include in json, jsonl '
+             'and csv output, e.g. estimatedTotalVolume.  Results that are '
+             'not included, such as mrse, are not calculated.')
+    parser.add_argument(
+        '--jobs', type=int, default=1,
+        help='Number of files to fit concurrently in separate processes')
+    parser.add_argument(
+        '--unordered', action='store_true',
+        help='Print the results for each file as soon as it is complete, '
+             'rather than in the order the files were given')
+    parser.add_argument(
+        '--seed', type=int,
+        help='Seed for the random number generator used by the weibull '
+             'model, so that fits are reproducible')
+    parser.add_argument(
+        '--no-cache', '--no_cache', dest='no_cache', action='store_true',
+        help='Refit every file rather than reusing cached results')
+    parser.add_argument(
+        '--cache_dir', type=str, default=settings.CLI_CACHE_DIRECTORY,
+        help='Directory in which fitted results are cached.  The results are '
+             'loaded with pickle, so the directory must only be writable by '
+             'trusted users')
+    parser.add_argument(
+        '--profile', type=str, nargs='?', const='text',
+        choices=profiling.PROFILE_FORMATS,
+        help='Time each stage of the calculation and report the totals per '
+             'stage and per file.  The report is text by default, or json, '
+             'or a chrome trace (viewable in chrome://tracing or Perfetto)')
+    parser.add_argument(
+        '--profile_output', type=str,
+        help='Write the profile report to this file rather than standard '
+             'error')
+    parser.add_argument(
+        '--memory', type=str, nargs='?', const='text',
+        choices=memory.MEMORY_FORMATS,
+        help='Track the memory allocated while processing each file and '
+             'report the peak, the memory retained by each file and the '
+             'sites that allocated the most.  Slows processing down')
+    parser.add_argument(
+        '--memory_limit', type=float,
+        help='Stop the batch, and report the memory allocated, if more than '
+             'this many megabytes are allocated by Python while processing a '
+             'file.  Applies to each process when used with --jobs')
+    parser.add_argument(
+        '--memory_output', type=str,
+        help='Write the memory report to this file rather than standard '
+             'error')
     return parser
 
 
+def enable_memory_tracking(args):
+    """
+    Start tracking memory if the --memory or --memory_limit arguments are
+    given.
+    """
+    if args.memory is not None or args.memory_limit is not None:
+        limit = args.memory_limit
+        memory.enable(None if limit is None else int(limit * 1024 * 1024))
+
+
+def write_memory_report(args):
+    """
+    Write a report of the memory allocated in the format and to the file
+    given by the --memory arguments.
+    """
+    report_format = args.memory or 'text'
+    if args.memory_output is None:
+        memory.writeReport(sys.stderr, report_format)
+    else:
+        with open(args.memory_output, 'w') as memory_file:
+            memory.writeReport(memory_file, report_format)
+
+
+def write_profile_report(args):
+    """
+    Write the timings recorded in the format and to the file given by the
+    --profile arguments.
+    """
+    if args.profile_output is None:
+        profiling.writeReport(sys.stderr, args.profile)
+    else:
+        with open(args.profile_output, 'w') as profile_file:
+            profiling.writeReport(profile_file, args.profile)
+
+
+def get_fields(parser, args):
+    """
+    Return list of the result names given by the --fields argument, or None if
+    all results are to be output.  Exits with a parser error listing the valid
+    names if any are not results of the model.
+    """
+    if args.fields is None:
+        return None
+    fields = [field.strip() for field in args.fields.split(',')]
+    valid_fields = get_valid_fields(args.model)
+    unknown_fields = [field for field in fields if field not in valid_fields]
+    if unknown_fields:
+        parser.error('Unknown fields: {}. Valid fields for the {} model are: '
+                     '{}'.format(', '.join(unknown_fields), args.model,
+                                 ', '.join(valid_fields)))
+    return fields
+
+
+def get_valid_fields(model):
+    """
+    Return list of the result names that can be output for model, which may
+    be 'all'.
+    """
+    models = MODEL_NAMES if model == 'all' else [model]
+    valid_fields = []
+    for model_name in models:
+        valid_fields += [field for field in ModelResults.fieldNames(model_name)
+                         if field not in valid_fields]
+    return valid_fields
+
+
+def get_result_cache(args):
+    """
+    Return the ResultCache described by the command line arguments, or None if
+    caching is turned off.
+    """
+    if args.no_cache:
+        return None
+    return ResultCache(args.cache_dir,
+                       settings.CLI_CACHE_MAX_SIZE_MB * 1024 * 1024)
+
+
 def set_model_settings_from_arguments(model_settings, args):
     """
     Use command line arguments to set model parameters.  If no parameters are
@@ -64,27 +219,26 @@ def set_model_settings_from_arguments(model_settings, args):
     given, return an error.
     """
     model_settings.set_model(args.model)
+    models = MODEL_NAMES if args.model == 'all' else [args.model]
 
-    if args.model == 'exponential':
-        if args.segments is None:
-            return
-        else:
+    if 'exponential' in models:
+        if args.segments is not None:
             model_settings.set_exponential_parameters(args.segments)
-    elif args.model == 'power_law':
+    if 'power_law' in models:
         arglist = [args.proximal_limit, args.distal_limit]
         if all_are_none(arglist):
-            return
+            pass
         elif none_are_none(arglist):
             model_settings.set_power_law_parameters(args.proximal_limit,
                                                     args.distal_limit)
         else:
             raise ValueError(
                 'Bad parameters.  Set all parameters or set none.')
-    elif args.model == 'weibull':
+    if 'weibull' in models:
         arglist = [args.runs, args.iterations_per_run, args.lambda_lower,
                    args.lambda_upper, args.k_lower, args.k_upper]
         if all_are_none(arglist):
-            return
+            pass
         elif none_are_none(arglist):
             model_settings.set_weibull_parameters(
                 args.runs, args.iterations_per_run,
@@ -94,6 +248,7 @@ def set_model_settings_from_arguments(model_settings, args):
         else:
             raise ValueError(
                 'Bad parameters.  Set all parameters or set none.')
+        model_settings.wei_telemetry = args.telemetry
 
 
 def none_are_none(arglist):
@@ -127,13 +282,14 @@ class ModelSettings(object):
         self.wei_lambda_upper_bound = settings.WEI_DEFAULT_LAMBDA_UPPER_BOUND
         self.wei_k_lower_bound = settings.WEI_DEFAULT_K_LOWER_BOUND
         self.wei_k_upper_bound = settings.WEI_DEFAULT_K_UPPER_BOUND
+        self.wei_telemetry = False
 
     def set_model(self, model):
         """
-        Set the model to use.
+        Set the model to use.  'all' fits every model.
         """
         model = model.lower()
-        model_names = ['weibull', 'power_law', 'exponential']
+        model_names = MODEL_NAMES + ['all']
         if model not in model_names:
             raise ValueError('Model must be one of: {}'.format(
                              " ".join(model_names)))
@@ -175,16 +331,23 @@ class ModelSettings(object):
         self.wei_k_lower_bound = limits[1][0]
         self.wei_k_upper_bound = limits[1][1]
 
-    def get_params(self):
+    def get_models(self):
+        """
+        Return list of the names of the models to be fitted.
+        """
+        return MODEL_NAMES if self.model == 'all' else [self.model]
+
+    def get_params(self, model=None):
         """
         Return list of appropriate parameters based on the chosen model
-        setting.
+        setting, or for the given model if one is specified.
         """
-        if self.model == 'exponential':
+        model = model or self.model
+        if model == 'exponential':
             return [self.exp_segments]
-        elif self.model == 'power_law':
+        elif model == 'power_law':
             return [self.pow_proximal_limit, self.pow_distal_limit]
-        elif self.model == 'weibull':
+        elif model == 'weibull':
             limits = ((self.wei_lambda_lower_bound,
                        self.wei_lambda_upper_bound),
                       (self.wei_k_lower_bound,
@@ -192,22 +355,25 @@ class ModelSettings(object):
             return [self.wei_number_of_runs, self.wei_iterations_per_run,
                     limits]
 
-    def get_as_text(self):
+    def get_as_text(self, model=None):
         """
         Return pretty representation of settings values for use in plots or
         other outputs.
         """
-        if self.model == 'exponential':
+        model = model or self.model
+        if model == 'all':
+            return '\n'.join(self.get_as_text(m) for m in MODEL_NAMES)
+        elif model == 'exponential':
             text = """\
                 Model: Exponential
                 Number of segments: {}""".format(self.exp_segments)
-        elif self.model == 'power_law':
+        elif model == 'power_law':
             text = """\
                 Model: Power Law
                 Proximal limit: {}
                 Distal limit: {}""".format(self.pow_proximal_limit,
                                            self.pow_distal_limit)
-        elif self.model == 'weibull':
+        elif model == 'weibull':
             text = """\
                 Model: Weibull
                 Number of runs: {}
@@ -221,6 +387,32 @@ class ModelSettings(object):
                                            self.wei_k_upper_bound)
         return dedent(text)
 
+    def set_from_dict(self, settings_dict):
+        """
+        Set the model and model settings from a dictionary of the form returned
+        by get_as_dict.  Settings that are not given keep their current values.
+        """
+        unknown = set(settings_dict) - set(vars(self))
+        if unknown:
+            raise ValueError('Unknown settings: {}'.format(
+                             ', '.join(sorted(unknown))))
+        values = vars(self).copy()
+        values.update(settings_dict)
+
+        self.set_model(values['model'])
+        self.exp_max_segments = int(values['exp_max_segments'])
+        self.set_exponential_parameters(int(values['exp_segments']))
+        self.set_power_law_parameters(float(values['pow_proximal_limit']),
+                                      float(values['pow_distal_limit']))
+        self.set_weibull_parameters(
+            int(values['wei_number_of_runs']),
+            int(values['wei_iterations_per_run']),
+            ((float(values['wei_lambda_lower_bound']),
+              float(values['wei_lambda_upper_bound'])),
+             (float(values['wei_k_lower_bound']),
+              float(values['wei_k_upper_bound']))))
+        self.wei_telemetry = bool(values['wei_telemetry'])
+
     def get_as_dict(self):
         """
         Return model settings as a dictionary.
@@ -240,83 +432,305 @@ class ModelSettings(object):
                                                    'exp_max_segments'],
                                    'power_law': ['pow_proximal_limit',
                                                  'pow_distal_limit'],
-                                   'weibull': ['wei_lambda_upper_bound',
+                                   'weibull': ['wei_number_of_runs',
+                                               'wei_iterations_per_run',
+                                               'wei_lambda_lower_bound',
                                                'wei_lambda_upper_bound',
-                                               'wei_k_upper_bound',
+                                               'wei_k_lower_bound',
                                                'wei_k_upper_bound']}
 
         # Drop unused settings
-        settings_used = settings_used_by_models[self.model]
+        settings_used = []
+        for model in self.get_models():
+            settings_used += settings_used_by_models[model]
         all_settings = settings.keys()
         settings_to_drop = [s for s in all_settings if s not in settings_used]
         for setting in settings_to_drop:
             settings.pop(setting)
 
+        # Only given when set, so that existing keys and output are unchanged
+        if self.wei_telemetry and 'weibull' in self.get_models():
+            settings['wei_telemetry'] = True
+
         return settings
 
 
-def fit_isopachs(isopachs, model_settings):
+@profiling.timed('fit_isopachs')
+def fit_isopachs(isopachs, model_settings, cancel_event=None, fields=None):
     """
     ([list of Isopach], AshCalcModelSettings) -> dictionary of results.
 
-    Runs the model to fit the isopachs and return the results.
+    Runs the model to fit the isopachs and return the results.  If the model
+    is 'all' the results of fit_all_models are returned.
+
+    If cancel_event (a threading.Event) is set during a Weibull fit, the fit
+    stops and CalculationCancelled is raised.
+
+    If fields is a list of result names, only those are included when the
+    results are output.  Secondary results such as mrse are calculated here
+    only if they are included, so leaving them out avoids the work.
     """
+    if model_settings.model == 'all':
+        results = fit_all_models(isopachs, model_settings, cancel_event)
+    else:
+        results = _fit_single_model(isopachs, model_settings, cancel_event)
+    select_fields(results, model_settings.model, fields)
+    calculate_fields(results, model_settings.model)
+    return results
+
+
+def _fit_single_model(isopachs, model_settings, cancel_event):
     params = model_settings.get_params()
     if model_settings.model == 'exponential':
         results = exponential.exponentialModelAnalysis(isopachs, *params)
     elif model_settings.model == 'power_law':
         results = power_law.powerLawModelAnalysis(isopachs, *params)
     elif model_settings.model == 'weibull':
-        results = weibull.weibullModelAnalysis(isopachs, *params)
+        results = weibull.weibullModelAnalysis(
+            isopachs, *params, cancelEvent=cancel_event,
+            telemetry=model_settings.wei_telemetry)
     return results
 
 
-def plot_results_figure(filename, results, model_settings, comments):
+def fit_all_models(isopachs, model_settings, cancel_event=None):
     """
-    Plot log thickness versus square root area plot, with results and
-    regression lines included.
+    ([list of Isopach], AshCalcModelSettings) -> dictionary of results.
 
-    Returns figure object for further changes.
-    """
-    volume = results['estimatedTotalVolume']
-    thickness_function = results['thicknessFunction']
-    sqrt_area = np.array([isopach.sqrtAreaKM
-                          for isopach in results['isopachs']])
-    thickness = np.array([isopach.thicknessM
-                          for isopach in results['isopachs']])
+    Fits every model to the isopachs, one after another.  The exponential
+    regression table only depends on the isopachs, so it is calculated once
+    and shared by the exponential fit and the two segment fit needed for the
+    power law's suggested proximal limit.  When the exponential model has two
+    segments its fit is used for both.
 
-    # Plot data
-    fig = plt.figure()
-    plt.semilogy(sqrt_area, thickness, 'x')
+    Returns a dictionary mapping each model name to its results, along with
+    'isopachs', 'mrseRanking' (model names ordered from best to worst fit) and
+    'bestModel'.
+    """
+    regression_table = exponential.calculateIsopachRegressionTable(isopachs)
+    results = {}
+    results['exponential'] = exponential.exponentialModelAnalysis(
+        isopachs, *model_settings.get_params('exponential'),
+        regressionTable=regression_table)
+
+    if model_settings.exp_segments == 2:
+        two_segment_results = results['exponential']
+    else:
+        try:
+            two_segment_results = exponential.exponentialModelAnalysis(
+                isopachs, 2, regressionTable=regression_table)
+        except ValueError:
+            # Too few isopachs, which the power law handles itself
+            two_segment_results = None
+    results['power_law'] = power_law.powerLawModelAnalysis(
+        isopachs, *model_settings.get_params('power_law'),
+        exponentialResults=two_segment_results)
+
+    results['weibull'] = weibull.weibullModelAnalysis(
+        isopachs, *model_settings.get_params('weibull'),
+        cancelEvent=cancel_event, telemetry=model_settings.wei_telemetry)
+
+    ranking = sorted(MODEL_NAMES, key=lambda model: results[model]['mrse'])
+    results.update({'isopachs': isopachs,
+                    'mrseRanking': ranking,
+                    'bestModel': ranking[0]})
+    return results
 
-    # Plot fitted curve
-    xmin, xmax = plt.xlim()
 
-    if model_settings.model == 'power_law':
-        model_sqrt_area = np.linspace(model_settings.pow_proximal_limit,
-                                      model_settings.pow_distal_limit)
-        # Divide by root of pi (see power_law.pi for details)
-        model_sqrt_area = model_sqrt_area * np.sqrt(np.pi)
+def select_fields(results, model, fields):
+    """
+    Set the result names to be included when the results are output.  If
+    fields is None, all are included.
+    """
+    if model == 'all':
+        for model_name in MODEL_NAMES:
+            if fields is None:
+                results[model_name].fields = None
+            else:
+                results[model_name].fields = [
+                    field for field in fields
+                    if field in ModelResults.fieldNames(model_name)]
     else:
-        model_sqrt_area = np.linspace(xmin, xmax)
+        results.fields = fields
+
+
+def calculate_fields(results, model):
+    """
+    Calculate the secondary results to be output, such as mrse, so that it is
+    done where the fit was rather than when the results are output, and so
+    that they are stored in the cache.  Returns True if any were calculated.
+    """
+    if model == 'all':
+        return any([results[model_name].calculateFields()
+                    for model_name in MODEL_NAMES])
+    return results.calculateFields()
 
-    model_thickness = [thickness_function(x) for x in model_sqrt_area]
-    plt.semilogy(model_sqrt_area, model_thickness, '-r')
 
-    # Label with axes, title and text model description
-    plt.xlabel('Square root of area (km)')
-    plt.ylabel('Thickness (m)')
-    title = '\n'.join(comments)
-    plt.title(title)
-    ax = plt.gca()
-    text = model_settings.get_as_text()
-    text += '\n\nVolume: {:.1f} km3'.format(volume)
-    plt.text(0.05, 0.05, text, transform=ax.transAxes)
+def remove_unserializable_results(results, model):
+    """
+    Return a dictionary of the results without the isopachs and thickness
+    functions, which cannot be converted to json.
+    """
+    if model == 'all':
+        all_results = {model_name: results[model_name].toDict()
+                       for model_name in MODEL_NAMES}
+        all_results.update({'mrseRanking': results['mrseRanking'],
+                            'bestModel': results['bestModel']})
+        return all_results
+    return results.toDict()
 
-    plt.savefig('{}_{}.png'.format(filename.replace('.csv', ''),
-                                   model_settings.model))
 
+def process_file(filename, model_settings, plot=False, cache=None,
+                 seed=None, fields=None):
+    """
+    Read the isopachs in filename, fit them and optionally plot the results.
+
+    If a ResultCache is given, results for identical isopachs, settings and
+    seed are loaded from it rather than refitted.
+
+    Any exception raised is caught and returned in the error field so that a
+    single bad file does not abort a batch.  The exception is
+    MemoryLimitExceeded, which is raised so that the batch stops.
+
+    :return FileResult namedtuple of filename, results, comments and error.
+    """
+    try:
+        with profiling.span('process_file', deposit=filename), \
+                memory.track(filename):
+            isopachs, comments = isopach.read_isopach_file(filename)
+            memory.checkpoint('read')
+
+            results = None
+            if cache is not None:
+                with profiling.span('cache_get'):
+                    key = cache.get_key(isopachs, model_settings, seed)
+                    results = cache.get(key)
+
+            if results is None:
+                if seed is not None:
+                    random.seed(seed)
+                results = fit_isopachs(isopachs, model_settings,
+                                       fields=fields)
+                if cache is not None:
+                    with profiling.span('cache_put'):
+                        cache.put(key, results)
+            else:
+                select_fields(results, model_settings.model, fields)
+                if calculate_fields(results, model_settings.model):
+                    # Store the newly calculated results for the next hit
+                    with profiling.span('cache_put'):
+                        cache.put(key, results)
+            memory.checkpoint('fit')
+
+            if plot:
+                plot_results_figure(filename, results, model_settings,
+                                    comments)
+                memory.checkpoint('plot')
+    except MemoryLimitExceeded:
+        raise
+    except Exception as e:
+        return FileResult(filename, None, None, e)
+    return FileResult(filename, results, comments, None)
+
+
+def process_file_in_worker(*args):
+    """
+    Run process_file in a worker process.  Returns the FileResult along with
+    the timing spans and memory records made, so they can be merged into the
+    parent's.  If the memory limit is exceeded the records are attached to
+    the exception, so the parent can still report them.
+    """
+    try:
+        result = process_file(*args)
+    except MemoryLimitExceeded as e:
+        e.spans = profiling.takeSpans()
+        e.records = memory.takeRecords()
+        raise
+    return result, profiling.takeSpans(), memory.takeRecords()
+
+
+def process_files(filelist, model_settings, plot=False, jobs=1,
+                  ordered=True, cache=None, seed=None, fields=None):
+    """
+    Generator that fits each file in filelist, yielding a FileResult for
+    each one.  If jobs is greater than 1 the files are fitted concurrently in
+    a pool of worker processes.  If ordered is False, results are yielded as
+    soon as they are complete rather than in the order of filelist.
+    """
+    if jobs < 1:
+        raise ValueError('Number of jobs must be at least 1')
+
+    if jobs == 1:
+        for filename in filelist:
+            yield process_file(filename, model_settings, plot, cache, seed,
+                               fields)
+        return
+
+    # Imported here as it is slow to import and only needed for batches
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=initialise_worker,
+                             initargs=(profiling.isEnabled(),
+                                       memory.isEnabled(),
+                                       memory.getLimit())) as executor:
+        futures = [executor.submit(process_file_in_worker, filename,
+                                   model_settings, plot, cache, seed, fields)
+                   for filename in filelist]
+        filenames = dict(zip(futures, filelist))
+        completed = futures if ordered else as_completed(futures)
+        for future in completed:
+            try:
+                result, spans, memory_records = future.result()
+                profiling.addSpans(spans)
+                memory.addRecords(memory_records)
+                yield result
+            except MemoryLimitExceeded as e:
+                profiling.addSpans(getattr(e, 'spans', []))
+                memory.addRecords(getattr(e, 'records', []))
+                # Stop the batch without starting the remaining files
+                for pending in futures:
+                    pending.cancel()
+                raise
+            except Exception as e:
+                # Only raised if the worker process itself failed
+                yield FileResult(filenames[future], None, None, e)
+
+
+def initialise_worker(profile=False, track_memory=False, memory_limit=None):
+    """
+    Reseed the random number generator in each worker process, as forked
+    workers would otherwise share the parent's state and so produce identical
+    Weibull runs.  If profile is True, timing spans are recorded, and if
+    track_memory is True, memory is tracked with the given limit in bytes.
+    """
+    random.seed()
+    if profile:
+        profiling.enable()
+    if track_memory:
+        memory.enable(memory_limit)
 
+
+def print_error(filename, error):
+    """
+    Print a message describing why a file could not be processed.
+    """
+    print('Error processing {}: {}'.format(filename, error), file=sys.stderr)
+
+
+@profiling.timed('plot')
+def plot_results_figure(filename, results, model_settings, comments):
+    """
+    Plot log thickness versus square root area plot, with the fitted curves
+    included, as *filename_model.png*.  See plotting.plot_results_figure.
+    """
+    # Imported here as matplotlib is slow to import and is only needed when
+    # plotting.
+    from command_line import plotting
+    return plotting.plot_results_figure(filename, results, model_settings,
+                                        comments)
+
+
+@profiling.timed('print_output')
 def print_output(filename, results, model_settings, comments):
     """
     Format output and print to screen.
@@ -330,24 +744,101 @@ def print_output(filename, results, model_settings, comments):
     print(format_results_by_model(results, model_settings.model))
 
 
-def print_json_output(filename, results, model_settings, comments):
+def get_json_record(filename, results, model_settings, comments):
     """
-    Format output as json and print to screen.
+    Return dictionary of results, filename, comments and model settings that
+    can be serialized to json.
     """
-    all_results = results.copy()
-
-    # Remove results that do not serialize to json
-    for key in ['isopachs', 'thicknessFunction']:
-        all_results.pop(key)
-
+    all_results = remove_unserializable_results(results, model_settings.model)
     all_results.update({'filename': filename,
                         'comments': comments})
     all_results.update(model_settings.get_as_dict())
+    return all_results
 
+
+@profiling.timed('print_json_output')
+def print_json_output(filename, results, model_settings, comments):
+    """
+    Format output as json and print to screen.
+    """
+    all_results = get_json_record(filename, results, model_settings, comments)
     print(json.dumps(all_results, sort_keys=True, indent=4,
           separators=(',', ': ')))
 
 
+@profiling.timed('print_jsonl_output')
+def print_jsonl_output(filename, results, model_settings, comments):
+    """
+    Print output as a single line of compact json and flush it, so that the
+    records can be read while a batch is still running.
+    """
+    all_results = get_json_record(filename, results, model_settings, comments)
+    print(json.dumps(all_results, separators=(',', ':')), flush=True)
+
+
+def print_jsonl_error(filename, error):
+    """
+    Print a json line recording that a file could not be processed.
+    """
+    print(json.dumps({'filename': filename, 'error': str(error)},
+                     separators=(',', ':')), flush=True)
+
+
+def print_csv_header():
+    """
+    Print the header row of the csv summary table.
+    """
+    csv.writer(sys.stdout).writerow(CSV_FIELDS)
+    sys.stdout.flush()
+
+
+@profiling.timed('print_csv_output')
+def print_csv_output(filename, results, model_settings):
+    """
+    Print one csv summary row per fitted model and flush them.
+    """
+    writer = csv.DictWriter(sys.stdout, CSV_FIELDS, extrasaction='ignore')
+    writer.writerows(get_csv_rows(filename, results, model_settings))
+    sys.stdout.flush()
+
+
+def get_csv_rows(filename, results, model_settings):
+    """
+    Return a list of csv summary rows, as dictionaries, one per fitted model.
+    """
+    rows = []
+    for model in model_settings.get_models():
+        if model_settings.model == 'all':
+            model_results = results[model]
+        else:
+            model_results = results
+        rows.append(get_csv_row(filename, model, model_results))
+    return rows
+
+
+def get_csv_row(filename, model, model_results):
+    """
+    Return the csv summary row, as a dictionary, for the results of one model.
+    """
+    row = {'filename': filename, 'model': model}
+    values = model_results.toDict()
+    for field in CSV_FIELDS[2:-1]:
+        value = values.get(field, '')
+        if isinstance(value, list):
+            value = ' '.join(str(v) for v in value)
+        row[field] = value
+    return row
+
+
+def print_csv_error(filename, error):
+    """
+    Print a csv summary row recording that a file could not be processed.
+    """
+    csv.DictWriter(sys.stdout, CSV_FIELDS).writerow(
+        {'filename': filename, 'error': str(error)})
+    sys.stdout.flush()
+
+
 def format_results_by_model(results, model):
     """
     Format results dictionary to print different calculated model parameters,
@@ -356,7 +847,14 @@ def format_results_by_model(results, model):
     :return Multiline string of model parameter name: values.
     """
     text = ''
-    if model == 'exponential':
+    if model == 'all':
+        for model_name in MODEL_NAMES:
+            text += '{}:\n'.format(model_name)
+            text += format_results_by_model(results[model_name], model_name)
+        text += 'MRSE ranking: {}\n'.format(', '.join(results['mrseRanking']))
+        text += 'Best model: {}\n'.format(results['bestModel'])
+        return text
+    elif model == 'exponential':
         for i in range(results['numberOfSegments']):
             text += 'Segment {} Bt: {:.3f}\n'.format(
                     i, results['segmentBts'][i])
@@ -0,0 +1,76 @@
+# -- coding: utf-8 --
+"""
+Synthetic deposit generation.
+
+Writes catalogs of deposits generated from known model parameters, either as
+isopach files that can be fitted by ashcalc.py or as a single npz file of
+flat arrays for batch fitting.  See core.synthetic.
+"""
+import argparse
+
+from core import synthetic
+
+
+def setup_generate_parser():
+    parser = argparse.ArgumentParser(
+        prog='ashcalc.py generate',
+        description='Generate synthetic deposits with known volumes.')
+    parser.add_argument(
+        'output', type=str,
+        help='Directory to write isopach files to, or the npz file to write')
+    parser.add_argument(
+        '--deposits', type=int, default=10,
+        help='Number of deposits to generate')
+    parser.add_argument(
+        '--model', type=str, default='all',
+        choices=synthetic.MODEL_NAMES + ['all'],
+        help='Model the deposits follow.  "all" chooses a model at random '
+             'for each deposit')
+    parser.add_argument(
+        '--isopachs', type=int, nargs='+', default=[5, 20],
+        metavar='COUNT',
+        help='Number of isopachs in each deposit, or the minimum and maximum '
+             'number')
+    parser.add_argument(
+        '--segments', type=int, default=1,
+        help='Number of segments of exponential deposits')
+    parser.add_argument(
+        '--noise', type=str, default='lognormal',
+        choices=synthetic.NOISE_MODELS,
+        help='How noise is added to the thicknesses')
+    parser.add_argument(
+        '--noise_level', type=float, default=0.05,
+        help='Relative size of the noise')
+    parser.add_argument(
+        '--spacing', type=str, default='log', choices=synthetic.SPACINGS,
+        help='How the isopachs are spaced')
+    parser.add_argument(
+        '--format', type=str, default='csv', choices=['csv', 'npz'],
+        help='Write an isopach file per deposit, or a single npz file')
+    parser.add_argument(
+        '--seed', type=int,
+        help='Seed for the random number generator, so the same deposits are '
+             'generated')
+    return parser
+
+
+def main(argv):
+    parser = setup_generate_parser()
+    args = parser.parse_args(argv)
+    if len(args.isopachs) > 2:
+        parser.error('--isopachs takes a count or a minimum and maximum')
+    minimum, maximum = args.isopachs[0], args.isopachs[-1]
+    if minimum < 2 or maximum < minimum:
+        parser.error('Deposits need at least 2 isopachs')
+
+    models = synthetic.MODEL_NAMES if args.model == 'all' else [args.model]
+    deposits = synthetic.generateCatalog(
+        args.deposits, models=models, numberOfIsopachs=(minimum, maximum),
+        seed=args.seed, noise=args.noise, noiseLevel=args.noise_level,
+        spacing=args.spacing, numberOfSegments=args.segments)
+
+    if args.format == 'npz':
+        synthetic.writeCatalogNpz(args.output, deposits)
+    else:
+        synthetic.writeCatalogFiles(args.output, deposits)
+    print('Wrote {} deposits to {}'.format(len(deposits), args.output))
@@ -0,0 +1,156 @@
+# -- coding: utf-8 --
+"""
+Headless plotting of fitted results to image files.
+
+Figures are drawn with the Agg backend directly, without the pyplot state
+machine, so plotting works in worker processes and does not leak figures
+across a long batch.  A single figure is created per process and reused for
+every plot.
+"""
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+from command_line.cli import MODEL_NAMES, remove_unserializable_results
+
+MODEL_STYLES = {'exponential': '-r', 'power_law': '-g', 'weibull': '-b'}
+
+# Key under which the hash of the plotted inputs is stored in the png metadata
+PNG_KEY = 'AshCalcKey'
+
+_figure = None
+
+
+def plot_results_figure(filename, results, model_settings, comments):
+    """
+    Plot log thickness versus square root area plot, with the fitted curves
+    included, and save it as *filename_model.png*.
+
+    If the image already exists and was drawn from identical inputs it is not
+    redrawn.
+
+    :return path of the image.
+    """
+    path = '{}_{}.png'.format(filename.replace('.csv', ''),
+                              model_settings.model)
+    key = get_plot_key(results, model_settings, comments)
+    if os.path.exists(path) and read_png_text(path).get(PNG_KEY) == key:
+        return path
+
+    figure = _get_figure()
+    axes = figure.axes[0]
+    axes.clear()
+
+    sqrt_area = np.array([isopach.sqrtAreaKM
+                          for isopach in results['isopachs']])
+    thickness = np.array([isopach.thicknessM
+                          for isopach in results['isopachs']])
+
+    # Plot data
+    axes.semilogy(sqrt_area, thickness, 'x')
+
+    # Plot fitted curves
+    xmin, xmax = axes.get_xlim()
+    text = model_settings.get_as_text()
+    if model_settings.model == 'all':
+        text += '\n'
+        for model in MODEL_NAMES:
+            _plot_model_curve(axes, model, results[model], model_settings,
+                              xmin, xmax)
+            text += '\n{} volume: {:.1f} km3'.format(
+                model, results[model]['estimatedTotalVolume'])
+        axes.legend(['data'] + MODEL_NAMES)
+    else:
+        _plot_model_curve(axes, model_settings.model, results,
+                          model_settings, xmin, xmax)
+        text += '\n\nVolume: {:.1f} km3'.format(
+            results['estimatedTotalVolume'])
+
+    # Label with axes, title and text model description
+    axes.set_xlabel('Square root of area (km)')
+    axes.set_ylabel('Thickness (m)')
+    axes.set_title('\n'.join(comments))
+    axes.text(0.05, 0.05, text, transform=axes.transAxes)
+
+    figure.savefig(path, metadata={PNG_KEY: key})
+    return path
+
+
+def _get_figure():
+    """
+    Return the figure used for plotting, creating it the first time this is
+    called in a process.
+    """
+    global _figure
+    if _figure is None:
+        # Imported here as matplotlib is slow to import and is only needed
+        # when plotting.
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        _figure = Figure()
+        FigureCanvasAgg(_figure)
+        _figure.add_subplot(1, 1, 1)
+    return _figure
+
+
+def _plot_model_curve(axes, model, results, model_settings, xmin, xmax):
+    """
+    Plot the thickness curve of a single model's results on the axes.  Points
+    outside the domain of the model are not drawn.
+    """
+    if model == 'power_law':
+        model_sqrt_area = np.linspace(model_settings.pow_proximal_limit,
+                                      model_settings.pow_distal_limit)
+        # Divide by root of pi (see power_law.pi for details)
+        model_sqrt_area = model_sqrt_area * np.sqrt(np.pi)
+    else:
+        model_sqrt_area = np.linspace(max(xmin, 0), xmax)
+
+    model_thickness = results.thickness(model_sqrt_area)
+    axes.semilogy(model_sqrt_area, model_thickness, MODEL_STYLES[model])
+
+
+def get_plot_key(results, model_settings, comments):
+    """
+    Return hex digest identifying the inputs to a plot.
+    """
+    data = {'results': remove_unserializable_results(results,
+                                                     model_settings.model),
+            'isopachs': [[isopach.thicknessM, isopach.sqrtAreaKM]
+                         for isopach in results['isopachs']],
+            'settings': model_settings.get_as_dict(),
+            'comments': comments}
+    encoded = json.dumps(data, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def read_png_text(path):
+    """
+    Return dictionary of the uncompressed text metadata stored in a png file.
+    An empty dictionary is returned if the file cannot be read.
+    """
+    text = {}
+    try:
+        with open(path, 'rb') as f:
+            if f.read(8) != b'\x89PNG\r\n\x1a\n':
+                return text
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    break
+                length, chunk_type = struct.unpack('>I4s', header)
+                if chunk_type == b'IDAT' or chunk_type == b'IEND':
+                    # Text metadata is written before the image data
+                    break
+                data = f.read(length)
+                f.read(4)  # CRC
+                if chunk_type == b'tEXt':
+                    keyword, _, value = data.partition(b'\x00')
+                    text[keyword.decode('latin-1')] = value.decode('latin-1')
+    except OSError:
+        pass
+    return text
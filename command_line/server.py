@@ -0,0 +1,234 @@
+# -- coding: utf-8 --
+"""
+Local fitting service.
+
+Keeps a pool of warm worker processes and accepts fit requests over HTTP on a
+local port or Unix socket, so that other tools do not pay the cost of starting
+a new interpreter for every deposit.
+
+POST /fit with a json body of the form
+
+    {"isopachs": [[thicknessM, sqrtAreaKM], ...],
+     "settings": {"model": "power_law", "pow_proximal_limit": 1.0, ...},
+     "filename": "optional name", "comments": ["optional"], "seed": 1}
+
+returns the same json as print_json_output.  The settings take the same names
+as ModelSettings.get_as_dict and any that are not given take their default
+values.  GET /health returns the server status.
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import socketserver
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from command_line import cli
+from core.isopach import Isopach
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_QUEUE_SIZE = 16
+
+# Largest request body accepted, in bytes
+MAX_REQUEST_SIZE = 10 * 1024 * 1024
+
+
+def setup_serve_parser():
+    parser = argparse.ArgumentParser(
+        prog='ashcalc.py serve',
+        description='Run a local service that fits isopach data sent as json '
+                    'over HTTP.')
+    parser.add_argument(
+        '--host', type=str, default=DEFAULT_HOST,
+        help='Address to listen on')
+    parser.add_argument(
+        '--port', type=int, default=DEFAULT_PORT,
+        help='Port to listen on')
+    parser.add_argument(
+        '--socket', type=str,
+        help='Listen on this Unix socket path instead of a port')
+    parser.add_argument(
+        '--workers', type=int, default=os.cpu_count() or 1,
+        help='Number of worker processes')
+    parser.add_argument(
+        '--queue_size', type=int, default=DEFAULT_QUEUE_SIZE,
+        help='Number of requests that may wait for a free worker before new '
+             'requests are refused')
+    return parser
+
+
+def fit_request(request):
+    """
+    Fit the isopachs in a decoded request and return the json record of the
+    results.  Run in the worker processes.
+    """
+    if not isinstance(request, dict) or 'isopachs' not in request:
+        raise ValueError('Request must be a json object containing isopachs')
+
+    isopachs = [Isopach(float(thicknessM), float(sqrtAreaKM))
+                for thicknessM, sqrtAreaKM in request['isopachs']]
+    model_settings = cli.ModelSettings()
+    model_settings.set_from_dict(request.get('settings', {}))
+
+    seed = request.get('seed')
+    if seed is not None:
+        random.seed(seed)
+    results = cli.fit_isopachs(isopachs, model_settings)
+    return cli.get_json_record(request.get('filename'), results,
+                               model_settings, request.get('comments', []))
+
+
+def _initialise_service_worker():
+    """
+    Prepare a worker process.  Interrupts are ignored as Ctrl-C is sent to
+    the whole process group, and the main process shuts the workers down.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    cli.initialise_worker()
+
+
+def _warm_up():
+    """
+    Fit a small deposit so that a worker's imports and caches are ready before
+    the first request arrives.
+    """
+    isopachs = [Isopach(1.0, 10.0), Isopach(0.5, 20.0), Isopach(0.1, 50.0),
+                Isopach(0.05, 80.0)]
+    cli.fit_isopachs(isopachs, cli.ModelSettings())
+    return os.getpid()
+
+
+class FittingService(object):
+    """
+    Pool of worker processes with a bounded number of outstanding requests.
+    """
+    def __init__(self, workers, queue_size):
+        if workers < 1:
+            raise ValueError('Number of workers must be at least 1')
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=_initialise_service_worker)
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self.workers = workers
+        self.queue_size = queue_size
+
+        warm_ups = [self._executor.submit(_warm_up) for _ in range(workers)]
+        for future in warm_ups:
+            future.result()
+
+    def fit(self, request):
+        """
+        Fit a decoded request in a worker process and return the json record.
+        Returns None without fitting if too many requests are outstanding.
+        """
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            return self._executor.submit(fit_request, request).result()
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+
+class FitRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles requests to the server's FittingService.
+    """
+    def do_GET(self):
+        if self.path != '/health':
+            self._send_json(404, {'error': 'Not found'})
+            return
+        service = self.server.service
+        self._send_json(200, {'status': 'ok',
+                              'workers': service.workers,
+                              'queue_size': service.queue_size})
+
+    def do_POST(self):
+        if self.path != '/fit':
+            self._send_json(404, {'error': 'Not found'})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        if length > MAX_REQUEST_SIZE:
+            self._send_json(413, {'error': 'Request too large'})
+            return
+        try:
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError as e:
+            self._send_json(400, {'error': 'Invalid json: {}'.format(e)})
+            return
+
+        try:
+            record = self.server.service.fit(request)
+        except (ValueError, TypeError, KeyError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+
+        if record is None:
+            self._send_json(503, {'error': 'Server busy'})
+        else:
+            self._send_json(200, record)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return self.server.server_address
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, sort_keys=True, indent=4,
+                          separators=(',', ': ')).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                  socket_path=None):
+    """
+    Return a threaded HTTP server passing requests to the FittingService,
+    listening on either the host and port or the Unix socket path.
+    """
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, FitRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), FitRequestHandler)
+    server.service = service
+    return server
+
+
+def main(argv):
+    args = setup_serve_parser().parse_args(argv)
+    service = FittingService(args.workers, args.queue_size)
+    server = create_server(service, args.host, args.port, args.socket)
+    if args.socket is not None:
+        print('Serving on {}'.format(args.socket), flush=True)
+    else:
+        print('Serving on http://{}:{}'.format(*server.server_address[:2]),
+              flush=True)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
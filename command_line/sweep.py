@@ -0,0 +1,250 @@
+# -- coding: utf-8 --
+"""
+Parameter sweeps.
+
+Fits each deposit under many model settings and writes one tidy csv table,
+with a row per deposit, scenario and model.  The scenarios are read from a
+json file of the form
+
+    {"base": {"model": "exponential"},
+     "grid": {"exp_segments": [1, 2, 3]},
+     "scenarios": [{"name": "wide", "model": "power_law",
+                    "pow_distal_limit": 500}]}
+
+Every combination of the values in "grid" is a scenario, as is every entry in
+"scenarios".  Each is applied on top of the "base" settings, which default to
+the usual ModelSettings.  All three sections are optional.  The settings take
+the same names as ModelSettings.get_as_dict.
+
+Work that only depends on the deposit, such as reading the file and the
+exponential regression table, is shared by all the scenarios, as are fits of
+the same model with the same settings.
+"""
+import argparse
+import csv
+import itertools
+import json
+import math
+import random
+import sys
+
+from command_line import cli
+from core import isopach
+from core.models import exponential, power_law, weibull
+
+SETTINGS_FIELDS = ['exp_segments', 'pow_proximal_limit', 'pow_distal_limit',
+                   'wei_number_of_runs', 'wei_iterations_per_run',
+                   'wei_lambda_lower_bound', 'wei_lambda_upper_bound',
+                   'wei_k_lower_bound', 'wei_k_upper_bound']
+
+SWEEP_FIELDS = (['scenario', 'filename'] + SETTINGS_FIELDS +
+                cli.CSV_FIELDS[1:])
+
+
+def setup_sweep_parser():
+    parser = argparse.ArgumentParser(
+        prog='ashcalc.py sweep',
+        description='Fit isopach data under every combination of settings in '
+                    'a scenario file and write a csv table of the results.')
+    parser.add_argument(
+        'scenario_file', type=str,
+        help='json file describing the scenarios')
+    parser.add_argument(
+        'filelist', nargs='+', type=str,
+        help='List of isopach files to fit')
+    parser.add_argument(
+        '--jobs', type=int, default=1,
+        help='Number of worker processes')
+    parser.add_argument(
+        '--output', type=str,
+        help='Write the table to this file rather than standard output')
+    parser.add_argument(
+        '--seed', type=int,
+        help='Seed the random number generator before each Weibull fit, so '
+             'every scenario is reproducible')
+    return parser
+
+
+def read_scenarios(filename):
+    """
+    Read a scenario file and return its expanded list of scenarios.
+    """
+    with open(filename) as scenario_file:
+        return expand_scenarios(json.load(scenario_file))
+
+
+def expand_scenarios(spec):
+    """
+    Return a list of (name, settings dictionary) pairs for each scenario
+    described by spec.  The settings are checked, so that mistakes are found
+    before any fitting is done.
+    """
+    unknown = set(spec) - {'base', 'grid', 'scenarios'}
+    if unknown:
+        raise ValueError('Unknown scenario file sections: {}'.format(
+                         ', '.join(sorted(unknown))))
+    base = spec.get('base', {})
+    grid = spec.get('grid', {})
+    listed = spec.get('scenarios', [])
+
+    scenarios = []
+    if grid or not listed:
+        keys = sorted(grid)
+        for values in itertools.product(*(grid[key] for key in keys)):
+            settings = dict(zip(keys, values))
+            name = ','.join('{}={}'.format(key, value)
+                            for key, value in settings.items())
+            scenarios.append((name or 'base', settings))
+    for i, entry in enumerate(listed):
+        settings = dict(entry)
+        name = str(settings.pop('name', 'scenario_{}'.format(i)))
+        scenarios.append((name, settings))
+
+    expanded = []
+    for name, settings in scenarios:
+        values = dict(base)
+        values.update(settings)
+        model_settings = cli.ModelSettings()
+        try:
+            model_settings.set_from_dict(values)
+        except (ValueError, TypeError) as e:
+            raise ValueError('Scenario {}: {}'.format(name, e))
+        expanded.append((name, values))
+    return expanded
+
+
+class Deposit(object):
+    """
+    The isopachs of one file, along with the fits already made to them, so
+    that they can be shared between scenarios.  Weibull fits are random and so
+    are only shared when seeded.
+    """
+    def __init__(self, filename, seed=None):
+        self.filename = filename
+        self.seed = seed
+        self.isopachs, self.comments = isopach.read_isopach_file(filename)
+        self._regression_table = None
+        self._fits = {}
+
+    def fit(self, model, model_settings):
+        """
+        Return the results of fitting model with model_settings.
+        """
+        params = model_settings.get_params(model)
+        key = (model, repr(params))
+        if key not in self._fits:
+            if model == 'weibull' and self.seed is None:
+                return self._fit(model, params)
+            self._fits[key] = self._fit(model, params)
+        return self._fits[key]
+
+    def _fit(self, model, params):
+        if model == 'exponential':
+            if self._regression_table is None:
+                self._regression_table = \
+                    exponential.calculateIsopachRegressionTable(self.isopachs)
+            return exponential.exponentialModelAnalysis(
+                self.isopachs, *params,
+                regressionTable=self._regression_table)
+        elif model == 'power_law':
+            try:
+                two_segment_results = self.fit('exponential',
+                                               self._two_segment_settings)
+            except ValueError:
+                two_segment_results = None
+            return power_law.powerLawModelAnalysis(
+                self.isopachs, *params,
+                exponentialResults=two_segment_results)
+        elif model == 'weibull':
+            if self.seed is not None:
+                random.seed(self.seed)
+            return weibull.weibullModelAnalysis(self.isopachs, *params)
+
+    @property
+    def _two_segment_settings(self):
+        model_settings = cli.ModelSettings()
+        model_settings.set_exponential_parameters(2)
+        return model_settings
+
+
+def run_scenarios(filename, scenarios, seed=None):
+    """
+    Fit the deposit in filename under each of the (name, settings) scenarios
+    and return a list of table rows.  Errors are recorded in the rows rather
+    than raised, so one bad scenario does not abort the sweep.
+    """
+    try:
+        deposit = Deposit(filename, seed)
+    except Exception as e:
+        return [{'scenario': name, 'filename': filename, 'error': str(e)}
+                for name, _ in scenarios]
+
+    rows = []
+    for name, values in scenarios:
+        model_settings = cli.ModelSettings()
+        model_settings.set_from_dict(values)
+        settings_row = {'scenario': name, 'filename': filename}
+        settings_row.update(model_settings.get_as_dict())
+        for model in model_settings.get_models():
+            try:
+                results = deposit.fit(model, model_settings)
+                row = cli.get_csv_row(filename, model, results)
+            except Exception as e:
+                row = {'model': model, 'error': str(e)}
+            row.update(settings_row)
+            rows.append(row)
+    return rows
+
+
+def run_sweep(filelist, scenarios, jobs=1, seed=None):
+    """
+    Generator that yields the lists of table rows for each file, in order.
+    If jobs is greater than 1, the work is shared between a pool of worker
+    processes.  When there are fewer files than jobs, the scenarios for each
+    file are split into chunks so that every worker is used.
+    """
+    if jobs < 1:
+        raise ValueError('Number of jobs must be at least 1')
+
+    if jobs == 1:
+        for filename in filelist:
+            yield run_scenarios(filename, scenarios, seed)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    number_of_chunks = min(len(scenarios),
+                           max(1, math.ceil(jobs / len(filelist))))
+    chunk_size = math.ceil(len(scenarios) / number_of_chunks)
+    chunks = [scenarios[i:i + chunk_size]
+              for i in range(0, len(scenarios), chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=cli.initialise_worker) as executor:
+        futures = [executor.submit(run_scenarios, filename, chunk, seed)
+                   for filename in filelist for chunk in chunks]
+        for future in futures:
+            yield future.result()
+
+
+def main(argv):
+    parser = setup_sweep_parser()
+    args = parser.parse_args(argv)
+    try:
+        scenarios = read_scenarios(args.scenario_file)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = csv.DictWriter(output, SWEEP_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        failures = 0
+        for rows in run_sweep(args.filelist, scenarios, args.jobs, args.seed):
+            writer.writerows(rows)
+            output.flush()
+            failures += sum(1 for row in rows if row.get('error'))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 1 if failures else 0
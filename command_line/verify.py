@@ -0,0 +1,104 @@
+# -- coding: utf-8 --
+"""
+Numerical equivalence checks.
+
+Runs each fast engine and the reference models it replaces over generated
+deposits, and any isopach files or npz catalogs given, then reports the
+deviation of the results and the speedup.  Exits with a non-zero status if
+any engine does not match within its tolerance.  See core.equivalence.
+"""
+import argparse
+import json
+import sys
+
+from command_line import cli
+from core import equivalence, isopach, synthetic
+
+
+def setup_verify_parser():
+    parser = argparse.ArgumentParser(
+        prog='ashcalc.py verify',
+        description='Check that the fast engines reproduce the reference '
+                    'models within tolerance.')
+    parser.add_argument(
+        'filelist', nargs='*', type=str,
+        help='Isopach files or npz catalogs to check, as well as the '
+             'generated deposits')
+    parser.add_argument(
+        '--engine', type=str, action='append',
+        choices=list(equivalence.ENGINES),
+        help='Engine to check.  May be repeated.  By default all are checked')
+    parser.add_argument(
+        '--deposits', type=int, default=100,
+        help='Number of synthetic deposits to generate')
+    parser.add_argument(
+        '--isopachs', type=int, nargs=2, default=[6, 20],
+        metavar=('MIN', 'MAX'),
+        help='Range of the number of isopachs in the generated deposits')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Seed for the generated deposits')
+    parser.add_argument(
+        '--runs', type=int,
+        help='Number of runs of the Weibull engines')
+    parser.add_argument(
+        '--iterations_per_run', type=int,
+        help='Number of iterations per run of the Weibull engines')
+    parser.add_argument(
+        '--json', action='store_true',
+        help='Print the reports as json')
+    return parser
+
+
+def load_deposits(filelist):
+    """
+    Return a list of the deposits, each a list of Isopachs, in the isopach
+    files and npz catalogs in filelist.
+    """
+    deposits = []
+    for filename in filelist:
+        if filename.endswith('.npz'):
+            deposits += [deposit.isopachs for deposit in
+                         synthetic.readCatalogNpz(filename)]
+        else:
+            deposits.append(isopach.read_isopach_file(filename)[0])
+    return deposits
+
+
+def get_engine_settings(args):
+    """
+    Return the settings used by the engines, the defaults of ModelSettings
+    unless given on the command line.
+    """
+    model_settings = cli.ModelSettings()
+    proximal_limit, distal_limit = model_settings.get_params('power_law')
+    runs, iterations, limits = model_settings.get_params('weibull')
+    return {'proximalLimitKM': proximal_limit,
+            'distalLimitKM': distal_limit,
+            'numberOfRuns': args.runs or runs,
+            'iterationsPerRun': args.iterations_per_run or iterations,
+            'limits': limits}
+
+
+def main(argv):
+    args = setup_verify_parser().parse_args(argv)
+
+    deposits = [deposit.isopachs for deposit in synthetic.generateCatalog(
+        args.deposits, numberOfIsopachs=tuple(args.isopachs),
+        seed=args.seed)]
+    deposits += load_deposits(args.filelist)
+    settings = get_engine_settings(args)
+
+    reports = []
+    for name in args.engine or equivalence.ENGINES:
+        report = equivalence.compareEngine(equivalence.ENGINES[name],
+                                           deposits, settings)
+        reports.append(report)
+        if not args.json:
+            print(equivalence.formatReport(report), flush=True)
+
+    if args.json:
+        json.dump([equivalence.reportToDict(report) for report in reports],
+                  sys.stdout, indent=2)
+        print()
+    return 0 if all(report.passed for report in reports) else 1
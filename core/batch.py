@@ -0,0 +1,293 @@
+'''
+Vectorised fitting of many deposits at once.
+
+Deposits are given as flat arrays of the isopach data for every deposit,
+along with an array of offsets: the isopachs of deposit i are at indices
+offsets[i] to offsets[i+1]. This allows the single segment exponential and
+power law models, which are linear regressions, to be fitted to all the
+deposits with a few numpy calls rather than a Python call per deposit.
+
+The Weibull model is fitted by annealing a chain per run per deposit
+simultaneously, with the data padded into 2D arrays, so the cost of each
+Python iteration is shared by the whole batch.
+'''
+
+import random
+
+import numpy as np
+
+from core.exceptions import CalculationCancelled
+from core.models.power_law import calculatePowerLawVolume
+from core.models.weibull import calculateWeibullVolume
+
+SQRT_PI = np.sqrt(np.pi)
+
+
+def flattenDeposits(deposits):
+    """
+    Converts a list of deposits, each a list of Isopachs, into the flat
+    (thicknessesM, sqrtAreasKM, offsets) arrays used by the batch functions.
+    """
+    counts = [len(isopachs) for isopachs in deposits]
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(int)
+    thicknessesM = np.array([isopach.thicknessM for isopachs in deposits for isopach in isopachs], dtype=float)
+    sqrtAreasKM = np.array([isopach.sqrtAreaKM for isopachs in deposits for isopach in isopachs], dtype=float)
+    return thicknessesM, sqrtAreasKM, offsets
+
+
+def _checkOffsets(values, offsets):
+    offsets = np.asarray(offsets, dtype=int)
+    if offsets.ndim != 1 or len(offsets) < 2 or offsets[0] != 0 or offsets[-1] != len(values):
+        raise ValueError("Offsets must start at 0 and end at the number of isopachs")
+    counts = np.diff(offsets)
+    if np.any(counts < 2):
+        raise ValueError("Each deposit must have at least 2 isopachs")
+    return offsets, counts
+
+
+def segmentedMean(values, offsets, counts):
+    """ Returns the mean of values for each deposit """
+    return np.add.reduceat(values, offsets[:-1])/counts
+
+
+def batchLinearRegression(xs, ys, offsets):
+    """
+    Calculates the least squares regression line through the points of each deposit
+    
+    Returns
+    slopes:array, intercepts:array -- the gradient and intercept of each deposit's line
+    """
+    xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+    offsets, counts = _checkOffsets(xs, offsets)
+    
+    xMeans = segmentedMean(xs, offsets, counts)
+    yMeans = segmentedMean(ys, offsets, counts)
+    xDeviations = xs - np.repeat(xMeans, counts)
+    yDeviations = ys - np.repeat(yMeans, counts)
+    
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        slopes = (np.add.reduceat(xDeviations*yDeviations, offsets[:-1])
+                  / np.add.reduceat(xDeviations*xDeviations, offsets[:-1]))
+    intercepts = yMeans - slopes*xMeans
+    return slopes, intercepts
+
+
+def _batchMRSE(predictedThicknessesM, thicknessesM, offsets, counts):
+    relativeSquaredErrors = ((predictedThicknessesM-thicknessesM)/thicknessesM)**2
+    return segmentedMean(relativeSquaredErrors, offsets, counts)
+
+
+def batchExponentialModelAnalysis(thicknessesM, sqrtAreasKM, offsets):
+    """
+    Fits a single segment exponential model to each deposit. Equivalent to
+    calling exponentialModelAnalysis(isopachs, 1) on each deposit.
+    
+    Model: T(x) = c*exp(-m*x)
+    
+    Returns
+    A dictionary with the following key-value mapping, each value an array with an
+    entry per deposit:
+    
+        dict["estimatedTotalVolume"]  --  the estimated total volume of the deposit.
+        dict["coefficient"]           --  estimated coefficient, c.
+        dict["exponent"]              --  estimated exponent, m.
+        dict["bt"]                    --  estimated half-thickness distance.
+        dict["mrse"]                  --  the mean relative squared error of the model.
+    """
+    thicknessesM = np.asarray(thicknessesM, dtype=float)
+    sqrtAreasKM = np.asarray(sqrtAreasKM, dtype=float)
+    offsets, counts = _checkOffsets(thicknessesM, offsets)
+    
+    slopes, intercepts = batchLinearRegression(sqrtAreasKM, np.log(thicknessesM), offsets)
+    coefficients = np.exp(intercepts)
+    exponents = -slopes
+    
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        # calculateExponentialSegmentVolume between 0 and infinity
+        volumes = (2*coefficients)/(1000*exponents*exponents)
+        bts = np.log(2)/(exponents*SQRT_PI)
+        predicted = np.repeat(coefficients, counts)*np.exp(-np.repeat(exponents, counts)*sqrtAreasKM)
+    
+    return {"estimatedTotalVolume" : volumes,
+            "coefficient" : coefficients,
+            "exponent" : exponents,
+            "bt" : bts,
+            "mrse" : _batchMRSE(predicted, thicknessesM, offsets, counts)}
+
+
+def batchPowerLawModelAnalysis(thicknessesM, sqrtAreasKM, offsets, proximalLimitKM, distalLimitKM):
+    """
+    Fits a power law model to each deposit. Equivalent to calling
+    powerLawModelAnalysis(isopachs, proximalLimitKM, distalLimitKM) on each deposit,
+    except that the suggested proximal limit is not calculated and, rather than
+    raising an error, the mrse is nan for deposits with isopachs outside the limits
+    of integration.
+    
+    Model: T(x) = c*x^(-m)
+    
+    Returns
+    A dictionary with the following key-value mapping, each value an array with an
+    entry per deposit:
+    
+        dict["estimatedTotalVolume"]  --  the estimated total volume of the deposit.
+        dict["coefficient"]           --  estimated coefficient, c.
+        dict["exponent"]              --  estimated exponent, m.
+        dict["mrse"]                  --  the mean relative squared error of the model.
+    """
+    thicknessesM = np.asarray(thicknessesM, dtype=float)
+    sqrtAreasKM = np.asarray(sqrtAreasKM, dtype=float)
+    offsets, counts = _checkOffsets(thicknessesM, offsets)
+    
+    slopes, intercepts = batchLinearRegression(np.log(sqrtAreasKM), np.log(thicknessesM), offsets)
+    coefficients = np.exp(intercepts)
+    exponents = -slopes
+    
+    proximalLimitSqrtAreaKM = proximalLimitKM*SQRT_PI
+    distalLimitSqrtAreaKM = distalLimitKM*SQRT_PI
+    
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        volumes = calculatePowerLawVolume(coefficients, exponents, proximalLimitSqrtAreaKM, distalLimitSqrtAreaKM)
+        predicted = np.repeat(coefficients, counts)*sqrtAreasKM**-np.repeat(exponents, counts)
+    
+    outOfRange = (sqrtAreasKM < proximalLimitSqrtAreaKM) | (sqrtAreasKM > distalLimitSqrtAreaKM)
+    predicted[outOfRange] = np.nan
+    
+    return {"estimatedTotalVolume" : volumes,
+            "coefficient" : coefficients,
+            "exponent" : exponents,
+            "mrse" : _batchMRSE(predicted, thicknessesM, offsets, counts)}
+
+
+def padDeposits(values, offsets, fillValue=1.0):
+    """
+    Converts flat values into a 2D array with a row per deposit, padded with
+    fillValue. Returns the padded array and a boolean mask of the real values.
+    """
+    values = np.asarray(values, dtype=float)
+    offsets, counts = _checkOffsets(values, offsets)
+    mask = np.arange(np.max(counts)) < counts[:,None]
+    padded = np.full(mask.shape, fillValue)
+    padded[mask] = values
+    return padded, mask
+
+
+def _batchWeibullTheta(xs, ts, mask, lambs, ks):
+    # Vectorised calculateTheta, a row per chain
+    with np.errstate(all="ignore"):
+        qs = np.exp(-np.log(ts)+(ks[:,None]-2)*np.log(xs/lambs[:,None])-np.power(xs/lambs[:,None], ks[:,None]))
+        qs = np.where(mask, qs, 0)
+        top, bottom = np.sum(qs, axis=1), np.sum(qs*qs, axis=1)
+        thetas = np.where((top != 0) & (bottom != 0), top/bottom, 1)
+    return np.where(lambs == 0, 0, thetas)
+
+
+def _batchWeibullScores(xs, ts, mask, lambs, ks):
+    # Vectorised weibull._logErrorFunction, a row per chain
+    thetas = _batchWeibullTheta(xs, ts, mask, lambs, ks)
+    with np.errstate(all="ignore"):
+        scaledXs = xs/lambs[:,None]
+        relativeErrors = (np.exp(np.log(thetas[:,None]*scaledXs**(ks[:,None]-2))-scaledXs**ks[:,None])-ts)/ts
+        relativeSquaredErrors = np.sum(np.where(mask, relativeErrors*relativeErrors, 0), axis=1)
+        return np.log(relativeSquaredErrors) + relativeSquaredErrors
+
+
+def _batchUpdateParameters(values, limits, iteration, maxIterations, generator):
+    # Vectorised weibull._updateParameter, resampling until every value is valid
+    delta = (1-iteration/maxIterations)*0.1*(limits[1]-limits[0])
+    newValues = values + generator.uniform(-delta, delta, len(values))
+    invalid = (newValues < limits[0]) | (newValues > limits[1]) | (newValues == 0)
+    while np.any(invalid):
+        newValues[invalid] = values[invalid] + generator.uniform(-delta, delta, np.count_nonzero(invalid))
+        invalid = (newValues < limits[0]) | (newValues > limits[1]) | (newValues == 0)
+    return newValues
+
+
+def batchWeibullModelAnalysis(thicknessesM, sqrtAreasKM, offsets, numberOfRuns, iterationsPerRun, limits,
+                              cancelEvent=None, generator=None):
+    """
+    Fits the Weibull model to each deposit. Uses the same hill-climbing algorithm
+    as weibullModelAnalysis, but every run for every deposit is performed at once,
+    so the results are statistically, rather than exactly, equivalent.
+    
+    Model: T(x) = theta*((x/lambda)^(k-2))*exp(-((x/lambda)^k))
+    
+    Arguments
+    numberOfRuns:int              --  the number of runs performed for each deposit
+    iterationsPerRun:int          --  the number of iterations per run
+    limits:list of 2-tuples       --  the bounds for parameters lambda and k, as
+                                      in weibullModelAnalysis.
+    cancelEvent:Event             --  optional threading.Event, if it is set during the
+                                      calculation CalculationCancelled is raised.
+    generator:numpy.random.Generator  --  optional source of random numbers, by
+                                      default one is seeded from the random module.
+    
+    Returns
+    A dictionary with the following key-value mapping, each value an array with an
+    entry per deposit:
+    
+        dict["estimatedTotalVolume"]  --  the estimated total volume of the deposit.
+        dict["lambda"]                --  estimated value of parameter lambda.
+        dict["k"]                     --  estimated value of parameter k.
+        dict["theta"]                 --  estimated value of parameter theta.
+        dict["bestScore"]             --  the score of the parameters returned.
+        dict["mrse"]                  --  the mean relative squared error of the model.
+    """
+    if generator is None:
+        generator = np.random.default_rng(random.getrandbits(64))
+    lambdaLimits, kLimits = limits
+    
+    paddedXs, mask = padDeposits(sqrtAreasKM, offsets)
+    paddedTs, _ = padDeposits(thicknessesM, offsets)
+    numberOfDeposits = len(mask)
+    
+    # Chain c anneals deposit c//numberOfRuns
+    xs = np.repeat(paddedXs, numberOfRuns, axis=0)
+    ts = np.repeat(paddedTs, numberOfRuns, axis=0)
+    chainMask = np.repeat(mask, numberOfRuns, axis=0)
+    numberOfChains = len(xs)
+    
+    lambs = generator.uniform(lambdaLimits[0], lambdaLimits[1], numberOfChains)
+    ks = generator.uniform(kLimits[0], kLimits[1], numberOfChains)
+    currentScores = _batchWeibullScores(xs, ts, chainMask, lambs, ks)
+    
+    bestLambs, bestKs, bestScores = lambs.copy(), ks.copy(), currentScores.copy()
+    
+    for iteration in range(iterationsPerRun):
+        
+        if cancelEvent is not None and cancelEvent.is_set():
+            raise CalculationCancelled()
+        
+        newLambs = _batchUpdateParameters(lambs, lambdaLimits, iteration, iterationsPerRun, generator)
+        newKs = _batchUpdateParameters(ks, kLimits, iteration, iterationsPerRun, generator)
+        newScores = _batchWeibullScores(xs, ts, chainMask, newLambs, newKs)
+        
+        improved = newScores < bestScores
+        bestLambs[improved] = newLambs[improved]
+        bestKs[improved] = newKs[improved]
+        bestScores[improved] = newScores[improved]
+        
+        with np.errstate(all="ignore"):
+            accepted = ((newScores < currentScores)
+                        | (generator.uniform(0, 1, numberOfChains) > np.exp(currentScores-newScores)))
+        lambs[accepted] = newLambs[accepted]
+        ks[accepted] = newKs[accepted]
+        currentScores[accepted] = newScores[accepted]
+    
+    # Pick the best run for each deposit
+    scores = np.where(np.isnan(bestScores), np.inf, bestScores).reshape(numberOfDeposits, numberOfRuns)
+    bestChains = np.arange(numberOfDeposits)*numberOfRuns + np.argmin(scores, axis=1)
+    lambs, ks, bestScores = bestLambs[bestChains], bestKs[bestChains], bestScores[bestChains]
+    
+    thetas = _batchWeibullTheta(paddedXs, paddedTs, mask, lambs, ks)
+    with np.errstate(all="ignore"):
+        scaledXs = paddedXs/lambs[:,None]
+        predicted = thetas[:,None]*scaledXs**(ks[:,None]-2)*np.exp(-scaledXs**ks[:,None])
+        volumes = calculateWeibullVolume(lambs, ks, thetas)
+    relativeSquaredErrors = np.where(mask, ((predicted-paddedTs)/paddedTs)**2, 0)
+    
+    return {"estimatedTotalVolume" : volumes,
+            "lambda" : lambs,
+            "k" : ks,
+            "theta" : thetas,
+            "bestScore" : bestScores,
+            "mrse" : np.sum(relativeSquaredErrors, axis=1)/np.sum(mask, axis=1)}
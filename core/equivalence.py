@@ -0,0 +1,212 @@
+'''
+Numerical equivalence of fast engines with the reference models.
+
+Each engine pairs a reference implementation, normally the model analysis run
+one deposit at a time, with a candidate implementation that should give the
+same results more quickly. Both are run over the same deposits and the
+deviation of each result is compared with the engine's tolerance, along with
+the time each took.
+
+Deterministic engines must match every deposit within the tolerance.
+Stochastic engines, such as Weibull annealers, cannot match run for run, or
+even the reference rerun, so instead they must fit as well: the median amount
+by which their quality field (e.g. mrse) is worse than the reference's must be
+within the tolerance. Deviations of their other fields are only reported.
+
+Engines are added to ENGINES with registerEngine, so new fast paths can be
+checked before they are used.
+'''
+
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from core import batch
+from core.models.exponential import calculateIsopachRegressionTable, exponentialModelAnalysis
+from core.models.power_law import powerLawModelAnalysis
+from core.models.weibull import weibullModelAnalysis
+
+Engine = namedtuple("Engine", "name description fields reference candidate rtol atol qualityField")
+
+FieldReport = namedtuple("FieldReport", "name maxDeviation medianDeviation failures")
+
+EngineReport = namedtuple("EngineReport", "engine numberOfDeposits referenceErrors fields "
+                                          "referenceTime candidateTime passed")
+
+ENGINES = OrderedDict()
+
+def registerEngine(name, description, fields, reference, candidate, rtol=1e-9, atol=1e-12, qualityField=None):
+    """
+    Adds an engine to ENGINES.
+
+    reference and candidate are functions taking a list of deposits, each a
+    list of Isopachs, and a dictionary of settings, and returning a dictionary
+    mapping each of fields to an array with a value per deposit. The
+    reference should use nan for deposits it cannot fit.
+
+    qualityField is given for stochastic engines, and is the field, smaller
+    being better, used to judge them.
+    """
+    ENGINES[name] = Engine(name, description, fields, reference, candidate, rtol, atol, qualityField)
+
+def _referenceArrays(deposits, fields, analysis):
+    """ Runs analysis on each deposit, returning arrays of the fields, nan where it fails """
+    values = dict((field, np.full(len(deposits), np.nan)) for field in fields)
+    for i, isopachs in enumerate(deposits):
+        try:
+            results = analysis(isopachs)
+            for field in fields:
+                values[field][i] = results[field]
+        except (ValueError, ZeroDivisionError, FloatingPointError):
+            pass
+    return values
+
+def relativeDeviations(reference, candidate, atol=0):
+    """ Returns |candidate-reference|/|reference|, with atol added to the denominator """
+    reference = np.asarray(reference, dtype=float)
+    candidate = np.asarray(candidate, dtype=float)
+    with np.errstate(all="ignore"):
+        deviations = np.abs(candidate-reference)/(np.abs(reference)+atol)
+    # Infinite values that agree do not deviate
+    return np.where(reference == candidate, 0, deviations)
+
+def compareEngine(engine, deposits, settings):
+    """
+    Runs the reference and candidate engines over the deposits and returns an
+    EngineReport. settings is a dictionary with the proximalLimitKM and
+    distalLimitKM of the power law model and the numberOfRuns,
+    iterationsPerRun and limits of the Weibull model.
+    """
+    # Poorly conditioned deposits overflow in both engines, which is not of interest here
+    with np.errstate(all="ignore"):
+        start = time.perf_counter()
+        referenceValues = engine.reference(deposits, settings)
+        referenceTime = time.perf_counter()-start
+
+        start = time.perf_counter()
+        candidateValues = engine.candidate(deposits, settings)
+        candidateTime = time.perf_counter()-start
+
+    referenceFitted = np.all([~np.isnan(referenceValues[field]) for field in engine.fields], axis=0)
+
+    passed = True
+    fieldReports = []
+    for field in engine.fields:
+        deviations = relativeDeviations(referenceValues[field][referenceFitted],
+                                        candidateValues[field][referenceFitted], engine.atol)
+        deviations = np.where(np.isnan(deviations), np.inf, deviations)
+        if len(deviations) == 0:
+            fieldReports.append(FieldReport(field, 0.0, 0.0, 0))
+            continue
+        failures = int(np.count_nonzero(deviations > engine.rtol))
+        fieldReports.append(FieldReport(field, float(np.max(deviations)), float(np.median(deviations)), failures))
+        if engine.qualityField is None:
+            passed = passed and failures == 0
+
+    if engine.qualityField is not None:
+        reference = referenceValues[engine.qualityField][referenceFitted]
+        candidate = candidateValues[engine.qualityField][referenceFitted]
+        with np.errstate(all="ignore"):
+            worsening = np.where(candidate <= reference, 0, (candidate-reference)/(np.abs(reference)+engine.atol))
+        worsening = np.where(np.isnan(worsening), np.inf, worsening)
+        passed = len(worsening) == 0 or float(np.median(worsening)) <= engine.rtol
+
+    return EngineReport(engine, len(deposits), int(np.count_nonzero(~referenceFitted)), fieldReports,
+                        referenceTime, candidateTime, passed)
+
+def formatReport(report):
+    """ Returns a text description of an EngineReport """
+    engine = report.engine
+    speedup = report.referenceTime/report.candidateTime if report.candidateTime > 0 else float("inf")
+    lines = ["%s: %s" % (engine.name, "PASS" if report.passed else "FAIL"),
+             "    " + engine.description,
+             "    %d deposits, %d not fitted by the reference" % (report.numberOfDeposits, report.referenceErrors),
+             "    reference %.4f s, candidate %.4f s, speedup %.1fx" % (report.referenceTime, report.candidateTime, speedup),
+             "    tolerance %g (%s)" % (engine.rtol, "every deposit" if engine.qualityField is None else
+                                           "median worsening of " + engine.qualityField),
+             "    %-24s%14s%14s%10s" % ("field", "max dev", "median dev", "over tol")]
+    for field in report.fields:
+        lines.append("    %-24s%14.3e%14.3e%10d" % field)
+    return "\n".join(lines) + "\n"
+
+def reportToDict(report):
+    """ Returns a dictionary of an EngineReport that can be serialised to json """
+    return {"engine" : report.engine.name,
+            "description" : report.engine.description,
+            "passed" : report.passed,
+            "numberOfDeposits" : report.numberOfDeposits,
+            "referenceErrors" : report.referenceErrors,
+            "referenceTime" : report.referenceTime,
+            "candidateTime" : report.candidateTime,
+            "rtol" : report.engine.rtol,
+            "qualityField" : report.engine.qualityField,
+            "fields" : [field._asdict() for field in report.fields]}
+
+#############
+## Engines ##
+#############
+
+def _flatten(deposits):
+    return batch.flattenDeposits(deposits)
+
+def _singleSegmentValues(results):
+    return {"estimatedTotalVolume" : results["estimatedTotalVolume"],
+            "coefficient" : results["segmentCoefficients"][0],
+            "exponent" : results["segmentExponents"][0],
+            "mrse" : results["mrse"]}
+
+registerEngine("batch_exponential",
+               "core.batch single segment exponential fits against exponentialModelAnalysis(isopachs, 1)",
+               ["estimatedTotalVolume", "coefficient", "exponent", "mrse"],
+               lambda deposits, settings: _referenceArrays(
+                   deposits, ["estimatedTotalVolume", "coefficient", "exponent", "mrse"],
+                   lambda isopachs: _singleSegmentValues(exponentialModelAnalysis(isopachs, 1))),
+               lambda deposits, settings: batch.batchExponentialModelAnalysis(*_flatten(deposits)))
+
+registerEngine("batch_power_law",
+               "core.batch power law fits against powerLawModelAnalysis",
+               ["estimatedTotalVolume", "coefficient", "exponent", "mrse"],
+               lambda deposits, settings: _referenceArrays(
+                   deposits, ["estimatedTotalVolume", "coefficient", "exponent", "mrse"],
+                   lambda isopachs: powerLawModelAnalysis(isopachs, settings["proximalLimitKM"],
+                                                          settings["distalLimitKM"])),
+               lambda deposits, settings: batch.batchPowerLawModelAnalysis(*_flatten(deposits),
+                                                                           settings["proximalLimitKM"],
+                                                                           settings["distalLimitKM"]))
+
+_REGRESSION_TABLE_FIELDS = ["estimatedTotalVolume_%d" % n for n in (1, 2, 3)]
+
+def _regressionTableReference(deposits, settings):
+    fields = _REGRESSION_TABLE_FIELDS
+    def analysis(isopachs):
+        return dict((field, exponentialModelAnalysis(isopachs, n)["estimatedTotalVolume"])
+                    for n, field in enumerate(fields, 1))
+    return _referenceArrays(deposits, fields, analysis)
+
+def _regressionTableCandidate(deposits, settings):
+    fields = _REGRESSION_TABLE_FIELDS
+    def analysis(isopachs):
+        table = calculateIsopachRegressionTable(isopachs)
+        return dict((field, exponentialModelAnalysis(isopachs, n, regressionTable=table)["estimatedTotalVolume"])
+                    for n, field in enumerate(fields, 1))
+    return _referenceArrays(deposits, fields, analysis)
+
+registerEngine("regression_table",
+               "exponential fits of 1 to 3 segments sharing one regression table against separate fits",
+               _REGRESSION_TABLE_FIELDS,
+               _regressionTableReference,
+               _regressionTableCandidate)
+
+registerEngine("batch_weibull",
+               "core.batch vectorised Weibull annealing against weibullModelAnalysis",
+               ["estimatedTotalVolume", "mrse"],
+               lambda deposits, settings: _referenceArrays(
+                   deposits, ["estimatedTotalVolume", "mrse"],
+                   lambda isopachs: weibullModelAnalysis(isopachs, settings["numberOfRuns"],
+                                                         settings["iterationsPerRun"], settings["limits"])),
+               lambda deposits, settings: batch.batchWeibullModelAnalysis(*_flatten(deposits),
+                                                                          settings["numberOfRuns"],
+                                                                          settings["iterationsPerRun"],
+                                                                          settings["limits"]),
+               rtol=0.05, qualityField="mrse")
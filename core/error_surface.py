@@ -0,0 +1,195 @@
+'''
+Vectorised error surfaces of the power law and Weibull models.
+
+The error surface is the log of the mean relative squared error of the model
+over a grid of its two free parameters: (coefficient, exponent) for the power
+law model and (lambda, k) for the Weibull model, whose theta is chosen
+optimally for each point. The whole grid is evaluated with numpy broadcasting
+over a (rows, columns, isopachs) array, in chunks of rows to bound the memory
+used.
+
+Points where the error cannot be calculated, or is greater than
+MAX_SURFACE_ERROR, are nan.
+
+For interactive use, ErrorSurfaceTiles calculates surfaces on lattices of
+points at multiples of power of two steps, so that the points calculated for
+one surface can be reused by the next. Each lattice is split into square
+tiles, which are kept in a least recently used cache:
+
+    -- refining a surface halves the steps, and a quarter of the points of
+       the finer lattice are those of the coarser one.
+    -- moving the bounds of a surface only calculates the tiles newly exposed.
+'''
+
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+MODEL_NAMES = ["power_law", "weibull"]
+
+# Errors above this are left out of the surface, as they would flatten the rest of it
+MAX_SURFACE_ERROR = 10**10
+
+# Maximum number of elements in the broadcast arrays of a chunk of rows
+MAX_CHUNK_ELEMENTS = 2**20
+
+# Number of lattice points along each side of a tile
+TILE_SIZE = 32
+
+# Number of tiles kept by ErrorSurfaceTiles, each TILE_SIZE*TILE_SIZE floats
+DEFAULT_MAX_TILES = 256
+
+# Resolution of the first, coarsest, pass of a progressive surface
+PROGRESSIVE_START_RESOLUTION = 25
+
+def _maskErrors(errors):
+    with np.errstate(invalid="ignore"):
+        return np.where(np.isfinite(errors) & (errors <= MAX_SURFACE_ERROR), errors, np.nan)
+
+def _powerLawLogErrors(xs, ts, coefficients, exponents):
+    thicknesses = coefficients[..., None]*xs**-exponents[..., None]
+    return np.log(np.mean(((thicknesses-ts)/ts)**2, axis=-1))
+
+def _weibullLogErrors(xs, ts, lambdas, ks):
+    scaledXs = xs/lambdas[..., None]
+    logShapes = (ks[..., None]-2)*np.log(scaledXs) - scaledXs**ks[..., None]
+
+    # The optimal theta for each point, as calculated by calculateTheta
+    qs = np.exp(-np.log(ts) + logShapes)
+    top, bottom = np.sum(qs, axis=-1), np.sum(qs*qs, axis=-1)
+    thetas = np.where((top != 0) & (bottom != 0), top/bottom, 1)
+    thetas = np.where(lambdas == 0, 0, thetas)
+
+    thicknesses = np.exp(np.log(thetas)[..., None] + logShapes)
+    return np.log(np.mean(((thicknesses-ts)/ts)**2, axis=-1))
+
+def errorSurface(model, sqrtAreasKM, thicknessesM, X, Y):
+    """
+    Returns an array, the shape of X and Y, of the log mean relative squared
+    error of the model at each point of the parameter grid X, Y. model is one
+    of MODEL_NAMES. The grid is of (coefficient, exponent) for the power law
+    model and (lambda, k) for the Weibull model.
+    """
+    if model == "power_law":
+        logErrors = _powerLawLogErrors
+    elif model == "weibull":
+        logErrors = _weibullLogErrors
+    else:
+        raise ValueError("Model must be one of: " + " ".join(MODEL_NAMES))
+
+    xs = np.asarray(sqrtAreasKM, dtype=float)
+    ts = np.asarray(thicknessesM, dtype=float)
+    X, Y = np.asarray(X, dtype=float), np.asarray(Y, dtype=float)
+    Z = np.empty(X.shape)
+
+    rowSize = max(1, int(np.prod(X.shape[1:]))*len(xs))
+    chunkRows = max(1, MAX_CHUNK_ELEMENTS//rowSize)
+    with np.errstate(all="ignore"):
+        for start in range(0, X.shape[0], chunkRows):
+            end = start+chunkRows
+            Z[start:end] = _maskErrors(logErrors(xs, ts, X[start:end], Y[start:end]))
+    return Z
+
+#################
+## Progressive ##
+#################
+
+def latticeLevel(start, end, resolution):
+    """
+    Returns the level of the lattice whose step, 2**level, gives the number of
+    points closest to resolution between start and end.
+    """
+    return int(round(math.log2((end-start)/resolution)))
+
+def progressiveLevels(startX, endX, startY, endY, resolution, startResolution=PROGRESSIVE_START_RESOLUTION):
+    """
+    Returns a list of the (levelX, levelY) lattice levels of the passes of a
+    progressive surface, from a resolution of about startResolution doubling
+    up to resolution.
+    """
+    levelX = latticeLevel(startX, endX, resolution)
+    levelY = latticeLevel(startY, endY, resolution)
+    numberOfPasses = 1 + max(0, int(math.floor(math.log2(resolution/startResolution))))
+    return [(levelX+i, levelY+i) for i in reversed(range(numberOfPasses))]
+
+class ErrorSurfaceTiles():
+    """
+    Least recently used cache of tiles of error surfaces, from which surfaces
+    over any bounds are assembled. Tiles are identified by the model and
+    isopachs as well as their position, so one cache can be shared by
+    different surfaces. It is not thread safe.
+    """
+    def __init__(self, maxTiles=DEFAULT_MAX_TILES):
+        self.maxTiles = maxTiles
+        self._tiles = OrderedDict()
+        self.tilesCalculated = 0
+        self.pointsCalculated = 0
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def clear(self):
+        self._tiles.clear()
+
+    def surface(self, model, sqrtAreasKM, thicknessesM, startX, endX, startY, endY, levelX, levelY):
+        """
+        Returns the X, Y and Z arrays of the model's error surface at the
+        points of the (levelX, levelY) lattice between the bounds, which are
+        included.
+        """
+        data = (model, tuple(float(x) for x in sqrtAreasKM), tuple(float(t) for t in thicknessesM))
+        stepX, stepY = 2.0**levelX, 2.0**levelY
+        firstI, lastI = _latticeIndices(startX, endX, stepX)
+        firstJ, lastJ = _latticeIndices(startY, endY, stepY)
+
+        firstTileI, lastTileI = firstI//TILE_SIZE, lastI//TILE_SIZE
+        firstTileJ, lastTileJ = firstJ//TILE_SIZE, lastJ//TILE_SIZE
+        Z = np.empty(((lastTileJ-firstTileJ+1)*TILE_SIZE, (lastTileI-firstTileI+1)*TILE_SIZE))
+        for tileJ in range(firstTileJ, lastTileJ+1):
+            for tileI in range(firstTileI, lastTileI+1):
+                row, col = (tileJ-firstTileJ)*TILE_SIZE, (tileI-firstTileI)*TILE_SIZE
+                Z[row:row+TILE_SIZE, col:col+TILE_SIZE] = self._getTile(data, levelX, levelY, tileI, tileJ)
+
+        offsetI, offsetJ = firstI-firstTileI*TILE_SIZE, firstJ-firstTileJ*TILE_SIZE
+        Z = Z[offsetJ:offsetJ+lastJ-firstJ+1, offsetI:offsetI+lastI-firstI+1]
+        X, Y = np.meshgrid(np.arange(firstI, lastI+1)*stepX, np.arange(firstJ, lastJ+1)*stepY)
+        return X, Y, Z
+
+    def _getTile(self, data, levelX, levelY, tileI, tileJ):
+        key = (data, levelX, levelY, tileI, tileJ)
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+            return tile
+
+        tile = self._calculateTile(data, levelX, levelY, tileI, tileJ)
+        self._tiles[key] = tile
+        if len(self._tiles) > self.maxTiles:
+            self._tiles.popitem(last=False)
+        return tile
+
+    def _calculateTile(self, data, levelX, levelY, tileI, tileJ):
+        model, xs, ts = data
+        indices = np.arange(TILE_SIZE)
+        X, Y = np.meshgrid((tileI*TILE_SIZE+indices)*2.0**levelX, (tileJ*TILE_SIZE+indices)*2.0**levelY)
+        tile = np.empty((TILE_SIZE, TILE_SIZE))
+        toCalculate = np.ones((TILE_SIZE, TILE_SIZE), dtype=bool)
+
+        # The even points of the tile are in a tile of the coarser lattice, if it has been calculated
+        half = TILE_SIZE//2
+        coarseTile = self._tiles.get((data, levelX+1, levelY+1, tileI//2, tileJ//2))
+        if coarseTile is not None:
+            row, col = (tileJ%2)*half, (tileI%2)*half
+            tile[::2, ::2] = coarseTile[row:row+half, col:col+half]
+            toCalculate[::2, ::2] = False
+
+        tile[toCalculate] = errorSurface(model, xs, ts, X[toCalculate], Y[toCalculate])
+        self.tilesCalculated += 1
+        self.pointsCalculated += int(np.count_nonzero(toCalculate))
+        return tile
+
+def _latticeIndices(start, end, step):
+    """ Returns the first and last indices of the lattice points between start and end """
+    tolerance = 1e-9
+    return int(math.ceil(start/step-tolerance)), int(math.floor(end/step+tolerance))
@@ -1,2 +1,10 @@
 class ExpectedException(Exception):
 	pass
+
+class CalculationCancelled(Exception):
+	"""Raised within a calculation when it has been asked to stop"""
+	pass
+
+class MemoryLimitExceeded(Exception):
+	"""Raised when memory tracking finds more memory allocated than the limit set"""
+	pass
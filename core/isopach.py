@@ -5,6 +5,8 @@ Created on 2 Jul 2013
 '''
 import numpy as np
 
+from core import profiling
+
 class Isopach(object):
 
     def __init__(self, thicknessM, sqrtAreaKM):
@@ -18,6 +20,7 @@ class Isopach(object):
     	return self.sqrtAreaKM/np.sqrt(np.pi)
 
 
+@profiling.timed("read_isopach_file")
 def read_isopach_file(filename):
     """
     Read a list of isopachs from comma separated text file, with columns of
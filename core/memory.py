@@ -0,0 +1,233 @@
+'''
+Opt-in tracking of the memory allocated while processing deposits.
+
+Uses tracemalloc, so only memory allocated by Python (including numpy arrays)
+is counted. When tracking is disabled, track() returns a shared context
+manager that does nothing and checkpoint() returns immediately.
+
+Each deposit is processed inside track(deposit), which resets the peak, and
+checkpoint(stage) is called at the boundaries of its stages. tracemalloc can
+only reset the peak from Python 3.9, so on earlier versions the peak of each
+deposit is the peak since tracking started. Every checkpoint
+records the memory currently allocated and the peak since the deposit began.
+If a limit is set and the peak exceeds it, MemoryLimitExceeded is raised so
+the batch can stop cleanly and report what was allocated.
+
+After the first deposit a snapshot is taken, so the report can show the sites
+whose allocations have grown since, which is where memory that creeps up over
+a batch comes from.
+'''
+
+import json
+import os
+import sys
+import tracemalloc
+from collections import namedtuple
+
+from core.exceptions import MemoryLimitExceeded
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+MemoryRecord = namedtuple("MemoryRecord", "deposit stage current peak pid")
+
+MEMORY_FORMATS = ["text", "json"]
+
+_enabled = False
+_limitBytes = None
+_records = []
+_currentDeposit = None
+_baselineSnapshot = None
+
+def enable(limitBytes=None, frames=1):
+    """
+    Starts tracking memory. If limitBytes is given, MemoryLimitExceeded is
+    raised at a checkpoint once more than that has been allocated. frames is
+    the number of stack frames stored for each allocation.
+    """
+    global _enabled, _limitBytes
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    _enabled = True
+    _limitBytes = limitBytes
+
+def disable():
+    global _enabled, _baselineSnapshot
+    _enabled = False
+    _baselineSnapshot = None
+    tracemalloc.stop()
+
+def isEnabled():
+    return _enabled
+
+def getLimit():
+    return _limitBytes
+
+class _NullTracker(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        return False
+
+_NULL_TRACKER = _NullTracker()
+
+class _DepositTracker(object):
+
+    __slots__ = ("deposit", "previousDeposit")
+
+    def __init__(self, deposit):
+        self.deposit = deposit
+
+    def __enter__(self):
+        global _currentDeposit
+        self.previousDeposit = _currentDeposit
+        _currentDeposit = self.deposit
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        checkpoint("start")
+        return self
+
+    def __exit__(self, excType, *excInfo):
+        global _currentDeposit, _baselineSnapshot
+        try:
+            if excType is None:
+                checkpoint("end")
+                if _baselineSnapshot is None:
+                    _baselineSnapshot = _takeSnapshot()
+        finally:
+            _currentDeposit = self.previousDeposit
+        return False
+
+def track(deposit):
+    """ Returns a context manager within which memory is attributed to deposit """
+    if not _enabled:
+        return _NULL_TRACKER
+    return _DepositTracker(deposit)
+
+def checkpoint(stage):
+    """
+    Records the memory allocated at the end of stage. Raises
+    MemoryLimitExceeded if the peak is above the limit.
+    """
+    if not _enabled:
+        return
+    current, peak = tracemalloc.get_traced_memory()
+    _records.append(MemoryRecord(_currentDeposit, stage, current, peak, os.getpid()))
+    if _limitBytes is not None and peak > _limitBytes:
+        raise MemoryLimitExceeded("%s allocated while processing %s (%s), more than the limit of %s"
+                                  % (_formatBytes(peak), _currentDeposit, stage, _formatBytes(_limitBytes)))
+
+def takeRecords():
+    """ Returns the records made so far and forgets them """
+    global _records
+    records, _records = _records, []
+    return records
+
+def addRecords(records):
+    """ Adds records made elsewhere, e.g. in a worker process """
+    _records.extend(MemoryRecord(*record) for record in records)
+
+def getRecords():
+    return list(_records)
+
+def _takeSnapshot():
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>")])
+
+def topAllocations(limit=10):
+    """
+    Returns a list of (site, size in bytes, count) of the sites with the most
+    memory allocated, or, once the first deposit is complete, the sites whose
+    allocations have grown the most since.
+    """
+    if not tracemalloc.is_tracing():
+        return []
+    snapshot = _takeSnapshot()
+    if _baselineSnapshot is not None:
+        statistics = [stat for stat in snapshot.compare_to(_baselineSnapshot, "lineno") if stat.size_diff > 0]
+        return [(str(stat.traceback), stat.size_diff, stat.count_diff) for stat in statistics[:limit]]
+    return [(str(stat.traceback), stat.size, stat.count) for stat in snapshot.statistics("lineno")[:limit]]
+
+def summarise(records, topSites=None):
+    """
+    Returns a dictionary of the peak allocated overall and, for each deposit,
+    the memory still allocated when it was finished compared with when it
+    began, the peak while it was processed and the memory at each stage.
+
+    The top allocation sites and maximum resident set size are only those of
+    this process, so workerProcesses gives the number of other processes
+    whose records are included.
+    """
+    deposits = {}
+    for record in records:
+        if record.deposit is None:
+            continue
+        deposit = deposits.setdefault(record.deposit, {"start" : record.current, "peak" : 0, "stages" : {}})
+        deposit["peak"] = max(deposit["peak"], record.peak)
+        deposit["stages"][record.stage] = record.current
+    for deposit in deposits.values():
+        deposit["retained"] = deposit["stages"].get("end", deposit["start"]) - deposit["start"]
+    summary = {"peak" : max((record.peak for record in records), default=0),
+               "limit" : _limitBytes,
+               "deposits" : deposits,
+               "topAllocations" : [{"site" : site, "size" : size, "count" : count}
+                                   for site, size, count in (topSites or [])],
+               "workerProcesses" : len(set(record.pid for record in records) - {os.getpid()})}
+    if resource is not None:
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+        maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        summary["maxRSS"] = maxRSS if sys.platform == "darwin" else maxRSS*1024
+    return summary
+
+def _formatBytes(size):
+    for unit in ["B", "KB", "MB"]:
+        if abs(size) < 1024:
+            return "%.1f %s" % (size, unit)
+        size /= 1024
+    return "%.1f GB" % size
+
+def formatSummary(summary):
+    """ Returns the summary as text """
+    lines = ["Peak allocated: " + _formatBytes(summary["peak"])]
+    if summary["limit"] is not None:
+        lines.append("Limit: " + _formatBytes(summary["limit"]))
+    if "maxRSS" in summary:
+        lines.append("Maximum resident set size: " + _formatBytes(summary["maxRSS"]))
+    lines.append("")
+    lines.append("%-40s%14s%14s" % ("Deposit", "Peak", "Retained"))
+    for name, deposit in summary["deposits"].items():
+        lines.append("%-40s%14s%14s" % (name, _formatBytes(deposit["peak"]), _formatBytes(deposit["retained"])))
+    if summary["topAllocations"]:
+        lines.append("")
+        lines.append("Top allocation sites" + (" (growth since the first deposit)" if _baselineSnapshot is not None else ""))
+        for allocation in summary["topAllocations"]:
+            lines.append("%14s%8d  %s" % (_formatBytes(allocation["size"]), allocation["count"], allocation["site"]))
+    if summary["workerProcesses"]:
+        lines.append("")
+        lines.append("The deposits were processed in %d worker processes, whose allocation sites and resident"
+                     % summary["workerProcesses"])
+        lines.append("set sizes are not included above.")
+    return "\n".join(lines) + "\n"
+
+def writeReport(outputFile, format="text", records=None):
+    """ Writes a report of the records made, or the records given, to outputFile """
+    if format not in MEMORY_FORMATS:
+        raise ValueError("Memory report format must be one of: " + " ".join(MEMORY_FORMATS))
+    if records is None:
+        records = getRecords()
+    summary = summarise(records, topAllocations())
+    if format == "text":
+        outputFile.write(formatSummary(summary))
+    else:
+        json.dump(summary, outputFile, indent=2)
+        outputFile.write("\n")
@@ -6,9 +6,11 @@ Created on 15 Jul 2013
 
 import numpy as np
 
-from core import regression_methods
+from core import profiling, regression_methods
+from core.results import ExponentialResults
 
-def exponentialModelAnalysis(isopachs,n):
+@profiling.timed("exponential")
+def exponentialModelAnalysis(isopachs,n,regressionTable=None):
 	"""
 	Analyses the isopach data under the assumption it follows a n-segment exponential model 
 	
@@ -18,12 +20,15 @@ def exponentialModelAnalysis(isopachs,n):
 	Arguments
 	isopachs:list of Isopachs -- list of isopachs to analyse
 	n:int -- the number of exponential segments
+	regressionTable:tuple -- optional regression table for the isopachs, as returned by
+							 calculateIsopachRegressionTable, to avoid recalculating it
 	
 	Returns
-	A dictionary with the following key-value mapping:
+	An ExponentialResults object, which can be used as a dictionary with the following key-value mapping:
 	
 		dict["estimatedTotalVolume"]:float		  --  the estimated total volume of the deposit.
 		dict["thicknessFunction"]:func x->t		 --  the thickness function, calculates T(x) (in metres).
+														results.thickness(x) is a vectorised version.
 		dict["segmentLimits"]:list of floats		--  list of bounds for the segments. Segment i
 														is valid between segmentLimits[i] and
 														segmentLimits[i+1].
@@ -42,11 +47,10 @@ def exponentialModelAnalysis(isopachs,n):
 		dict["mrse"]:float 							-- the mean relative squared error of the model
 	"""
 
-	thicknessesM = [isopach.thicknessM for isopach in isopachs]
 	logThickness = [np.log(isopach.thicknessM) for isopach in isopachs]
 	sqrtAreasKM = [isopach.sqrtAreaKM for isopach in isopachs]
 
-	regressionLines, segmentLimits = regression_methods.calculateMultiLineRegression(sqrtAreasKM,logThickness,n)
+	regressionLines, segmentLimits = regression_methods.calculateMultiLineRegression(sqrtAreasKM,logThickness,n,regressionTable)
 
 	segmentT0s = [np.exp(line.c) for line in regressionLines]
 	segmentKs = [-line.m for line in regressionLines]
@@ -59,25 +63,24 @@ def exponentialModelAnalysis(isopachs,n):
 		segmentVolumes.append(calculateExponentialSegmentVolume(segmentT0s[i],segmentKs[i],segmentLimits[i],segmentLimits[i+1]))
 	estimatedTotalVolume = sum(segmentVolumes)
 
-	def thicknessFunction(x):
-		for i in range(n):
-			if segmentLimits[i] <= x < segmentLimits[i+1]:
-				return segmentT0s[i]*np.exp(-segmentKs[i]*x)
-		raise ValueError("x (" + str(x) + ") is not in the domain of the function (0 to infinity)")
+	return ExponentialResults(isopachs,
+							  estimatedTotalVolume=estimatedTotalVolume,
+							  segmentLimits=segmentLimits,
+							  segmentVolumes=segmentVolumes,
+							  segmentCoefficients=segmentT0s,
+							  segmentExponents=segmentKs,
+							  segmentBts=segmentBts,
+							  regressionLines=regressionLines,
+							  numberOfSegments=n)
 
-	mrse = regression_methods.meanRelativeSquaredError(sqrtAreasKM, thicknessesM, thicknessFunction)
-
-	return {"estimatedTotalVolume" : estimatedTotalVolume,
-			"thicknessFunction" : thicknessFunction,
-			"segmentLimits" : segmentLimits,
-			"segmentVolumes" : segmentVolumes,
-			"segmentCoefficients" : segmentT0s,
-			"segmentExponents" : segmentKs,
-			"segmentBts" : segmentBts,
-			"regressionLines" : regressionLines,
-			"isopachs" : isopachs,
-			"numberOfSegments" : n,
-			"mrse" : mrse}
+def calculateIsopachRegressionTable(isopachs):
+	"""
+	Returns the regression table of log thickness against square root area used to
+	fit the exponential segments. It is the same for any number of segments.
+	"""
+	logThickness = [np.log(isopach.thicknessM) for isopach in isopachs]
+	sqrtAreasKM = [isopach.sqrtAreaKM for isopach in isopachs]
+	return regression_methods.calculateRegressionTable(sqrtAreasKM,logThickness)
 
 def calculateExponentialSegmentVolume(coefficient,exponent,startLimitKM,endLimitKM):
 	"""
@@ -6,10 +6,12 @@ Created on 15 Jul 2013
 
 import numpy as np
 
-from core import regression_methods
+from core import profiling, regression_methods
 from core.models.exponential import exponentialModelAnalysis
+from core.results import PowerLawResults
 
-def powerLawModelAnalysis(isopachs, proximalLimitKM, distalLimitKM):
+@profiling.timed("power_law")
+def powerLawModelAnalysis(isopachs, proximalLimitKM, distalLimitKM, exponentialResults=None):
     """
     Analyses the isopach data under the assumption it follows a power law model
     
@@ -20,12 +22,18 @@ def powerLawModelAnalysis(isopachs, proximalLimitKM, distalLimitKM):
     isopachs:list of Isopachs -- list of isopachs to analyse
     proximalLimitKM:float -- the proximal limit of integration (in km)
     distalLimitKM:float -- the distal limit of integration (in km)
+    exponentialResults:dict -- optional results of a 2 segment exponential analysis of the
+                               same isopachs, used to avoid refitting when estimating the
+                               suggested proximal limit
+    
+    The suggested proximal limit and mrse are only calculated when they are first accessed.
     
     Returns
-    A dictionary with the following key-value mapping:
+    A PowerLawResults object, which can be used as a dictionary with the following key-value mapping:
     
         dict["estimatedTotalVolume"]:float          --  the estimated total volume of the deposit.
         dict["thicknessFunction"]:func x->t         --  the thickness function, calculates T(x) (in metres).
+                                                        results.thickness(x) is a vectorised version.
         dict["regressionLine"]:Line                 --  Line object representing the least squares
                                                         regression line used to estimate the parameters
         dict["coefficient"]:float                   --  estimated coefficient for the power curve
@@ -37,10 +45,8 @@ def powerLawModelAnalysis(isopachs, proximalLimitKM, distalLimitKM):
         dict["mrse"]:float                          -- the mean relative squared error of the model
     """
     
-    thicknessesM = [isopach.thicknessM for isopach in isopachs]
-    sqrtAreasKM = [isopach.sqrtAreaKM for isopach in isopachs]
-    logThicknessesM = [np.log(t) for t in thicknessesM]
-    logSqrtAreaKM = [np.log(a) for a in sqrtAreasKM]
+    logThicknessesM = [np.log(isopach.thicknessM) for isopach in isopachs]
+    logSqrtAreaKM = [np.log(isopach.sqrtAreaKM) for isopach in isopachs]
     
     proximalLimitSqrtAreaKM = proximalLimitKM*np.sqrt(np.pi)
     distalLimitSqrtAreaKM = distalLimitKM*np.sqrt(np.pi)
@@ -50,29 +56,18 @@ def powerLawModelAnalysis(isopachs, proximalLimitKM, distalLimitKM):
     c = np.exp(regressionLine.c)
     estimatedTotalVolume = calculatePowerLawVolume(c, m, proximalLimitSqrtAreaKM, distalLimitSqrtAreaKM)
 
-    def thicknessFunction(x):
-        if proximalLimitSqrtAreaKM <= x <= distalLimitSqrtAreaKM:
-            return c*(x**-m)
-        else:
-            raise ValueError("x is out of range of proximal and distal limits of integration")
+    results = PowerLawResults(isopachs,
+                              estimatedTotalVolume=estimatedTotalVolume,
+                              regressionLine=regressionLine,
+                              coefficient=c,
+                              exponent=m,
+                              proximalLimitKM=proximalLimitKM,
+                              distalLimitKM=distalLimitKM,
+                              exponentialResults=exponentialResults)
     
-    if len(isopachs) > 3:
-        suggestedProximalLimit = calculateProximalLimitEstimate(isopachs, c, m)
-    else:
-        suggestedProximalLimit = "N/A"
-
-    mrse = regression_methods.meanRelativeSquaredError(sqrtAreasKM, thicknessesM, thicknessFunction)
-
-    return {"estimatedTotalVolume" : estimatedTotalVolume,
-            "thicknessFunction" : thicknessFunction,
-            "regressionLine" : regressionLine,
-            "coefficient" : c,
-            "exponent" : m,
-            "isopachs" : isopachs,
-            "proximalLimitKM" : proximalLimitKM,
-            "distalLimitKM" : distalLimitKM,
-            "suggestedProximalLimit" : suggestedProximalLimit,
-            "mrse" : mrse}
+    # The model is only defined between the limits of integration
+    results.checkDomain(results.sqrtAreasKM)
+    return results
   
 def calculatePowerLawVolume(coefficient,exponent,proximalLimitKM,distalLimitKM):
     """ 
@@ -80,10 +75,14 @@ def calculatePowerLawVolume(coefficient,exponent,proximalLimitKM,distalLimitKM):
     """
     return 0.001*2*coefficient*(distalLimitKM**(2-exponent)-proximalLimitKM**(2-exponent))/(2-exponent)
 
-def calculateProximalLimitEstimate(isopachs,coefficient,exponent):
+def calculateProximalLimitEstimate(isopachs,coefficient,exponent,expResults=None):
     """
     Returns the estimate for the proximal limit of integration
     suggested by Bonadonna and Houghton 2005
+    
+    expResults may be given as the results of a 2 segment exponential analysis
+    of the isopachs, otherwise the analysis is carried out.
     """
-    expResults = exponentialModelAnalysis(isopachs,2)
+    if expResults is None:
+        expResults = exponentialModelAnalysis(isopachs,2)
     return ((expResults["segmentCoefficients"][0]/coefficient)**(-(1/exponent)))/np.sqrt(np.pi)
@@ -5,13 +5,20 @@ Created on 2 Jul 2013
 '''
 
 import random
+import time
 import numpy as np
-from core import regression_methods
+from core import profiling
+from core.exceptions import CalculationCancelled
+from core.results import WeibullResults, WeibullTelemetry
 
 # As sometimes the hill-climbing algorithm encounters very very small k values
 np.seterr(divide="ignore")
 
-def weibullModelAnalysis(isopachs,numberOfRuns,iterationsPerRun,limits):
+# Number of iterations of a run between calls of the progress callback
+PROGRESS_INTERVAL = 100
+
+@profiling.timed("weibull")
+def weibullModelAnalysis(isopachs,numberOfRuns,iterationsPerRun,limits,cancelEvent=None,telemetry=False,progressCallback=None):
 	"""
 	Analyses the isopach data under the assumption it follows a Weibull model
 	
@@ -29,13 +36,23 @@ def weibullModelAnalysis(isopachs,numberOfRuns,iterationsPerRun,limits):
 	limits:list of 2-tuples	--  A list of 2 2-tuples, the first 2 tuple representing
 								   lower and upper bounds for parameter lambda and the 
 								   second 2-tuple the bounds for parameter k.
+	cancelEvent:Event		  --  optional threading.Event (or equivalent), if it is set
+								   during the calculation CalculationCancelled is raised.
+	telemetry:bool			 --  if True, the solver's counters and traces are recorded
+								   and returned as a WeibullTelemetry.
+	progressCallback:func	  --  optional function called as progressCallback(completedRuns,
+								   completedIterations, bestScore) every PROGRESS_INTERVAL
+								   iterations and at the end of each run, where
+								   completedIterations is the total over all runs and
+								   bestScore the best score found so far.
 								   
 	
 	Returns
-	A dictionary with the following key-value mapping:
+	A WeibullResults object, which can be used as a dictionary with the following key-value mapping:
 	
 		dict["estimatedTotalVolume"]:float   --  the estimated total volume of the deposit (in km3).
 		dict["thicknessFunction"]:func x->t  --  the thickness function, calculates T(x) (in metres).
+												 results.thickness(x) is a vectorised version.
 		dict["lambda"]:float				 --  estimated value of parameter lambda
 		dict["k"]:float					  --  estimated value of parameter k
 		dict["theta"]:float				  --  estimated value of parameter theta
@@ -45,32 +62,34 @@ def weibullModelAnalysis(isopachs,numberOfRuns,iterationsPerRun,limits):
 		dict["limits"]:list of 2-tuples	  --  the limits for lambda and k used in calculations
 
 		dict["mrse"]:float 					-- the mean relative squared error of the model
+		dict["telemetry"]:WeibullTelemetry	--  the solver's counters and traces if telemetry is True,
+												 otherwise None
 	"""
 
 	sqrtAreasKM = np.array([isopach.sqrtAreaKM for isopach in isopachs])
 	thicknessesM = np.array([isopach.thicknessM for isopach in isopachs])
+	solverTelemetry = WeibullTelemetry(numberOfRuns, iterationsPerRun) if telemetry else None
 
 	lamb, k, bestScore = _solveWeibullParameters(_logErrorFunction,
 												 sqrtAreasKM,
 												 thicknessesM,
 												 numberOfRuns,
 												 iterationsPerRun,
-												 *limits)
+												 *limits,
+												 cancelEvent=cancelEvent,
+												 telemetry=solverTelemetry,
+												 progressCallback=progressCallback)
 	theta = calculateTheta(sqrtAreasKM, thicknessesM, lamb,k)
-	
-	thicknessFunction = _createThicknessFunction(lamb, k, theta)
 	estimatedTotalVolumeKM3 = calculateWeibullVolume(lamb, k, theta)
-	mrse = regression_methods.meanRelativeSquaredError(sqrtAreasKM, thicknessesM, thicknessFunction)
-
-	return {"estimatedTotalVolume" : estimatedTotalVolumeKM3,
-			"thicknessFunction" : thicknessFunction,
-			"lambda" : lamb,
-			"k" : k,
-			"theta" : theta,
-			"bestScore" : bestScore,
-			"isopachs" : isopachs,
-			"limits" : limits,
-			"mrse" : mrse}
+
+	return WeibullResults(isopachs,
+						  estimatedTotalVolume=estimatedTotalVolumeKM3,
+						  lamb=lamb,
+						  k=k,
+						  theta=theta,
+						  bestScore=bestScore,
+						  limits=limits,
+						  telemetry=solverTelemetry)
 	
 def calculateWeibullVolume(lamb,k,theta):
 	""" 
@@ -93,39 +112,43 @@ def calculateTheta(xs,ts,lamb,k):
 		top, bottom = np.sum(qs), np.sum(qs*qs)
 		return top/bottom if top != 0 and bottom != 0 else 1
 
-def _createThicknessFunction(lamb,k,theta):
-	
-	def thicknessFunction(x):
-		try:
-			return np.exp(np.log(theta)+(k-2)*np.log(x/lamb)-(x/lamb)**k)
-		except FloatingPointError:
-			return 0
-	return thicknessFunction
-
 def _logErrorFunction(xs,ts,lamb,k):   
 	theta = calculateTheta(xs,ts,lamb,k)
 	relativeSquaredError = np.sum(np.power(((np.exp(np.log(theta*((xs/lamb)**(k-2)))-(xs/lamb)**k)-ts)/ts),2))
 	return np.log(relativeSquaredError) + relativeSquaredError
 	
-def _solveWeibullParameters(errorFunction,xs,ts,numberOfRuns,iterationsPerRun,lambdaLimits,kLimits):
+def _solveWeibullParameters(errorFunction,xs,ts,numberOfRuns,iterationsPerRun,lambdaLimits,kLimits,cancelEvent=None,telemetry=None,progressCallback=None):
 	
 	bestScore = float('inf')
 	bestParameters = []
+	progress = None
+
+	for run in range(numberOfRuns):
+		if progressCallback is not None:
+			def progress(iteration, runBestScore, run=run):
+				progressCallback(run, run*iterationsPerRun+iteration, min(bestScore, runBestScore))
 
-	for _ in range(numberOfRuns):
 		startLamb = random.uniform(lambdaLimits[0],lambdaLimits[1])
 		startK = random.uniform(kLimits[0],kLimits[1])
 		
 		startingParameters = [startLamb,startK]
-		currentParameters, currentScore = _performRun(errorFunction,xs,ts,startingParameters,iterationsPerRun,lambdaLimits,kLimits)
+		if telemetry is not None:
+			telemetry.startParameters[run] = startingParameters
+			startTime = time.perf_counter()
+		currentParameters, currentScore = _performRun(errorFunction,xs,ts,startingParameters,iterationsPerRun,lambdaLimits,kLimits,cancelEvent,telemetry,run,progress)
+		if telemetry is not None:
+			telemetry.runTimes[run] = time.perf_counter()-startTime
+			telemetry.bestScores[run] = currentScore
 		if(bestScore > currentScore):
 			bestParameters = currentParameters
 			bestScore = currentScore
+		if progressCallback is not None:
+			progressCallback(run+1, (run+1)*iterationsPerRun, bestScore)
 	
 	bestParameters.append(bestScore)
 	return bestParameters
 
-def _performRun(errorFunction, xs, ts, initialParameters, maxIterations, lambdaLimits, kLimits):
+def _performRun(errorFunction, xs, ts, initialParameters, maxIterations, lambdaLimits, kLimits, cancelEvent=None, telemetry=None, run=0, progress=None):
 	iteration = 0
 	
 	lamb, k = initialParameters
@@ -134,10 +157,20 @@ def _performRun(errorFunction, xs, ts, initialParameters, maxIterations, lambdaL
 	bestScore = currentScore
 	bestParameters = initialParameters
 	
+	if telemetry is not None:
+		telemetry.evaluations[run] += 1
+		telemetry.bestScoreTrajectory[run,0] = bestScore
+	
 	while iteration < maxIterations:
 		
-		newLambda = _updateParameter(lamb,lambdaLimits,iteration,maxIterations)
-		newK = _updateParameter(k,kLimits,iteration,maxIterations)
+		if cancelEvent is not None and cancelEvent.is_set():
+			raise CalculationCancelled()
+
+		if progress is not None and iteration % PROGRESS_INTERVAL == 0 and iteration > 0:
+			progress(iteration, bestScore)
+
+		newLambda = _updateParameter(lamb,lambdaLimits,iteration,maxIterations,telemetry,run)
+		newK = _updateParameter(k,kLimits,iteration,maxIterations,telemetry,run)
 
 		newScore = errorFunction(xs,ts,newLambda,newK)
 
@@ -150,14 +183,27 @@ def _performRun(errorFunction, xs, ts, initialParameters, maxIterations, lambdaL
 		if newScore < currentScore or random.uniform(0,1) > np.exp(currentScore-newScore):
 			lamb, k = newParameters
 			currentScore = newScore
+			accepted = True
+		else:
+			accepted = False
+		
+		if telemetry is not None:
+			telemetry.evaluations[run] += 1
+			if accepted:
+				telemetry.acceptedMoves[run] += 1
+			else:
+				telemetry.rejectedMoves[run] += 1
+			telemetry.bestScoreTrajectory[run,iteration+1] = bestScore
 			
 		iteration += 1
 	return bestParameters, bestScore
 
-def _updateParameter(value,limits,iteration,maxIterations):
+def _updateParameter(value,limits,iteration,maxIterations,telemetry=None,run=0):
 	
 	while True:
 		delta = (1-iteration/maxIterations)*0.1*(limits[1]-limits[0])
 		newValue = value + random.uniform(-delta,delta)
 		if limits[0] <= newValue <= limits[1] and newValue != 0:
 			return newValue
+		if telemetry is not None:
+			telemetry.redraws[run] += 1
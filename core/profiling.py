@@ -0,0 +1,174 @@
+'''
+Lightweight timing of the stages of a calculation.
+
+Profiling is disabled by default, in which case span() returns a shared
+context manager that does nothing and functions decorated with timed() are
+called directly, so the instrumentation costs a flag check per call. Once
+enabled, each span records its stage name, the deposit being processed, its
+start and end times and the process and thread it ran in.
+
+The times come from time.perf_counter, which is shared between processes on
+the same machine, so spans recorded in worker processes can be returned with
+takeSpans() and merged into the parent's with addSpans().
+'''
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+Span = namedtuple("Span", "name deposit start end pid tid")
+
+PROFILE_FORMATS = ["text", "json", "chrome"]
+
+_enabled = False
+_spans = []
+# The deposit of the innermost span of each thread, as threads may process different deposits
+_threadState = threading.local()
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def isEnabled():
+    return _enabled
+
+class _NullSpan(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _TimingSpan(object):
+
+    __slots__ = ("name", "deposit", "start", "previousDeposit")
+
+    def __init__(self, name, deposit):
+        self.name = name
+        self.deposit = deposit
+
+    def __enter__(self):
+        self.previousDeposit = getattr(_threadState, "deposit", None)
+        if self.deposit is None:
+            self.deposit = self.previousDeposit
+        else:
+            _threadState.deposit = self.deposit
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *excInfo):
+        end = time.perf_counter()
+        _spans.append(Span(self.name, self.deposit, self.start, end, os.getpid(), threading.get_ident()))
+        _threadState.deposit = self.previousDeposit
+        return False
+
+def span(name, deposit=None):
+    """
+    Returns a context manager that times the stage name. If deposit is given,
+    the span and every span inside it are attributed to that deposit.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _TimingSpan(name, deposit)
+
+def timed(name):
+    """ Decorator that times every call of the function as the stage name """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _TimingSpan(name, None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def takeSpans():
+    """ Returns the spans recorded so far and forgets them """
+    global _spans
+    spans, _spans = _spans, []
+    return spans
+
+def addSpans(spans):
+    """ Adds spans recorded elsewhere, e.g. in a worker process """
+    _spans.extend(Span(*span) for span in spans)
+
+def getSpans():
+    return list(_spans)
+
+def summarise(spans):
+    """
+    Returns a dictionary of the total, mean and maximum time in seconds and the
+    number of calls of each stage, along with the total time of each stage for
+    each deposit. Times are inclusive of any spans inside them.
+    """
+    stages = {}
+    deposits = {}
+    for span in spans:
+        duration = span.end - span.start
+        stage = stages.setdefault(span.name, {"count" : 0, "total" : 0.0, "max" : 0.0})
+        stage["count"] += 1
+        stage["total"] += duration
+        stage["max"] = max(stage["max"], duration)
+        if span.deposit is not None:
+            depositStages = deposits.setdefault(span.deposit, {})
+            depositStages[span.name] = depositStages.get(span.name, 0.0) + duration
+    for stage in stages.values():
+        stage["mean"] = stage["total"]/stage["count"]
+    return {"stages" : stages, "deposits" : deposits}
+
+def formatSummary(summary):
+    """ Returns the summary as a table of text """
+    lines = ["{:<28}{:>8}{:>12}{:>12}{:>12}".format("Stage", "Calls", "Total (s)", "Mean (s)", "Max (s)")]
+    for name, stage in sorted(summary["stages"].items(), key=lambda item: -item[1]["total"]):
+        lines.append("{:<28}{:>8}{:>12.4f}{:>12.4f}{:>12.4f}".format(name, stage["count"], stage["total"], stage["mean"], stage["max"]))
+    for deposit, stages in summary["deposits"].items():
+        lines.append("")
+        lines.append(str(deposit))
+        for name, total in sorted(stages.items(), key=lambda item: -item[1]):
+            lines.append("    {:<24}{:>12.4f}".format(name, total))
+    return "\n".join(lines) + "\n"
+
+def toChromeTrace(spans):
+    """ Returns the spans in the Chrome trace event format, viewable in chrome://tracing or Perfetto """
+    origin = min((span.start for span in spans), default=0)
+    events = []
+    for span in spans:
+        events.append({"name" : span.name,
+                       "cat" : "ashcalc",
+                       "ph" : "X",
+                       "ts" : (span.start-origin)*1e6,
+                       "dur" : (span.end-span.start)*1e6,
+                       "pid" : span.pid,
+                       "tid" : span.tid,
+                       "args" : {"deposit" : span.deposit}})
+    return {"traceEvents" : events, "displayTimeUnit" : "ms"}
+
+def writeReport(outputFile, format="text", spans=None):
+    """ Writes the spans recorded, or the spans given, to outputFile in the given format """
+    if format not in PROFILE_FORMATS:
+        raise ValueError("Profile format must be one of: " + " ".join(PROFILE_FORMATS))
+    if spans is None:
+        spans = getSpans()
+    if format == "text":
+        outputFile.write(formatSummary(summarise(spans)))
+    elif format == "json":
+        summary = summarise(spans)
+        summary["spans"] = [span._asdict() for span in spans]
+        json.dump(summary, outputFile, indent=2)
+        outputFile.write("\n")
+    elif format == "chrome":
+        json.dump(toChromeTrace(spans), outputFile)
+        outputFile.write("\n")
@@ -4,19 +4,24 @@ Created on 2 Jul 2013
 @author: Matthew Daggitt
 '''
 
-from scipy import stats
 import numpy as np
 
+from core import profiling
 from core.geom import Line
     
 def calculateSingleLineRegression(xs,ys):
     """ Returns the least squares regression line through the provided coordinates """
     if len(xs) == 2:
-        # Case needed as stats.linregress occasionaly throughs warnings for length 2 datasets
+        # Case needed as the general case occasionally throws warnings for length 2 datasets
         slope = (ys[1]-ys[0])/(xs[1]-xs[0])
         intercept = ys[0] - slope*xs[0]
     else:
-        slope, intercept = stats.linregress(xs, ys)[0:2]
+        # Same calculation as scipy.stats.linregress, done directly to avoid importing scipy
+        xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+        xMean, yMean = xs.mean(), ys.mean()
+        xDeviations = xs - xMean
+        slope = np.dot(xDeviations, ys - yMean)/np.dot(xDeviations, xDeviations)
+        intercept = yMean - slope*xMean
     
     return Line(slope,intercept)
 
@@ -28,7 +33,34 @@ def meanRelativeSquaredError(xs,ys,func):
     """Return the mean relative squared error."""
     return sum([((func(x)-y)/y)**2 for x, y in zip(xs,ys)])/len(xs)
 
-def calculateMultiLineRegression(xs, ys, numberOfSegments):
+@profiling.timed("regression_table")
+def calculateRegressionTable(xs, ys):
+    """
+    Calculates the regression line and residual sum of squares for every
+    contiguous run of at least two points, once the data is sorted by x. The
+    table only depends on the data, so it can be reused when fitting different
+    numbers of segments to the same data.
+    
+    Returns
+    xs:tuple, ys:tuple      --  the data sorted by x
+    allLines:dict           --  maps (i,j) to the regression Line through points i to j inclusive
+    allErrors:dict          --  maps (i,j) to the residual sum of squares of that line
+    """
+    xs, ys = zip(*sorted(zip(xs,ys), key=lambda x: x[0]))
+    
+    n = len(xs)
+    allLines = {}
+    allErrors = {}
+    
+    for j in range(1,n):
+        for i in range(0,j):
+            segXs, segYs = xs[i:j+1], ys[i:j+1]
+            allLines[(i,j)] = calculateSingleLineRegression(segXs,segYs)
+            allErrors[(i,j)] = residualSumOfSquares(segXs,segYs,allLines[(i,j)].calcY) if allLines[(i,j)] is not None else float("inf")
+    
+    return xs, ys, allLines, allErrors
+
+def calculateMultiLineRegression(xs, ys, numberOfSegments, regressionTable=None):
     """
     Fits a specified number of linear segments to the provided data
     
@@ -36,14 +68,13 @@ def calculateMultiLineRegression(xs, ys, numberOfSegments):
     xs -- the x coordinates of the data
     ys -- the y coordinates of the data
     numberOfSegments -- the number of linear segments to fit to the data
+    regressionTable -- optional result of calculateRegressionTable(xs, ys), to avoid recalculating it
     
     Returns
     segmentLines:list           --  list of Line objects each representing a linear segment
     segmentLimits:list          --  list of n+1 integers, segmentLines[i] is valid between segmentLimits[i] and segmentLimits[i+1]
     """
     
-    xs, ys = zip(*sorted(zip(xs,ys), key=lambda x: x[0]))
-    
     uniqueXValues = set(xs)
     m = len(uniqueXValues)
     if len(uniqueXValues) < numberOfSegments*2:
@@ -51,17 +82,11 @@ def calculateMultiLineRegression(xs, ys, numberOfSegments):
                          (" " if numberOfSegments == 1 else "s ") +
                          "with only " + str(m) + " unique x-value" + (" " if m == 1 else "s "))
     
-    n = len(xs)
-    allLines = {}
-    allErrors = {}
-    
-    for j in range(1,n):
-        for i in range(0,j):
-            segXs, segYs = xs[i:j+1], ys[i:j+1]
-            allLines[(i,j)] = calculateSingleLineRegression(segXs,segYs)
-            allErrors[(i,j)] = residualSumOfSquares(segXs,segYs,allLines[(i,j)].calcY) if allLines[(i,j)] is not None else float("inf")
+    if regressionTable is None:
+        regressionTable = calculateRegressionTable(xs, ys)
+    xs, ys, allLines, allErrors = regressionTable
     
-    minTraversal = _findMinTraversal(allErrors,n,numberOfSegments)
+    minTraversal = _findMinTraversal(allErrors,len(xs),numberOfSegments)
     segmentLines = [allLines[(x,y)] for (x,y) in minTraversal]
     segmentLimits = _calculateSegments(xs,ys,segmentLines,minTraversal)
     
@@ -79,6 +104,7 @@ def _calculateSegments(xs,ys,lines,minTraversal):
       
     return bounds
             
+@profiling.timed("segmentation_search")
 def _findMinTraversal(scores,numberOfPoints,numberOfSteps):
     
     traversals = _compilePossibleTraversals(0,numberOfPoints,numberOfSteps)
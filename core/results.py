@@ -0,0 +1,463 @@
+'''
+Result objects returned by the model analyses.
+'''
+
+import abc
+import json
+import pickle
+
+import numpy as np
+
+from core import profiling
+from core.geom import Line
+from core.isopach import Isopach
+
+SQRT_PI = np.sqrt(np.pi)
+
+
+class ModelResults(metaclass=abc.ABCMeta):
+    """
+    Abstract base class for the results of a model analysis.
+    
+    Only the fitted parameters and the isopach data are stored, so results can be
+    pickled, cached and passed between processes. The thickness function is the
+    vectorised thickness method rather than a closure, built on _thickness, which
+    each subclass implements.
+    
+    Secondary diagnostics, such as mrse, are calculated from the parameters when
+    they are first accessed and then remembered. If fields is set to a list of
+    keys, only those are included by toDict, so unused diagnostics are never
+    calculated.
+    
+    For backwards compatibility the results also behave like the dictionaries
+    previously returned by the analyses: results["estimatedTotalVolume"],
+    results["thicknessFunction"] and results["isopachs"] all work, and values can
+    be changed with results[key] = value.
+    """
+    
+    __slots__ = ("sqrtAreasKM", "thicknessesM", "fields", "_isopachs", "_mrse")
+    
+    # Name of the model, used when serialising
+    model = None
+    # The dictionary keys, in the order they were previously returned
+    _keys = ()
+    # Keys that are not valid attribute names
+    _aliases = {}
+    # Keys that cannot be serialised to json
+    _unserializableKeys = ("thicknessFunction", "isopachs")
+    # Keys that are calculated when first accessed if they are not given
+    _lazyKeys = ("mrse",)
+    
+    _modelClasses = {}
+    
+    def __init__(self, isopachs, **parameters):
+        """
+        Takes the isopachs analysed and a keyword argument for each parameter,
+        named either by its key or its attribute. Lazily calculated values may
+        be omitted.
+        """
+        self.isopachs = isopachs
+        self.fields = None
+        self._mrse = None
+        for key in self._parameterKeys():
+            attribute = self._aliases.get(key, key)
+            if attribute in parameters:
+                setattr(self, attribute, parameters[attribute])
+            elif key in parameters or key not in self._lazyKeys:
+                setattr(self, attribute, parameters[key])
+    
+    @classmethod
+    def _parameterKeys(cls):
+        return [key for key in cls._keys if key not in cls._unserializableKeys]
+    
+    @classmethod
+    def register(cls, modelClass):
+        """ Class decorator recording the result class for each model name """
+        cls._modelClasses[modelClass.model] = modelClass
+        return modelClass
+    
+    @staticmethod
+    def fieldNames(model):
+        """ Returns the keys of the named model's results that can be included by toDict """
+        return ModelResults._modelClasses[model]._parameterKeys()
+    
+    ###################
+    ## Isopach data ##
+    ###################
+    
+    @property
+    def isopachs(self):
+        """ List of the Isopachs analysed """
+        return self._isopachs
+    
+    @isopachs.setter
+    def isopachs(self, isopachs):
+        self._isopachs = list(isopachs)
+        self.thicknessesM = np.array([isopach.thicknessM for isopach in isopachs], dtype=float)
+        self.sqrtAreasKM = np.array([isopach.sqrtAreaKM for isopach in isopachs], dtype=float)
+    
+    #########################
+    ## Thickness functions ##
+    #########################
+    
+    def thickness(self, x):
+        """
+        Returns the thickness T(x) (in metres) at square root area x. x may be a
+        number or an array, in which case an array of thicknesses is returned.
+        Points outside the domain of the model are nan.
+        """
+        xs = np.asarray(x, dtype=float)
+        with np.errstate(all="ignore"):
+            ts = np.where(self._outOfDomain(xs), np.nan, self._thickness(xs))
+        return ts if np.ndim(ts) else float(ts)
+    
+    def thicknessFunction(self, x):
+        """
+        Returns the thickness T(x) (in metres). Raises a ValueError if x is
+        outside the domain of the model.
+        """
+        self.checkDomain(x)
+        return self.thickness(x)
+    
+    @property
+    def mrse(self):
+        """ The mean relative squared error of the model, calculated on first access """
+        if self._mrse is None:
+            self._mrse = self.calculateMRSE()
+        return self._mrse
+    
+    @mrse.setter
+    def mrse(self, value):
+        self._mrse = value
+    
+    @profiling.timed("mrse")
+    def calculateMRSE(self):
+        """ Returns the mean relative squared error of the model for the isopachs """
+        self.checkDomain(self.sqrtAreasKM)
+        relativeErrors = (self.thickness(self.sqrtAreasKM)-self.thicknessesM)/self.thicknessesM
+        return float(np.mean(relativeErrors**2))
+    
+    def calculateFields(self):
+        """
+        Calculates the lazily calculated values that toDict includes, so that
+        they are stored when the results are pickled. Returns True if any value
+        was calculated.
+        """
+        calculated = False
+        for key in self._lazyKeys:
+            if (self.fields is None or key in self.fields) and getattr(self, "_" + key) is None:
+                getattr(self, key)
+                calculated = True
+        return calculated
+    
+    @abc.abstractmethod
+    def _thickness(self, xs):
+        """ Returns the array of thicknesses of the model at the array xs, ignoring its domain """
+    
+    def _outOfDomain(self, xs):
+        return np.zeros(np.shape(xs), dtype=bool)
+    
+    def checkDomain(self, x):
+        """ Raises a ValueError if any of x is outside the domain of the model """
+        if np.any(self._outOfDomain(np.asarray(x, dtype=float))):
+            raise ValueError(self._domainErrorMessage(x))
+    
+    def _domainErrorMessage(self, x):
+        return "x (" + str(x) + ") is not in the domain of the function"
+    
+    #######################
+    ## Dictionary access ##
+    #######################
+    
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        return getattr(self, self._aliases.get(key, key))
+    
+    def __setitem__(self, key, value):
+        if key not in self._keys or key == "thicknessFunction":
+            raise KeyError(key)
+        setattr(self, self._aliases.get(key, key), value)
+    
+    def __contains__(self, key):
+        return key in self._keys
+    
+    def __iter__(self):
+        return iter(self._keys)
+    
+    def __len__(self):
+        return len(self._keys)
+    
+    def keys(self):
+        return list(self._keys)
+    
+    def values(self):
+        return [self[key] for key in self._keys]
+    
+    def items(self):
+        return [(key, self[key]) for key in self._keys]
+    
+    def get(self, key, default=None):
+        return self[key] if key in self._keys else default
+    
+    def copy(self):
+        """ Returns a dictionary of the results """
+        return dict(self.items())
+    
+    def toDict(self):
+        """
+        Returns a dictionary of the results that can be serialised to json. If
+        fields is set only those keys are included, and a ValueError is raised
+        if any of them is not a key of the results.
+        """
+        keys = self._parameterKeys()
+        if self.fields is not None:
+            unknownFields = [field for field in self.fields if field not in keys]
+            if unknownFields:
+                raise ValueError("Unknown %s result fields: %s" % (self.model, ", ".join(unknownFields)))
+            keys = [key for key in keys if key in self.fields]
+        return dict((key, self[key]) for key in keys)
+    
+    ###################
+    ## Serialisation ##
+    ###################
+    
+    def toBytes(self):
+        """ Returns the results pickled into bytes """
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+    
+    @staticmethod
+    def fromBytes(data):
+        """ Returns the results from bytes created by toBytes """
+        results = pickle.loads(data)
+        if not isinstance(results, ModelResults):
+            raise ValueError("Data does not contain model results")
+        return results
+    
+    def toJSON(self):
+        """ Returns a json string containing the model, isopach data and parameters """
+        return json.dumps({"model" : self.model,
+                           "isopachs" : [[t, a] for t, a in zip(self.thicknessesM.tolist(), self.sqrtAreasKM.tolist())],
+                           "parameters" : self.toDict()},
+                          separators=(",", ":"))
+    
+    @staticmethod
+    def fromJSON(text):
+        """ Returns the results from a json string created by toJSON """
+        data = json.loads(text)
+        modelClass = ModelResults._modelClasses[data["model"]]
+        isopachs = [Isopach(t, a) for t, a in data["isopachs"]]
+        parameters = modelClass._parametersFromJSON(data["parameters"])
+        return modelClass(isopachs, **parameters)
+    
+    @classmethod
+    def _parametersFromJSON(cls, parameters):
+        return parameters
+    
+    def __repr__(self):
+        return "<%s volume:%s>" % (type(self).__name__, str(self.estimatedTotalVolume))
+
+
+@ModelResults.register
+class ExponentialResults(ModelResults):
+    """
+    Results of exponentialModelAnalysis, see it for the meaning of each value.
+    """
+    
+    __slots__ = ("estimatedTotalVolume", "segmentLimits", "segmentVolumes", "segmentCoefficients",
+                 "segmentExponents", "segmentBts", "regressionLines", "numberOfSegments")
+    
+    model = "exponential"
+    _keys = ("estimatedTotalVolume", "thicknessFunction", "segmentLimits", "segmentVolumes",
+             "segmentCoefficients", "segmentExponents", "segmentBts", "regressionLines",
+             "isopachs", "numberOfSegments", "mrse")
+    
+    def _segmentIndices(self, xs):
+        """ Returns the segment containing each x, or -1 if there is none """
+        indices = np.full(np.shape(xs), -1)
+        for i in range(self.numberOfSegments):
+            inSegment = (self.segmentLimits[i] <= xs) & (xs < self.segmentLimits[i+1]) & (indices == -1)
+            indices = np.where(inSegment, i, indices)
+        return indices
+    
+    def _thickness(self, xs):
+        indices = self._segmentIndices(xs)
+        coefficients = np.asarray(self.segmentCoefficients, dtype=float)[indices]
+        exponents = np.asarray(self.segmentExponents, dtype=float)[indices]
+        return coefficients*np.exp(-exponents*xs)
+    
+    def _outOfDomain(self, xs):
+        return self._segmentIndices(xs) == -1
+    
+    def _domainErrorMessage(self, x):
+        return "x (" + str(x) + ") is not in the domain of the function (0 to infinity)"
+    
+    @classmethod
+    def _parametersFromJSON(cls, parameters):
+        parameters["regressionLines"] = [Line(*line) for line in parameters["regressionLines"]]
+        return parameters
+
+
+@ModelResults.register
+class PowerLawResults(ModelResults):
+    """
+    Results of powerLawModelAnalysis, see it for the meaning of each value.
+    """
+    
+    __slots__ = ("estimatedTotalVolume", "regressionLine", "coefficient", "exponent",
+                 "proximalLimitKM", "distalLimitKM", "_suggestedProximalLimit", "_exponentialResults")
+    
+    model = "power_law"
+    _keys = ("estimatedTotalVolume", "thicknessFunction", "regressionLine", "coefficient", "exponent",
+             "isopachs", "proximalLimitKM", "distalLimitKM", "suggestedProximalLimit", "mrse")
+    _lazyKeys = ("suggestedProximalLimit", "mrse")
+    
+    def __init__(self, isopachs, exponentialResults=None, **parameters):
+        """
+        exponentialResults may be the results of a 2 segment exponential analysis of
+        the isopachs, used when calculating the suggested proximal limit.
+        """
+        self._suggestedProximalLimit = None
+        self._exponentialResults = exponentialResults
+        ModelResults.__init__(self, isopachs, **parameters)
+    
+    @property
+    def suggestedProximalLimit(self):
+        """
+        The proximal limit suggested by Bonadonna and Houghton 2005, calculated on first
+        access. Requires 4 or more isopachs, otherwise it is "N/A".
+        """
+        if self._suggestedProximalLimit is None:
+            if len(self.sqrtAreasKM) > 3:
+                # Imported here as the power law model module imports this one
+                from core.models.power_law import calculateProximalLimitEstimate
+                self._suggestedProximalLimit = calculateProximalLimitEstimate(self.isopachs, self.coefficient,
+                                                                              self.exponent, self._exponentialResults)
+            else:
+                self._suggestedProximalLimit = "N/A"
+            # No longer needed, so not kept when the results are pickled
+            self._exponentialResults = None
+        return self._suggestedProximalLimit
+    
+    @suggestedProximalLimit.setter
+    def suggestedProximalLimit(self, value):
+        self._suggestedProximalLimit = value
+    
+    def _thickness(self, xs):
+        return self.coefficient*(xs**-self.exponent)
+    
+    def _outOfDomain(self, xs):
+        return (xs < self.proximalLimitKM*SQRT_PI) | (xs > self.distalLimitKM*SQRT_PI)
+    
+    def _domainErrorMessage(self, x):
+        return "x is out of range of proximal and distal limits of integration"
+    
+    @classmethod
+    def _parametersFromJSON(cls, parameters):
+        parameters["regressionLine"] = Line(*parameters["regressionLine"])
+        return parameters
+
+
+@ModelResults.register
+class WeibullResults(ModelResults):
+    """
+    Results of weibullModelAnalysis, see it for the meaning of each value.
+    """
+    
+    __slots__ = ("estimatedTotalVolume", "lamb", "k", "theta", "bestScore", "limits", "telemetry")
+    
+    model = "weibull"
+    _keys = ("estimatedTotalVolume", "thicknessFunction", "lambda", "k", "theta", "bestScore",
+             "isopachs", "limits", "mrse", "telemetry")
+    _aliases = {"lambda" : "lamb"}
+    
+    def __init__(self, isopachs, **parameters):
+        """ telemetry may be a WeibullTelemetry recorded by the solver, otherwise it is None """
+        parameters.setdefault("telemetry", None)
+        ModelResults.__init__(self, isopachs, **parameters)
+    
+    def toDict(self):
+        values = ModelResults.toDict(self)
+        if values.get("telemetry", 0) is None:
+            del values["telemetry"]
+        elif "telemetry" in values:
+            values["telemetry"] = values["telemetry"].toDict()
+        return values
+    
+    @classmethod
+    def _parametersFromJSON(cls, parameters):
+        if "telemetry" in parameters:
+            parameters["telemetry"] = WeibullTelemetry.fromDict(parameters["telemetry"])
+        return parameters
+    
+    def _thickness(self, xs):
+        return np.exp(np.log(self.theta)+(self.k-2)*np.log(xs/self.lamb)-(xs/self.lamb)**self.k)
+
+
+class WeibullTelemetry(object):
+    """
+    Counters and traces recorded by the Weibull solver, in arrays allocated
+    before the solver starts with an entry (or row) per run.
+    
+        startParameters:array      --  the starting lambda and k of each run.
+        evaluations:array          --  the number of evaluations of the error function.
+        acceptedMoves:array        --  the number of moves accepted.
+        rejectedMoves:array        --  the number of moves rejected.
+        redraws:array              --  the number of parameter values redrawn because they
+                                       were outside the limits.
+        bestScores:array           --  the best score found by each run.
+        bestScoreTrajectory:array  --  the best score of each run after each iteration, the
+                                       first column being the score of the starting parameters.
+        runTimes:array             --  the time taken by each run in seconds.
+    """
+    
+    __slots__ = ("startParameters", "evaluations", "acceptedMoves", "rejectedMoves", "redraws",
+                 "bestScores", "bestScoreTrajectory", "runTimes")
+    
+    def __init__(self, numberOfRuns, iterationsPerRun):
+        self.startParameters = np.zeros((numberOfRuns, 2))
+        self.evaluations = np.zeros(numberOfRuns, dtype=int)
+        self.acceptedMoves = np.zeros(numberOfRuns, dtype=int)
+        self.rejectedMoves = np.zeros(numberOfRuns, dtype=int)
+        self.redraws = np.zeros(numberOfRuns, dtype=int)
+        self.bestScores = np.full(numberOfRuns, np.inf)
+        self.bestScoreTrajectory = np.full((numberOfRuns, iterationsPerRun+1), np.nan)
+        self.runTimes = np.zeros(numberOfRuns)
+    
+    def acceptanceRates(self):
+        """ Returns the fraction of moves accepted by each run """
+        with np.errstate(all="ignore"):
+            return self.acceptedMoves/(self.acceptedMoves+self.rejectedMoves)
+    
+    def iterationsToBest(self, tolerance=0):
+        """
+        Returns the number of iterations each run took to get within tolerance of
+        the best score it found.
+        """
+        withinTolerance = self.bestScoreTrajectory <= self.bestScores[:,None] + tolerance
+        return np.argmax(withinTolerance, axis=1)
+    
+    def toDict(self):
+        """
+        Returns a dictionary of the telemetry that can be serialised to json.
+        Values that are not finite, such as the scores of runs that were never
+        started, are None.
+        """
+        values = {}
+        for name in self.__slots__:
+            array = getattr(self, name)
+            if array.dtype.kind == "f":
+                array = np.where(np.isfinite(array), array, None)
+            values[name] = array.tolist()
+        return values
+    
+    @staticmethod
+    def fromDict(values):
+        """ Returns the telemetry from a dictionary created by toDict, in which None is nan """
+        telemetry = WeibullTelemetry(0, 0)
+        for name in WeibullTelemetry.__slots__:
+            setattr(telemetry, name, np.asarray(values[name], dtype=getattr(telemetry, name).dtype))
+        return telemetry
+    
+    def __repr__(self):
+        return "<WeibullTelemetry runs:%d>" % len(self.evaluations)
@@ -0,0 +1,247 @@
+'''
+Synthetic deposits for scale and accuracy testing.
+
+Deposits are generated from known exponential, power law or Weibull
+parameters, so the true volume is known, with a configurable number of
+isopachs, spacing and noise. Given the same seed the same deposits are
+generated. Catalogs of deposits can be written as isopach files, which can be
+read by read_isopach_file, or as a single npz file holding the flat arrays and
+offsets used by core.batch.
+
+The parameters of each model use the same names as the results of its
+analysis:
+
+    exponential  --  segmentCoefficients, segmentExponents and segmentLimits (the
+                     bounds of the segments, from 0 to infinity).
+    power_law    --  coefficient, exponent, proximalLimitKM and distalLimitKM.
+    weibull      --  lambda, k and theta.
+'''
+
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from core.isopach import Isopach
+from core.models.exponential import calculateExponentialSegmentVolume
+from core.models.power_law import calculatePowerLawVolume
+from core.models.weibull import calculateWeibullVolume
+
+MODEL_NAMES = ["exponential", "power_law", "weibull"]
+NOISE_MODELS = ["none", "lognormal", "gaussian", "uniform"]
+SPACINGS = ["linear", "log", "random"]
+
+SQRT_PI = np.sqrt(np.pi)
+
+# Square root areas (in km) of the isopachs generated for each model, unless given
+DEFAULT_SQRT_AREA_RANGE_KM = (2, 200)
+
+SyntheticDeposit = namedtuple("SyntheticDeposit", "model parameters isopachs volume")
+
+########################
+## Model calculations ##
+########################
+
+def modelThickness(model, parameters, sqrtAreasKM):
+    """ Returns an array of the thicknesses (in metres) of the model at the given square root areas """
+    xs = np.asarray(sqrtAreasKM, dtype=float)
+    if model == "exponential":
+        limits = np.asarray(parameters["segmentLimits"], dtype=float)
+        indices = np.clip(np.searchsorted(limits, xs, side="right")-1, 0, len(limits)-2)
+        coefficients = np.asarray(parameters["segmentCoefficients"], dtype=float)[indices]
+        exponents = np.asarray(parameters["segmentExponents"], dtype=float)[indices]
+        return coefficients*np.exp(-exponents*xs)
+    elif model == "power_law":
+        return parameters["coefficient"]*xs**-parameters["exponent"]
+    elif model == "weibull":
+        scaledXs = xs/parameters["lambda"]
+        return parameters["theta"]*scaledXs**(parameters["k"]-2)*np.exp(-scaledXs**parameters["k"])
+    raise ValueError("Model must be one of: " + " ".join(MODEL_NAMES))
+
+def modelVolume(model, parameters):
+    """ Returns the true volume (in km3) of a deposit with the given model parameters """
+    if model == "exponential":
+        limits = parameters["segmentLimits"]
+        return sum(calculateExponentialSegmentVolume(coefficient, exponent, limits[i], limits[i+1])
+                   for i, (coefficient, exponent) in enumerate(zip(parameters["segmentCoefficients"],
+                                                                   parameters["segmentExponents"])))
+    elif model == "power_law":
+        return calculatePowerLawVolume(parameters["coefficient"], parameters["exponent"],
+                                       parameters["proximalLimitKM"]*SQRT_PI,
+                                       parameters["distalLimitKM"]*SQRT_PI)
+    elif model == "weibull":
+        return calculateWeibullVolume(parameters["lambda"], parameters["k"], parameters["theta"])
+    raise ValueError("Model must be one of: " + " ".join(MODEL_NAMES))
+
+def randomParameters(model, generator, numberOfSegments=1):
+    """
+    Returns a dictionary of random, but realistic, parameters for the model.
+    Exponential segments become shallower with distance and meet at the
+    segment limits.
+    """
+    if model == "exponential":
+        exponents = np.sort(generator.uniform(0.005, 0.2, numberOfSegments))[::-1]
+        breaks = np.sort(generator.uniform(10, 150, numberOfSegments-1))
+        coefficients = [np.exp(generator.uniform(np.log(0.5), np.log(20)))]
+        for i in range(numberOfSegments-1):
+            coefficients.append(coefficients[i]*np.exp(-(exponents[i]-exponents[i+1])*breaks[i]))
+        return {"segmentCoefficients" : [float(c) for c in coefficients],
+                "segmentExponents" : exponents.tolist(),
+                "segmentLimits" : [0.0] + breaks.tolist() + [float("inf")]}
+    elif model == "power_law":
+        return {"coefficient" : float(np.exp(generator.uniform(np.log(10), np.log(200)))),
+                "exponent" : float(generator.uniform(1.1, 1.9)),
+                "proximalLimitKM" : 1.0,
+                "distalLimitKM" : 300.0}
+    elif model == "weibull":
+        return {"lambda" : float(generator.uniform(20, 500)),
+                "k" : float(generator.uniform(0.5, 1.5)),
+                "theta" : float(np.exp(generator.uniform(np.log(0.005), np.log(0.5))))}
+    raise ValueError("Model must be one of: " + " ".join(MODEL_NAMES))
+
+#####################
+## Generating data ##
+#####################
+
+def generateSqrtAreas(numberOfIsopachs, sqrtAreaRangeKM, spacing, generator):
+    """ Returns a sorted array of square root areas (in km) within the range """
+    lower, upper = sqrtAreaRangeKM
+    if spacing == "linear":
+        return np.linspace(lower, upper, numberOfIsopachs)
+    elif spacing == "log":
+        return np.geomspace(lower, upper, numberOfIsopachs)
+    elif spacing == "random":
+        return np.sort(np.exp(generator.uniform(np.log(lower), np.log(upper), numberOfIsopachs)))
+    raise ValueError("Spacing must be one of: " + " ".join(SPACINGS))
+
+def addNoise(thicknessesM, noise, noiseLevel, generator):
+    """
+    Returns the thicknesses with relative noise of the given level added.
+
+        lognormal  --  multiplied by exp(N(0, noiseLevel)).
+        gaussian   --  multiplied by 1 + N(0, noiseLevel), kept positive.
+        uniform    --  multiplied by U(1 - noiseLevel, 1 + noiseLevel).
+    """
+    thicknessesM = np.asarray(thicknessesM, dtype=float)
+    if noise == "none" or noiseLevel == 0:
+        return thicknessesM.copy()
+    elif noise == "lognormal":
+        return thicknessesM*np.exp(generator.normal(0, noiseLevel, len(thicknessesM)))
+    elif noise == "gaussian":
+        return thicknessesM*np.maximum(1+generator.normal(0, noiseLevel, len(thicknessesM)), 0.01)
+    elif noise == "uniform":
+        return thicknessesM*generator.uniform(1-noiseLevel, 1+noiseLevel, len(thicknessesM))
+    raise ValueError("Noise must be one of: " + " ".join(NOISE_MODELS))
+
+def _defaultSqrtAreaRange(model, parameters):
+    if model == "power_law":
+        # Isopachs must be within the limits of integration
+        return (max(DEFAULT_SQRT_AREA_RANGE_KM[0], parameters["proximalLimitKM"]*SQRT_PI),
+                min(DEFAULT_SQRT_AREA_RANGE_KM[1], parameters["distalLimitKM"]*SQRT_PI))
+    return DEFAULT_SQRT_AREA_RANGE_KM
+
+def _getGenerator(seed):
+    return seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+
+def generateDeposit(model, parameters=None, numberOfIsopachs=8, noise="lognormal", noiseLevel=0.05,
+                    spacing="log", sqrtAreaRangeKM=None, numberOfSegments=1, seed=None):
+    """
+    Generates a deposit following the model.
+
+    Arguments
+    model:str                  --  one of MODEL_NAMES.
+    parameters:dict            --  the model parameters, random if not given.
+    numberOfIsopachs:int       --  the number of isopachs.
+    noise:str                  --  one of NOISE_MODELS, see addNoise.
+    noiseLevel:float           --  the relative size of the noise.
+    spacing:str                --  one of SPACINGS, how the isopachs are spaced.
+    sqrtAreaRangeKM:2-tuple    --  the range of square root areas of the isopachs.
+    numberOfSegments:int       --  the number of segments of random exponential parameters.
+    seed:int or Generator      --  seed, or numpy Generator, for the random numbers.
+
+    Returns
+    A SyntheticDeposit of the model, parameters, list of Isopachs and true volume.
+    """
+    generator = _getGenerator(seed)
+    if parameters is None:
+        parameters = randomParameters(model, generator, numberOfSegments)
+    if sqrtAreaRangeKM is None:
+        sqrtAreaRangeKM = _defaultSqrtAreaRange(model, parameters)
+
+    sqrtAreasKM = generateSqrtAreas(numberOfIsopachs, sqrtAreaRangeKM, spacing, generator)
+    thicknessesM = addNoise(modelThickness(model, parameters, sqrtAreasKM), noise, noiseLevel, generator)
+    isopachs = [Isopach(t, x) for t, x in zip(thicknessesM.tolist(), sqrtAreasKM.tolist())]
+    return SyntheticDeposit(model, parameters, isopachs, float(modelVolume(model, parameters)))
+
+def generateCatalog(numberOfDeposits, models=MODEL_NAMES, numberOfIsopachs=(5, 20), seed=None, **kwargs):
+    """
+    Generates a list of deposits, each following a model chosen at random from
+    models with random parameters. numberOfIsopachs may be an int or a
+    (minimum, maximum) tuple, in which case each deposit has a random number
+    of isopachs in the range. Other keyword arguments are passed to
+    generateDeposit.
+    """
+    generator = _getGenerator(seed)
+    if isinstance(numberOfIsopachs, int):
+        numberOfIsopachs = (numberOfIsopachs, numberOfIsopachs)
+    deposits = []
+    for _ in range(numberOfDeposits):
+        model = models[generator.integers(len(models))]
+        count = int(generator.integers(numberOfIsopachs[0], numberOfIsopachs[1]+1))
+        deposits.append(generateDeposit(model, numberOfIsopachs=count, seed=generator, **kwargs))
+    return deposits
+
+#############
+## Writing ##
+#############
+
+def writeIsopachFile(filename, deposit):
+    """
+    Writes the deposit as an isopach file, with its model, parameters and true
+    volume as comments.
+    """
+    with open(filename, "w") as isopachFile:
+        isopachFile.write("# model: " + deposit.model + "\n")
+        isopachFile.write("# parameters: " + json.dumps(deposit.parameters) + "\n")
+        isopachFile.write("# volume: " + repr(deposit.volume) + "\n")
+        for isopach in deposit.isopachs:
+            isopachFile.write(repr(isopach.thicknessM) + "," + repr(isopach.sqrtAreaKM) + "\n")
+
+def writeCatalogFiles(directory, deposits, prefix="deposit"):
+    """ Writes each deposit as an isopach file in directory and returns the list of filenames """
+    os.makedirs(directory, exist_ok=True)
+    width = len(str(len(deposits)))
+    filenames = []
+    for i, deposit in enumerate(deposits):
+        filename = os.path.join(directory, "%s_%0*d.csv" % (prefix, width, i))
+        writeIsopachFile(filename, deposit)
+        filenames.append(filename)
+    return filenames
+
+def writeCatalogNpz(filename, deposits):
+    """
+    Writes the deposits to a single compressed npz file with the flat
+    thicknessesM, sqrtAreasKM and offsets arrays used by core.batch, along with
+    the models, parameters (as json) and true volumes of the deposits.
+    """
+    counts = [len(deposit.isopachs) for deposit in deposits]
+    np.savez_compressed(filename,
+                        thicknessesM=np.array([i.thicknessM for d in deposits for i in d.isopachs], dtype=float),
+                        sqrtAreasKM=np.array([i.sqrtAreaKM for d in deposits for i in d.isopachs], dtype=float),
+                        offsets=np.concatenate(([0], np.cumsum(counts))).astype(int),
+                        models=np.array([deposit.model for deposit in deposits], dtype=str),
+                        parameters=np.array([json.dumps(deposit.parameters) for deposit in deposits], dtype=str),
+                        volumes=np.array([deposit.volume for deposit in deposits], dtype=float))
+
+def readCatalogNpz(filename):
+    """ Returns the list of SyntheticDeposits in an npz file written by writeCatalogNpz """
+    with np.load(filename) as data:
+        offsets = data["offsets"]
+        deposits = []
+        for i, (model, parameters, volume) in enumerate(zip(data["models"], data["parameters"], data["volumes"])):
+            start, end = offsets[i], offsets[i+1]
+            isopachs = [Isopach(t, x) for t, x in zip(data["thicknessesM"][start:end].tolist(),
+                                                     data["sqrtAreasKM"][start:end].tolist())]
+            deposits.append(SyntheticDeposit(str(model), json.loads(str(parameters)), isopachs, float(volume)))
+    return deposits
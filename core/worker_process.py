@@ -0,0 +1,152 @@
+'''
+Long-lived worker process that can be terminated mid-calculation.
+'''
+
+import multiprocessing
+import random
+import signal
+import threading
+
+from core.exceptions import CalculationCancelled
+
+# Connection to the parent, set within a worker process
+_connection = None
+
+
+class WorkerProcess(object):
+    """
+    Runs functions in a separate process, one at a time. The process is kept
+    between calculations to avoid the cost of starting a new one, but unlike a
+    thread it can be terminated if a calculation is no longer wanted.
+    
+    The function and its arguments and result must be picklable. receive may
+    be called from a different thread to the other methods.
+    """
+    
+    def __init__(self):
+        self._process = None
+        self._connection = None
+        self.busy = False
+        # The connection a receive is waiting on, which terminate leaves open
+        self._lock = threading.Lock()
+        self._receivingConnection = None
+
+    def start(self):
+        """ Starts the process if it is not already running """
+        if self._process is not None and self._process.is_alive():
+            return
+        parentConnection, childConnection = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_workerLoop, args=(childConnection,), daemon=True)
+        self._process.start()
+        childConnection.close()
+        self._connection = parentConnection
+        self.busy = False
+
+    def submit(self, function, args=(), kwargs=None):
+        """ Starts calculating function(*args, **kwargs) in the process """
+        if self.busy:
+            raise RuntimeError("Worker process is already calculating")
+        self.start()
+        self._connection.send((function, args, kwargs or {}))
+        self.busy = True
+
+    def poll(self, timeout=0):
+        """ Returns True if a message from the calculation is waiting to be received """
+        return self.busy and self._connection.poll(timeout)
+
+    def receive(self):
+        """
+        Blocks until the calculation sends a message and returns it as a (kind, value)
+        tuple. The final message of a calculation is either ("result", value) or
+        ("error", exception), and may be preceded by messages the calculation sends
+        with sendMessage, such as ("progress", value).
+        
+        If the process is terminated while waiting, or before, ("error",
+        CalculationCancelled()) is returned.
+        """
+        with self._lock:
+            connection = self._connection
+            self._receivingConnection = connection
+        try:
+            if connection is None:
+                raise EOFError()
+            kind, value = connection.recv()
+        except (EOFError, OSError, ValueError):
+            kind, value = "error", CalculationCancelled()
+        finally:
+            with self._lock:
+                self._receivingConnection = None
+                detached = connection is not self._connection
+            if detached and connection is not None:
+                # Terminated while waiting, so the connection was left for us to close
+                connection.close()
+
+        if kind in ("result", "error") and not detached:
+            self.busy = False
+        return kind, value
+
+    def terminate(self):
+        """
+        Stops any running calculation by terminating the process. A new process is
+        started when the next calculation is submitted.
+        """
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+        with self._lock:
+            # A receive waiting on the connection gets EOFError now the process
+            # has gone, and closes it itself
+            if self._connection is not None and self._connection is not self._receivingConnection:
+                self._connection.close()
+            self._process = None
+            self._connection = None
+        self.busy = False
+
+    def shutdown(self):
+        """ Stops the process once any running calculation has finished """
+        if self._process is not None and self._process.is_alive() and not self.busy:
+            self._connection.send(None)
+            self._process.join()
+            self._connection.close()
+            self._process = None
+            self._connection = None
+        else:
+            self.terminate()
+
+
+def sendMessage(kind, value):
+    """
+    Sends a (kind, value) message to the parent from a calculation running in a
+    worker process, where it is returned by WorkerProcess.receive before the
+    result. Does nothing outside a worker process.
+    """
+    if _connection is not None:
+        _connection.send((kind, value))
+
+
+def _workerLoop(connection):
+    global _connection
+    _connection = connection
+    # Interrupts are handled by the parent process, which terminates the worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Forked processes would otherwise share the parent's random state
+    random.seed()
+    
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        function, args, kwargs = task
+        try:
+            result = function(*args, **kwargs)
+            message = ("result", result)
+        except Exception as e:
+            message = ("error", e)
+        try:
+            connection.send(message)
+        except Exception as e:
+            # The result could not be pickled
+            connection.send(("error", e))
@@ -1,4 +1,4 @@
-from tkinter.ttk import LabelFrame, Button, Progressbar
+from tkinter.ttk import LabelFrame, Button, Label, Progressbar
 
 class CalculationFrame(LabelFrame):
 	
@@ -10,4 +10,31 @@ class CalculationFrame(LabelFrame):
 		self.endCalculationB = Button(self,text="Cancel calculation",width=20)
 		self.endCalculationB.grid(row=1,column=0,padx=10,pady=5)
 		self.calculationPB = Progressbar(self, mode="indeterminate",length=128)
-		self.calculationPB.grid(row=2,column=0,padx=10,pady=5)
\ No newline at end of file
+		self.calculationPB.grid(row=2,column=0,padx=10,pady=5)
+		self.calculationProgressL = Label(self,text="")
+		self.calculationProgressL.grid(row=3,column=0,padx=10)
+
+	def startProgress(self):
+		"""
+		Shows the calculation is running with the indeterminate bar, until
+		setProgress is called
+		"""
+		self.calculationPB.configure(mode="indeterminate",value=0)
+		self.calculationPB.start(interval=3)
+		self.calculationProgressL.configure(text="")
+
+	def setProgress(self, fraction, text):
+		"""
+		Shows the fraction of the calculation complete on the bar and text,
+		such as the time remaining, below it
+		"""
+		if str(self.calculationPB.cget("mode")) != "determinate":
+			self.calculationPB.stop()
+			self.calculationPB.configure(mode="determinate",maximum=1.0)
+		self.calculationPB.configure(value=fraction)
+		self.calculationProgressL.configure(text=text)
+
+	def stopProgress(self):
+		self.calculationPB.stop()
+		self.calculationPB.configure(mode="indeterminate",value=0)
+		self.calculationProgressL.configure(text="")
\ No newline at end of file
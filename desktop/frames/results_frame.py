@@ -1,5 +1,6 @@
 import math
 import tkinter
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from tkinter import messagebox
 from tkinter.ttk import Frame, LabelFrame, Label, Button, Combobox, Separator
@@ -9,10 +10,10 @@ from matplotlib import pyplot
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg as FigureCanvas
 from mpl_toolkits.mplot3d import Axes3D
 
-from core import regression_methods
+from core import error_surface, regression_methods
 from core.models.exponential import calculateExponentialSegmentVolume
 from core.models.power_law import calculatePowerLawVolume
-from core.models.weibull import calculateWeibullVolume, calculateTheta
+from core.models.weibull import calculateWeibullVolume
 from desktop import helper_functions
 from desktop.custom_components import NumericEntry, CustomEntry, ImprovedNotebook, CutDownNavigationToolbar
 from settings import Model
@@ -27,12 +28,15 @@ SQRT_PI = np.sqrt(np.pi)
 
 MODEL_PLOTTING_PRECISION = 100
 
-ERROR_SURFACE_MAX_RESOLUTION = 100
+ERROR_SURFACE_MAX_RESOLUTION = 200
 ERROR_SURFACE_MIN_RESOLUTION = 5
 ERROR_SURFACE_DEFAULT_RESOLUTION = 50
 
 NUMBER_OF_SF = 4
 
+# Milliseconds between checks for a finished error surface
+ERROR_SURFACE_POLL_INTERVAL = 50
+
 class ResultsFrame(LabelFrame):
 
 	padY = 5
@@ -62,6 +66,14 @@ class ResultsFrame(LabelFrame):
 		self.errorSurfaceFrame = ErrorSurfaceFrame(self)
 		self.errorSurfaceFrame.errorSurfaceB.bind("<Button-1>", self._displayErrorSurface)
 
+		# Error surfaces are calculated in the background, in passes of increasing
+		# resolution, and only the latest is plotted. The tiles are only used by
+		# the executor's thread.
+		self.errorSurfaceExecutor = ThreadPoolExecutor(max_workers=1)
+		self.errorSurfaceTiles = error_surface.ErrorSurfaceTiles()
+		self.errorSurfaceFuture = None
+		self.errorSurfacePasses = []
+
 		# Graph notebook
 
 		self.errorSurfaceSeperator = Separator(self,orient=tkinter.HORIZONTAL)
@@ -110,6 +122,17 @@ class ResultsFrame(LabelFrame):
 
 	def _updateDisplay(self, comboboxUpdate):
 
+		graphFrames = [self.modelGraphFrame, self.regressionGraphFrame]
+		for graphFrame in graphFrames:
+			graphFrame.beginUpdate()
+		try:
+			self._updateModelDisplay(comboboxUpdate)
+		finally:
+			for graphFrame in graphFrames:
+				graphFrame.endUpdate()
+
+	def _updateModelDisplay(self, comboboxUpdate):
+
 		if not comboboxUpdate:
 			self.modelGraphFrame.clear()
 			self.regressionGraphFrame.clear()
@@ -466,29 +489,45 @@ class ResultsFrame(LabelFrame):
 
 		xs = [isopach.sqrtAreaKM for isopach in self.isopachs]
 		ys = [isopach.thicknessM for isopach in self.isopachs]
-
-		if self.modelType == Model.POW:
-			def errorFunction(c,m):
-				thicknessFunction = lambda x : c*(x**(-m))
-				return math.log(regression_methods.meanRelativeSquaredError(xs, ys, thicknessFunction))
-
-		elif self.modelType == Model.WEI:
-			def errorFunction(lamb,k):
-				theta = calculateTheta(xs,ys,lamb,k)
-				def thicknessFunction(x):
-					try:
-						return np.exp(np.log(theta)+(k-2)*np.log(x/lamb)-(x/lamb)**k)
-					except FloatingPointError:
-						return 0
-				mrse = regression_methods.meanRelativeSquaredError(xs, ys, thicknessFunction)
-				return math.log(mrse)
+		model = "power_law" if self.modelType == Model.POW else "weibull"
 
 		self.errorSurfaceGraphFrame.axes.set_ylabel(self.errorSurfaceFrame.ySymbol)
 		self.errorSurfaceGraphFrame.clear()
-		self.errorSurfaceGraphFrame.plotSurface(errorFunction, xLL, xUL, yLL, yUL, resolution)
-
 		self.graphNotebook.select(self.errorSurfaceGraphFrame)
 
+		# Any surface still being calculated is superseded by this one
+		self.errorSurfacePasses = [(model, xs, ys, xLL, xUL, yLL, yUL, levelX, levelY) for levelX, levelY in
+								   error_surface.progressiveLevels(xLL, xUL, yLL, yUL, resolution)]
+		self._startErrorSurfacePass()
+
+	def _startErrorSurfacePass(self):
+		surfacePass = self.errorSurfacePasses.pop(0)
+		self.errorSurfaceFuture = self.errorSurfaceExecutor.submit(self.errorSurfaceTiles.surface, *surfacePass)
+		self.after(ERROR_SURFACE_POLL_INTERVAL, self._pollErrorSurface, self.errorSurfaceFuture)
+
+	def _pollErrorSurface(self, future):
+		if future is not self.errorSurfaceFuture:
+			return
+		if not future.done():
+			self.after(ERROR_SURFACE_POLL_INTERVAL, self._pollErrorSurface, future)
+			return
+		self.errorSurfaceFuture = None
+		try:
+			X, Y, Z = future.result()
+		except Exception as e:
+			# Any failure in the worker ends the remaining passes
+			self.errorSurfacePasses = []
+			messagebox.showerror("Calculation error", str(e) or type(e).__name__)
+			return
+		self.errorSurfaceGraphFrame.beginUpdate()
+		try:
+			self.errorSurfaceGraphFrame.clear()
+			self.errorSurfaceGraphFrame.plotSurface(X, Y, Z)
+		finally:
+			self.errorSurfaceGraphFrame.endUpdate()
+		if self.errorSurfacePasses:
+			self._startErrorSurfacePass()
+
 
 	def _parametersReset(self,event):
 		self.currentParameters = deepcopy(self.defaultParameters)
@@ -533,6 +572,8 @@ class ResultsFrame(LabelFrame):
 			self.modelGraphFrame.clear()
 			self.regressionGraphFrame.clear()
 			self.errorSurfaceGraphFrame.clear()
+			self.errorSurfaceFuture = None
+			self.errorSurfacePasses = []
 
 			self.graphNotebook.removeFrame(self.regressionGraphFrame)
 			self.graphNotebook.removeFrame(self.errorSurfaceGraphFrame)
@@ -814,10 +855,52 @@ class GraphFrame(Frame):
 		else:
 			raise ValueError("Dimension must be either 2 or 3")
 
-		self.currentLines = []
+		# (kind, artist) pairs of what is plotted, and of what was cleared during
+		# an update and so can be reused by the plots that follow
+		self.currentArtists = []
+		self.staleArtists = []
+		self.updateDepth = 0
+		self.drawPending = False
+
+	def beginUpdate(self):
+		"""
+		Defers drawing the canvas until the matching endUpdate, so that a
+		series of plots is drawn once. Artists removed by clear during the
+		update are reused, with their data replaced, by the plots of the same
+		kind that follow rather than being recreated.
+		"""
+		self.updateDepth += 1
+
+	def endUpdate(self):
+		self.updateDepth -= 1
+		if self.updateDepth == 0:
+			for _, artist in self.staleArtists:
+				artist.remove()
+			self.staleArtists = []
+			if self.drawPending:
+				self.drawPending = False
+				self.canvas.draw_idle()
+
+	def _draw(self):
+		if self.updateDepth > 0:
+			self.drawPending = True
+		else:
+			self.canvas.draw_idle()
+
+	def _reuseArtist(self,kind):
+		for i, (staleKind, artist) in enumerate(self.staleArtists):
+			if staleKind == kind:
+				del self.staleArtists[i]
+				self.currentArtists.append((kind, artist))
+				return artist
+		return None
 
 	def plotScatter(self,xs,ys,zeroed):
-		self.currentLines.append(self.axes.scatter(xs,ys))
+		scatter = self._reuseArtist("scatter")
+		if scatter is None:
+			self.currentArtists.append(("scatter", self.axes.scatter(xs,ys)))
+		else:
+			scatter.set_offsets(np.column_stack([xs,ys]))
 		minX, maxX = min(xs), max(xs)
 		minY, maxY = min(ys), max(ys)
 		dx, dy = 0.25*(maxX-minX), 0.25*(maxY-minY)
@@ -825,48 +908,46 @@ class GraphFrame(Frame):
 		endX, endY = maxX+dx, maxY+dy
 		self.axes.set_xlim((startX,endX))
 		self.axes.set_ylim((startY,endY))
-		self.canvas.draw()
+		self._draw()
 
 	def plotLine(self,xs,ys,color):
-		self.currentLines.extend(self.axes.plot(xs,ys,color=color))
-		self.canvas.draw()
+		line = self._reuseArtist("line")
+		if line is None:
+			self.currentArtists.extend(("line", l) for l in self.axes.plot(xs,ys,color=color))
+		else:
+			line.set_data(xs,ys)
+			line.set_color(color)
+		self._draw()
 
 	def plotFilledLine(self,xs,ys,color):
-		self.currentLines.append(self.axes.fill_between(xs,ys,y2=0,alpha=0.5,color=color))
-		self.canvas.draw()
-
-	def plotSurface(self,zfunc,startX,endX,startY,endY,resolution):
-		xInc, yInc = (endX-startX)/resolution, (endY-startY)/resolution
-		xs = np.arange(startX,endX,xInc)
-		ys = np.arange(startY,endY,yInc)
-		X, Y = np.meshgrid(np.array(xs),np.array(ys))
-
-		Z = []
-		for row in range(resolution):
-			rowL = []
-			for col in range(resolution):
-				try:
-					v = zfunc(X[row][col],Y[row][col])
-					if v > 10**10:
-						rowL.append(np.nan)
-					else:
-						rowL.append(v)
-				except FloatingPointError:
-					rowL.append(np.nan)
-			Z.append(np.array(rowL))
-		Z = np.array(Z)
-
-		maxZ = max([max([r for r in row if not np.isnan(r)]) for row in Z])
-		minZ = min([min([r for r in row if not np.isnan(r)]) for row in Z])
-
-		self.currentLines.append(self.axes.plot_wireframe(X, Y, Z))
-		self.axes.set_xlim((startX,endX))
-		self.axes.set_ylim((startY,endY))
-		self.axes.set_zlim((minZ,maxZ))
-		self.canvas.draw()
+		fill = self._reuseArtist("fill")
+		if fill is None:
+			self.currentArtists.append(("fill", self.axes.fill_between(xs,ys,y2=0,alpha=0.5,color=color)))
+		else:
+			xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+			top = np.column_stack([xs, ys])
+			bottom = np.column_stack([xs[::-1], np.zeros(len(xs))])
+			fill.set_verts([np.concatenate([bottom[-1:], top, bottom[:1], bottom])])
+			fill.set_color(color)
+		self._draw()
+
+	def plotSurface(self,X,Y,Z):
+		"""
+		Plots the surface Z over the grid X, Y as a wireframe. Points where Z
+		is nan are left out.
+		"""
+		self.currentArtists.append(("wireframe", self.axes.plot_wireframe(X, Y, Z)))
+		self.axes.set_xlim((X.min(),X.max()))
+		self.axes.set_ylim((Y.min(),Y.max()))
+		if not np.all(np.isnan(Z)):
+			self.axes.set_zlim((np.nanmin(Z),np.nanmax(Z)))
+		self._draw()
 
 	def clear(self):
-		for l in self.currentLines:
-			l.remove()
-			self.currentLines = []
-		self.canvas.draw()
+		if self.updateDepth > 0:
+			self.staleArtists.extend(self.currentArtists)
+		else:
+			for _, artist in self.currentArtists:
+				artist.remove()
+		self.currentArtists = []
+		self._draw()
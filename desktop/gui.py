@@ -5,6 +5,7 @@ Created on 15 Aug 2013
 '''
 import math
 import textwrap
+import time
 
 import tkinter
 from tkinter import messagebox
@@ -14,10 +15,11 @@ np.seterr(all="ignore")
 
 from core.isopach import Isopach
 
+import settings
 from settings import Model
 from desktop import helper_functions
 from desktop.thread_handlers import ThreadHandler
-from desktop.timing_module import createWeibullTimingEstimationFunction
+from desktop.timing_module import WeibullTimingEstimator
 from desktop.tooltip import ToolTip
 
 from desktop.frames.model_frame import ModelFrame
@@ -44,7 +46,7 @@ class App(tkinter.ttk.Frame):
 		
 		self.threadHandler = ThreadHandler()
 		self.calculating = False
-		self.weibullTimingEstimationFunction = createWeibullTimingEstimationFunction()
+		self.weibullTimingEstimator = WeibullTimingEstimator(settings.WEI_TIMING_CACHE_FILE)
 		
 		self.calculationFrame = CalculationFrame(self)
 		self.calculationFrame.grid(row=0,column=0,sticky="NSWE",padx=10,pady=10)
@@ -67,8 +69,12 @@ class App(tkinter.ttk.Frame):
 
 		self.createTooltips()
 
+		# Timing the calibration fits is left until the window is shown
+		self.after_idle(self.startTimingCalibration)
+
 		self.pack()
 		self.mainloop()
+		self.threadHandler.shutdown()
 		
 	def startCalculation(self, event):
 		
@@ -83,7 +89,8 @@ class App(tkinter.ttk.Frame):
 		
 		self.resultsFrame.clear()
 
-		self.calculationFrame.calculationPB.start(interval=3)
+		self.calculationFrame.startProgress()
+		self.calculationStartTime = time.perf_counter()
 		self.calculationFrame.startCalculationB.configure(state=tkinter.DISABLED)
 		self.calculationFrame.startCalculationB.unbind("<Button-1>")
 		self.calculationFrame.endCalculationB.configure(state=tkinter.ACTIVE)
@@ -102,7 +109,20 @@ class App(tkinter.ttk.Frame):
 				self.resultsFrame.displayNewModel(modelType,results)
 			self.finishCalculation(None)
 		elif self.calculating:
+			self.showProgress()
 			self.after(100, self.poll)
+
+	def showProgress(self):
+		progress = self.threadHandler.getCurrentCalculationProgress()
+		if progress is None:
+			return
+		fraction, completedRuns, numberOfRuns, bestScore = progress
+		text = "Run " + str(min(completedRuns+1, numberOfRuns)) + "/" + str(numberOfRuns)
+		if fraction > 0:
+			elapsed = time.perf_counter() - self.calculationStartTime
+			remaining = elapsed*(1-fraction)/fraction
+			text += ", about " + helper_functions.roundToSF(remaining,2) + " s left"
+		self.calculationFrame.setProgress(fraction, text)
 	
 	def finishCalculation(self,_):
 		self.threadHandler.cancelLastCalculation()
@@ -111,7 +131,17 @@ class App(tkinter.ttk.Frame):
 		self.calculationFrame.startCalculationB.bind("<Button-1>", self.startCalculation)
 		self.calculationFrame.endCalculationB.configure(state=tkinter.DISABLED)
 		self.calculationFrame.endCalculationB.unbind("<Button-1>")
-		self.calculationFrame.calculationPB.stop()
+		self.calculationFrame.stopProgress()
+
+	def startTimingCalibration(self):
+		self.weibullTimingEstimator.loadOrCalibrateInBackground()
+		self.pollTimingCalibration()
+
+	def pollTimingCalibration(self):
+		if self.weibullTimingEstimator.isCalibrated():
+			self.estimateWeibullCalculationTime(None)
+		elif not self.weibullTimingEstimator.calibrationFailed():
+			self.after(100, self.pollTimingCalibration)
 
 	def estimateWeibullCalculationTime(self,event):
 		try:
@@ -120,7 +150,7 @@ class App(tkinter.ttk.Frame):
 			iterationsPerRun = int(self.modelFrame.weiIterationsPerRun_E.get())
 			if numberOfRuns <= 0 or iterationsPerRun <= 0 or numberOfIsopachs <= 0:
 				raise ValueError()
-			est = self.weibullTimingEstimationFunction(numberOfIsopachs,iterationsPerRun,numberOfRuns)
+			est = self.weibullTimingEstimator.estimate(numberOfIsopachs,iterationsPerRun,numberOfRuns)
 			self.modelFrame.weiEstimatedTime_E.insertNew(helper_functions.roundToSF(est,2))
 		except ValueError:
 			self.modelFrame.weiEstimatedTime_E.insertNew("N/A")
@@ -138,7 +168,7 @@ class App(tkinter.ttk.Frame):
 			(self.resultsFrame.statsFrame.relativeSquaredError_E, 		True, "A measure of the goodness of fit of the model. Comparisons are only valid when comparing different models for identical isopach data."),
 			(self.resultsFrame.statsFrame.expSegVolume_E, 				True, "The model's estimate for the volume of this segment of the tephra deposit."),
 			(self.resultsFrame.statsFrame.powSuggestedProximalLimit_E,	True, "An estimate for the proximal limit of integration as described in Bonadonna and Houghton 2005. Requires 4 or more isopachs."),
-			(self.resultsFrame.errorSurfaceFrame.errorResolutionE,		True, "The resolution of the error surface, which is modelled by a grid of 'resolution' x 'resolution' points."),
+			(self.resultsFrame.errorSurfaceFrame.errorResolutionE,		True, "The resolution of the error surface, which is modelled by a grid of about 'resolution' x 'resolution' points. A coarse surface is shown first and refined up to this resolution."),
 			
 			(self.isopachFrame.loadFromFileButton,						False, "Load isopach data from a CSV file of the form: \n\tthickness1, \u221AArea1\n\tthickness2, \u221AArea2\n\t...\n\tthicknessN, \u221AAreaN\nwith thickness in metres and \u221AArea in kilometres"),
 		]
@@ -4,9 +4,10 @@ Created on 19 Aug 2013
 @author: Matthew Daggitt
 '''
 
-from threading import Thread
-from queue import Queue
+import time
 
+from core import worker_process
+from core.exceptions import CalculationCancelled
 from core.models.exponential import exponentialModelAnalysis
 from core.models.power_law import powerLawModelAnalysis
 from core.models.weibull import weibullModelAnalysis
@@ -16,18 +17,26 @@ from settings import Model
 
 class ThreadHandler():
     """
-    Class for running calculations in a seperate thread
+    Class for running calculations in a seperate process, so that they
+    neither block the gui nor keep running once they have been cancelled.
+
+    The process is started when the handler is created and reused for each
+    calculation, and is only replaced when a calculation is cancelled.
     """
     def __init__(self):
-        self._resultsQueue = Queue()
-        self._currentThreadID = 0
+        self._worker = worker_process.WorkerProcess()
+        self._worker.start()
         self._currentCalculationType = None
         self._currentResult = None
-        
+        self._currentProgress = None
+        self._numberOfRuns = None
+        self._totalIterations = None
+
     def startCalculation(self, calculationType, args):
         """
-        Creates a WorkerThread to carry out func(*args). Will cause any
-        previous still running calculations to be cancelled
+        Starts carrying out the calculation of type calculationType on args in
+        the worker process. Will cause any previous still running calculations
+        to be cancelled
         """
 
         if calculationType == Model.EXP:
@@ -37,69 +46,91 @@ class ThreadHandler():
         elif calculationType == Model.WEI:
             function = weibullModelAnalysis
 
-        self._currentThreadID += 1
+        self.cancelLastCalculation()
         self._currentCalculationType = calculationType
-        newThread = WorkerThread(function, args, self._calculationFinished, self._resultsQueue, self._currentThreadID)
-        newThread.setDaemon(True)
-        newThread.start()
-        
-    def _calculationFinished(self):
-        """
-        Called internally by the WorkerThreads. If the calculation was cancelled
-        the result is ignored, otherwise if it ended in an error the result type is changed to error,
-        and the result of the calculation is stored in _currentResult ready for retrieval
-        """
-        threadID, results = self._resultsQueue.get_nowait()
-        if threadID == None:
-            self._currentResult = ("Error",results)
-        elif threadID == self._currentThreadID:
-            self._currentResult = (self._currentCalculationType,results)
-            
+        self._currentResult = None
+        self._currentProgress = None
+        if calculationType == Model.WEI:
+            # Only Weibull fits take long enough to be worth reporting progress
+            self._numberOfRuns = args[1]
+            self._totalIterations = args[1]*args[2]
+            self._worker.submit(function, args, {"progressCallback" : ProgressReporter()})
+        else:
+            self._totalIterations = None
+            self._worker.submit(function, args)
+
     def cancelLastCalculation(self):
         """
-        Tells the ThreadHandler to cancel the last calculation
-        At the moment this involves leaving the calculation to run and
-        ignoring the result when it is returned
+        Tells the ThreadHandler to cancel the last calculation. If it is still
+        running the worker process is terminated, and a new one is started for
+        the next calculation.
         """
-        self._currentThreadID += 1
-    
+        if self._worker.busy:
+            self._worker.terminate()
+
     def getCurrentCalculationResult(self):
         """
         Returns the result of the last calculation if finished
-        otherwise returns None
+        otherwise returns None. The result is a tuple of the calculation type
+        and the results, or of "Error" and the exception if the calculation
+        failed.
         """
-        if self._currentResult is not None:
-            result = self._currentResult
-            self._currentResult = None
-            return result
-        else:
-            return None
-        
-class WorkerThread(Thread):
-    """Subclass of Thread that performs the calculation"""
-    
-    def __init__(self, function, args, callbackFunction, resultsQueue, threadID):
-        Thread.__init__(self)
-        self.callbackFunction = callbackFunction
-        self._resultsQueue = resultsQueue
-        self.function = function
-        self.args = args
-        self.threadID = threadID
-        
-    def run(self):
+        self._receiveMessages()
+        result = self._currentResult
+        self._currentResult = None
+        return result
+
+    def getCurrentCalculationProgress(self):
         """
-        Performs the provided calculation and puts the result and the calculation type
-        back into the results queue when finished.
-        
-        If an error occurs it puts the result type "None" and the error instance into
-        the results queue.
-        
-        It then calls it's callback function to signify it's finished (usually the
-        ThreadHandler.calculationFinished() method)
+        Returns the progress of the last calculation as a tuple of the
+        fraction complete, the number of completed runs, the total number of
+        runs and the best score so far, or None if it has not reported any
+        progress.
         """
-        try:
-            result = self.function(*self.args)
-            self._resultsQueue.put((self.threadID,result))
-        except Exception as e:
-            self._resultsQueue.put((None,e))
-        self.callbackFunction()
+        self._receiveMessages()
+        return self._currentProgress
+
+    def _receiveMessages(self):
+        """
+        Receives any messages waiting from the worker process, keeping the
+        latest progress and the result if the calculation has finished
+        """
+        while self._worker.poll():
+            kind, value = self._worker.receive()
+            if kind == "progress":
+                completedRuns, completedIterations, bestScore = value
+                self._currentProgress = (completedIterations/self._totalIterations, completedRuns,
+                                         self._numberOfRuns, bestScore)
+            elif kind == "result":
+                self._currentResult = (self._currentCalculationType, value)
+            elif kind == "error":
+                if isinstance(value, CalculationCancelled):
+                    # Only received if the process died without being cancelled
+                    value = RuntimeError("The calculation process stopped unexpectedly")
+                self._currentResult = ("Error", value)
+
+    def shutdown(self):
+        """
+        Stops the worker process, terminating any calculation still running
+        """
+        self._worker.shutdown()
+
+
+class ProgressReporter():
+    """
+    Progress callback for calculations in the worker process, which sends the
+    progress to the ThreadHandler at the end of every run, and otherwise at
+    most every interval seconds
+    """
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self._lastReportTime = 0
+        self._lastCompletedRuns = 0
+
+    def __call__(self, completedRuns, completedIterations, bestScore):
+        now = time.perf_counter()
+        # The number of completed runs only changes in the call at the end of a run
+        if completedRuns != self._lastCompletedRuns or now - self._lastReportTime >= self.interval:
+            self._lastReportTime = now
+            self._lastCompletedRuns = completedRuns
+            worker_process.sendMessage("progress", (completedRuns, completedIterations, float(bestScore)))
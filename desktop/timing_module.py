@@ -4,20 +4,146 @@ Created on 20 Aug 2013
 @author: Matthew Daggitt
 '''
 
+import json
+import os
+import platform
+import tempfile
+import threading
 from timeit import Timer
+
+import numpy as np
+
+from core import synthetic
 from core.models.weibull import weibullModelAnalysis
-from core.isopach import Isopach
-
-def createWeibullTimingEstimationFunction():
-    limits = [[0,1000],[0,10]]
-    n = 100
-    isopachs = [Isopach(i+1, i+1) for i in range(n)]
-    isopachSets = [[isopachs[:2],5,100,limits], [isopachs,5,100,limits]]
-    results = [_timeFunction(weibullModelAnalysis,iset,3) for iset in isopachSets]
-    timeTakenPerIsopach = (results[1]-results[0])/((n-2))
-    timeTakenPerIsopach /= 10
-
-    return lambda noIsopachs, noRuns, itersPerRun : timeTakenPerIsopach * noIsopachs * itersPerRun * noRuns
+
+# Changed whenever the calibration or cost model changes, so old calibrations are redone
+CALIBRATION_VERSION = 1
+
+# (number of isopachs, number of runs, iterations per run) of the timed fits
+CALIBRATION_FITS = [(5, 1, 100), (5, 2, 250), (20, 1, 100), (20, 2, 250), (100, 1, 100), (100, 2, 250)]
+CALIBRATION_LIMITS = [[0, 1000], [0, 2]]
+CALIBRATION_REPEATS = 3
+
+
+class WeibullTimingEstimator():
+    """
+    Estimates the time taken by Weibull fits on this machine.
+
+    The time is modelled as
+
+        overhead + runs*iterationsPerRun*(perIteration + perIsopach*isopachs)
+
+    as each iteration evaluates the error of every isopach once. The
+    coefficients are fitted by least squares to the times of a few small fits,
+    and are stored in cacheFilename along with a description of the machine,
+    so the fits are only timed again on a different machine or Python.
+    """
+    def __init__(self, cacheFilename):
+        self.cacheFilename = cacheFilename
+        self.coefficients = None
+        self.calibrationError = None
+        self._thread = None
+
+    def isCalibrated(self):
+        return self.coefficients is not None
+
+    def calibrationFailed(self):
+        """ Returns True if calibrating in the background raised an exception """
+        return self.calibrationError is not None
+
+    def estimate(self, numberOfIsopachs, iterationsPerRun, numberOfRuns):
+        """
+        Returns the estimated time in seconds of a Weibull fit. Raises
+        ValueError if the estimator has not yet been calibrated.
+        """
+        if self.coefficients is None:
+            raise ValueError("Weibull timings have not yet been calibrated")
+        overhead, perIteration, perIsopach = self.coefficients
+        return overhead + numberOfRuns*iterationsPerRun*(perIteration + perIsopach*numberOfIsopachs)
+
+    def load(self):
+        """
+        Loads the coefficients from the cache file, returning True if it held
+        a calibration for this machine
+        """
+        try:
+            with open(self.cacheFilename) as cacheFile:
+                data = json.load(cacheFile)
+        except (OSError, ValueError):
+            return False
+        if data.get("version") != CALIBRATION_VERSION or data.get("machine") != _describeMachine():
+            return False
+        self.coefficients = tuple(data["coefficients"])
+        return True
+
+    def calibrate(self):
+        """ Times the calibration fits, fits the cost model and stores it in the cache file """
+        sizes, times = [], []
+        for numberOfIsopachs, numberOfRuns, iterationsPerRun in CALIBRATION_FITS:
+            isopachs = synthetic.generateDeposit("weibull", numberOfIsopachs=numberOfIsopachs, seed=0).isopachs
+            args = [isopachs, numberOfRuns, iterationsPerRun, CALIBRATION_LIMITS]
+            sizes.append((numberOfIsopachs, numberOfRuns*iterationsPerRun))
+            times.append(min(_timeFunction(weibullModelAnalysis, args, 1) for _ in range(CALIBRATION_REPEATS)))
+        self.coefficients = _fitCostModel(sizes, times)
+        self._save()
+
+    def loadOrCalibrateInBackground(self):
+        """
+        Loads the calibration from the cache file, or if there is none for this
+        machine, calibrates in a background thread. isCalibrated returns True
+        once the coefficients are available, or calibrationFailed if they
+        never will be.
+        """
+        if self.load():
+            return
+        self._thread = threading.Thread(target=self._calibrateQuietly, daemon=True)
+        self._thread.start()
+
+    def _calibrateQuietly(self):
+        try:
+            self.calibrate()
+        except OSError:
+            # The estimates are still available even if they cannot be stored
+            pass
+        except Exception as e:
+            self.calibrationError = e
+
+    def _save(self):
+        directory = os.path.dirname(self.cacheFilename)
+        os.makedirs(directory, exist_ok=True)
+        data = {"version" : CALIBRATION_VERSION,
+                "machine" : _describeMachine(),
+                "coefficients" : list(self.coefficients)}
+
+        # Written to a temporary file first so that it is never left half written
+        handle, tempPath = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "w") as cacheFile:
+                json.dump(data, cacheFile, indent=2)
+            os.replace(tempPath, self.cacheFilename)
+        except BaseException:
+            os.remove(tempPath)
+            raise
+
+def _fitCostModel(sizes, times):
+    """
+    Returns the (overhead, perIteration, perIsopach) coefficients best fitting
+    the times of fits with the given (isopachs, total iterations) sizes. They
+    are kept non-negative, so that estimates always grow with the fit size.
+    """
+    isopachs = np.array([size[0] for size in sizes], dtype=float)
+    iterations = np.array([size[1] for size in sizes], dtype=float)
+    design = np.column_stack([np.ones(len(sizes)), iterations, iterations*isopachs])
+    coefficients = np.linalg.lstsq(design, np.array(times), rcond=None)[0]
+    return tuple(float(max(coefficient, 0)) for coefficient in coefficients)
+
+def _describeMachine():
+    return {"node" : platform.node(),
+            "machine" : platform.machine(),
+            "processor" : platform.processor(),
+            "cpuCount" : os.cpu_count(),
+            "python" : platform.python_version(),
+            "numpy" : np.__version__}
 
 def _timeFunction(func,args,number):
     return Timer(lambda : func(*args)).timeit(number=number)/number
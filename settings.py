@@ -1,3 +1,4 @@
+import os
 
 from enum import Enum
 
@@ -21,4 +22,14 @@ WEI_DEFAULT_ITERATIONS_PER_RUN = 1000
 WEI_DEFAULT_LAMBDA_LOWER_BOUND = 0.0
 WEI_DEFAULT_LAMBDA_UPPER_BOUND = 1000
 WEI_DEFAULT_K_LOWER_BOUND = 0.0
-WEI_DEFAULT_K_UPPER_BOUND = 2.0
\ No newline at end of file
+WEI_DEFAULT_K_UPPER_BOUND = 2.0
+
+# Per machine calibration of the estimated time of Weibull calculations
+WEI_TIMING_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "ashcalc", "weibull_timing.json")
+
+##################
+## Command line ##
+##################
+
+CLI_CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "ashcalc")
+CLI_CACHE_MAX_SIZE_MB = 100
@@ -0,0 +1,127 @@
+'''
+Tests of the asyncio interface for fitting isopachs.
+'''
+
+import asyncio
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from command_line import asynchronous, cli
+from core.exceptions import CalculationCancelled
+from core.isopach import Isopach
+
+ISOPACHS = [Isopach(t, x) for t, x in
+            [(10.0, 2.0), (5.0, 4.0), (2.0, 8.0), (0.5, 16.0)]]
+
+# Takes minutes unless it is stopped
+SLOW_ITERATIONS = 10**7
+
+
+def model_settings(model='exponential', iterations=100):
+    settings = cli.ModelSettings()
+    settings.set_model(model)
+    settings.set_weibull_parameters(1, iterations, ((0, 1000), (0, 2)))
+    return settings
+
+
+async def cancel_slow_fit(fitter):
+    """
+    Start a slow Weibull fit, cancel it and return how long the cancelled task
+    took to finish.
+    """
+    task = asyncio.ensure_future(
+        fitter.fit(ISOPACHS, model_settings('weibull', SLOW_ITERATIONS)))
+    await asyncio.sleep(0.5)
+    start = time.perf_counter()
+    task.cancel()
+    with pytest.raises((asyncio.CancelledError, CalculationCancelled)):
+        await task
+    return time.perf_counter() - start
+
+
+@pytest.fixture(params=asynchronous.EXECUTORS)
+def fitter(request):
+    fitter = asynchronous.AsyncFitter(request.param, max_workers=1)
+    yield fitter
+    fitter.close()
+
+
+def test_fit(fitter):
+    settings = model_settings()
+    results = asyncio.run(fitter.fit(ISOPACHS, settings))
+    expected = cli.fit_isopachs(ISOPACHS, settings)
+    assert results['estimatedTotalVolume'] == \
+        pytest.approx(expected['estimatedTotalVolume'])
+
+
+def running_helpers():
+    """
+    The number of threads and worker processes that are still running.
+    """
+    return threading.active_count() + len(multiprocessing.active_children())
+
+
+@pytest.mark.parametrize('executor', asynchronous.EXECUTORS)
+def test_fit_async_stops_its_helpers(executor):
+    settings = model_settings()
+    expected = cli.fit_isopachs(ISOPACHS, settings)
+    helpers = running_helpers()
+    # Each event loop has its own fitter, which is closed after the fit
+    for _ in range(2):
+        results = asyncio.run(
+            asynchronous.fit_async(ISOPACHS, settings, executor))
+        assert results['estimatedTotalVolume'] == \
+            pytest.approx(expected['estimatedTotalVolume'])
+    deadline = time.perf_counter() + 5
+    while running_helpers() > helpers and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    assert running_helpers() <= helpers
+
+
+def test_fit_many_isolates_failures(fitter):
+    deposits = [(ISOPACHS, model_settings()), (ISOPACHS[:1], model_settings()),
+                (ISOPACHS, model_settings('power_law'))]
+
+    async def fit_all():
+        return [item async for item in fitter.fit_many(deposits)]
+
+    items = sorted(asyncio.run(fit_all()), key=lambda item: item[0])
+    assert [index for index, _, _ in items] == [0, 1, 2]
+    assert items[0][2] is None and items[2][2] is None
+    assert items[1][1] is None and items[1][2] is not None
+
+
+def test_cancelling_a_thread_fit_stops_the_calculation():
+    fitter = asynchronous.AsyncFitter('thread', max_workers=1)
+
+    async def cancel_then_fit():
+        assert await cancel_slow_fit(fitter) < 5
+        # The only thread is free again, so the next fit is not held up
+        start = time.perf_counter()
+        await fitter.fit(ISOPACHS, model_settings())
+        return time.perf_counter() - start
+
+    try:
+        assert asyncio.run(cancel_then_fit()) < 5
+    finally:
+        fitter.close()
+
+
+def test_cancelling_a_process_fit_replaces_the_worker():
+    fitter = asynchronous.AsyncFitter('process', max_workers=1)
+
+    async def cancel_then_fit():
+        for _ in range(3):
+            assert await cancel_slow_fit(fitter) < 5
+            worker, = fitter._workers
+            assert not worker.busy
+            results = await fitter.fit(ISOPACHS, model_settings())
+            assert results['estimatedTotalVolume'] > 0
+
+    try:
+        asyncio.run(cancel_then_fit())
+    finally:
+        fitter.close()
@@ -0,0 +1,145 @@
+'''
+Tests of core.batch against the models fitted one deposit at a time.
+'''
+
+import random
+import threading
+
+import numpy as np
+import pytest
+
+import settings
+from core import batch, equivalence, synthetic
+from core.exceptions import CalculationCancelled
+from core.isopach import Isopach
+from core.models.exponential import exponentialModelAnalysis
+from core.models.power_law import powerLawModelAnalysis
+from core.models.weibull import weibullModelAnalysis
+
+PROXIMAL_LIMIT_KM = settings.POW_DEFAULT_PROXIMAL_LIMIT
+DISTAL_LIMIT_KM = settings.POW_DEFAULT_DISTAL_LIMIT
+WEIBULL_LIMITS = ((settings.WEI_DEFAULT_LAMBDA_LOWER_BOUND, settings.WEI_DEFAULT_LAMBDA_UPPER_BOUND),
+                  (settings.WEI_DEFAULT_K_LOWER_BOUND, settings.WEI_DEFAULT_K_UPPER_BOUND))
+
+
+def _randomDeposit(generator):
+    """ Isopachs thinning roughly exponentially, with noise """
+    numberOfIsopachs = generator.randint(3, 15)
+    sqrtAreasKM = sorted(generator.uniform(2, 150) for _ in range(numberOfIsopachs))
+    coefficient, exponent = generator.uniform(1, 100), generator.uniform(0.02, 0.5)
+    return [Isopach(coefficient*np.exp(-exponent*x)*generator.uniform(0.8, 1.25), x) for x in sqrtAreasKM]
+
+
+def _weibullDeposits(numberOfDeposits, seed):
+    """ Deposits of 8 isopachs following the Weibull model, with noise """
+    generator = random.Random(seed)
+    deposits = []
+    for _ in range(numberOfDeposits):
+        lamb, k, theta = generator.uniform(5, 300), generator.uniform(0.5, 1.8), generator.uniform(1, 100)
+        sqrtAreasKM = sorted(generator.uniform(0.1, 3)*lamb for _ in range(8))
+        deposits.append([Isopach(theta*(x/lamb)**(k-2)*np.exp(-(x/lamb)**k)*generator.uniform(0.9, 1.1), x)
+                         for x in sqrtAreasKM])
+    return deposits
+
+
+@pytest.fixture(scope="module")
+def deposits():
+    generator = random.Random(1)
+    return [_randomDeposit(generator) for _ in range(25)]
+
+
+def test_flatten_deposits(deposits):
+    thicknessesM, sqrtAreasKM, offsets = batch.flattenDeposits(deposits)
+    assert offsets[0] == 0 and offsets[-1] == len(thicknessesM) == len(sqrtAreasKM)
+    for i, isopachs in enumerate(deposits):
+        assert thicknessesM[offsets[i]:offsets[i+1]].tolist() == [isopach.thicknessM for isopach in isopachs]
+        assert sqrtAreasKM[offsets[i]:offsets[i+1]].tolist() == [isopach.sqrtAreaKM for isopach in isopachs]
+
+
+def test_offsets_are_checked():
+    with pytest.raises(ValueError):
+        batch.batchExponentialModelAnalysis([1.0, 0.5, 0.2], [1.0, 2.0, 3.0], [0, 1, 3])
+    with pytest.raises(ValueError):
+        batch.batchExponentialModelAnalysis([1.0, 0.5, 0.2], [1.0, 2.0, 3.0], [0, 2])
+
+
+def test_exponential_matches_scalar_model(deposits):
+    values = batch.batchExponentialModelAnalysis(*batch.flattenDeposits(deposits))
+    for i, isopachs in enumerate(deposits):
+        results = exponentialModelAnalysis(isopachs, 1)
+        np.testing.assert_allclose(values["estimatedTotalVolume"][i], results["estimatedTotalVolume"], rtol=1e-9)
+        np.testing.assert_allclose(values["coefficient"][i], results["segmentCoefficients"][0], rtol=1e-9)
+        np.testing.assert_allclose(values["exponent"][i], results["segmentExponents"][0], rtol=1e-9)
+        np.testing.assert_allclose(values["bt"][i], results["segmentBts"][0], rtol=1e-9)
+        np.testing.assert_allclose(values["mrse"][i], results["mrse"], rtol=1e-9)
+
+
+def test_power_law_matches_scalar_model(deposits):
+    values = batch.batchPowerLawModelAnalysis(*batch.flattenDeposits(deposits), PROXIMAL_LIMIT_KM, DISTAL_LIMIT_KM)
+    for i, isopachs in enumerate(deposits):
+        results = powerLawModelAnalysis(isopachs, PROXIMAL_LIMIT_KM, DISTAL_LIMIT_KM)
+        np.testing.assert_allclose(values["estimatedTotalVolume"][i], results["estimatedTotalVolume"], rtol=1e-9)
+        np.testing.assert_allclose(values["coefficient"][i], results["coefficient"], rtol=1e-9)
+        np.testing.assert_allclose(values["exponent"][i], results["exponent"], rtol=1e-9)
+        np.testing.assert_allclose(values["mrse"][i], results["mrse"], rtol=1e-9)
+
+
+def test_power_law_mrse_is_nan_outside_limits():
+    isopachs = [Isopach(t, x) for t, x in [(10.0, 1.0), (5.0, 3.0), (2.0, 6.0), (0.5, 12.0)]]
+    values = batch.batchPowerLawModelAnalysis(*batch.flattenDeposits([isopachs]), 1.0, DISTAL_LIMIT_KM)
+    assert np.isnan(values["mrse"][0])
+    assert np.isfinite(values["estimatedTotalVolume"][0])
+
+
+@pytest.mark.parametrize("name", ["batch_exponential", "batch_power_law", "regression_table"])
+def test_deterministic_engines_pass(name):
+    deposits = [deposit.isopachs for deposit in synthetic.generateCatalog(25, numberOfIsopachs=(3, 15), seed=1)]
+    engineSettings = {"proximalLimitKM" : PROXIMAL_LIMIT_KM, "distalLimitKM" : DISTAL_LIMIT_KM}
+    report = equivalence.compareEngine(equivalence.ENGINES[name], deposits, engineSettings)
+    assert report.passed, equivalence.formatReport(report)
+
+
+def test_weibull_fits_as_well_as_scalar_model():
+    deposits = _weibullDeposits(5, seed=0)
+    numberOfRuns, iterationsPerRun = 5, 300
+
+    random.seed(0)
+    values = batch.batchWeibullModelAnalysis(*batch.flattenDeposits(deposits), numberOfRuns, iterationsPerRun,
+                                             WEIBULL_LIMITS, generator=np.random.default_rng(0))
+    referenceMRSEs = [weibullModelAnalysis(isopachs, numberOfRuns, iterationsPerRun, WEIBULL_LIMITS)["mrse"]
+                      for isopachs in deposits]
+
+    assert np.all(values["lambda"] >= WEIBULL_LIMITS[0][0]) and np.all(values["lambda"] <= WEIBULL_LIMITS[0][1])
+    assert np.all(values["k"] >= WEIBULL_LIMITS[1][0]) and np.all(values["k"] <= WEIBULL_LIMITS[1][1])
+    worsening = (values["mrse"]-referenceMRSEs)/np.array(referenceMRSEs)
+    assert np.median(worsening) <= 0.05
+
+
+def test_weibull_volume_and_mrse_match_parameters():
+    deposits = _weibullDeposits(3, seed=1)
+    values = batch.batchWeibullModelAnalysis(*batch.flattenDeposits(deposits), 2, 100, WEIBULL_LIMITS,
+                                             generator=np.random.default_rng(1))
+    for i, isopachs in enumerate(deposits):
+        lamb, k, theta = values["lambda"][i], values["k"][i], values["theta"][i]
+        np.testing.assert_allclose(values["estimatedTotalVolume"][i], 0.001*2*theta*lamb*lamb/k, rtol=1e-9)
+        xs = np.array([isopach.sqrtAreaKM for isopach in isopachs])
+        ts = np.array([isopach.thicknessM for isopach in isopachs])
+        predicted = theta*(xs/lamb)**(k-2)*np.exp(-(xs/lamb)**k)
+        np.testing.assert_allclose(values["mrse"][i], np.mean(((predicted-ts)/ts)**2), rtol=1e-9)
+
+
+def test_weibull_is_reproducible_with_a_generator():
+    isopachs = [Isopach(t, x) for t, x in [(10.0, 1.0), (5.0, 3.0), (2.0, 6.0), (0.5, 12.0)]]
+    arrays = batch.flattenDeposits([isopachs, isopachs])
+    first = batch.batchWeibullModelAnalysis(*arrays, 2, 50, WEIBULL_LIMITS, generator=np.random.default_rng(3))
+    second = batch.batchWeibullModelAnalysis(*arrays, 2, 50, WEIBULL_LIMITS, generator=np.random.default_rng(3))
+    for key in first:
+        np.testing.assert_array_equal(first[key], second[key])
+
+
+def test_weibull_can_be_cancelled(deposits):
+    cancelEvent = threading.Event()
+    cancelEvent.set()
+    with pytest.raises(CalculationCancelled):
+        batch.batchWeibullModelAnalysis(*batch.flattenDeposits(deposits), 2, 10, WEIBULL_LIMITS,
+                                        cancelEvent=cancelEvent)
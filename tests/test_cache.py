@@ -0,0 +1,120 @@
+'''
+Tests of command_line.cache.
+'''
+
+import os
+import pickle
+
+import pytest
+
+from command_line import cache
+from command_line.cache import ResultCache
+from command_line.cli import ModelSettings
+from core.isopach import Isopach
+from core.models.power_law import powerLawModelAnalysis
+
+ISOPACHS = [Isopach(t, x) for t, x in [(10.0, 2.0), (5.0, 4.0), (2.0, 8.0), (0.5, 16.0)]]
+
+
+@pytest.fixture
+def resultCache(tmp_path):
+    return ResultCache(str(tmp_path / "cache"), 10**6)
+
+
+def test_round_trip(resultCache):
+    modelSettings = ModelSettings()
+    modelSettings.set_model("power_law")
+    results = powerLawModelAnalysis(ISOPACHS, *modelSettings.get_params())
+    key = resultCache.get_key(ISOPACHS, modelSettings)
+
+    assert resultCache.get(key) is None
+    resultCache.put(key, results)
+    cached = resultCache.get(key)
+    assert cached is not results
+    for name in ["estimatedTotalVolume", "coefficient", "exponent", "mrse"]:
+        assert cached[name] == results[name]
+    assert [(i.thicknessM, i.sqrtAreaKM) for i in cached.isopachs] == [(i.thicknessM, i.sqrtAreaKM) for i in ISOPACHS]
+
+
+def test_key_identifies_fit(resultCache, monkeypatch):
+    modelSettings = ModelSettings()
+    key = resultCache.get_key(ISOPACHS, modelSettings)
+    assert resultCache.get_key(list(ISOPACHS), ModelSettings()) == key
+
+    assert resultCache.get_key(ISOPACHS[:-1], modelSettings) != key
+    assert resultCache.get_key(ISOPACHS, modelSettings, seed=1) != key
+    otherSettings = ModelSettings()
+    otherSettings.set_exponential_parameters(3)
+    assert resultCache.get_key(ISOPACHS, otherSettings) != key
+
+    monkeypatch.setattr(cache, "CACHE_VERSION", cache.CACHE_VERSION+1)
+    assert resultCache.get_key(ISOPACHS, modelSettings) != key
+
+
+def test_key_depends_on_every_weibull_setting(resultCache):
+    modelSettings = ModelSettings()
+    modelSettings.set_model("weibull")
+    keys = {resultCache.get_key(ISOPACHS, modelSettings)}
+    for runs, iterations, limits in [(10, 1000, ((0, 1000), (0, 2))), (20, 100, ((0, 1000), (0, 2))),
+                                     (20, 1000, ((1, 1000), (0, 2))), (20, 1000, ((0, 1000), (0.5, 2)))]:
+        modelSettings.set_weibull_parameters(runs, iterations, limits)
+        keys.add(resultCache.get_key(ISOPACHS, modelSettings))
+    assert len(keys) == 5
+
+
+def test_key_ignores_number_types(resultCache):
+    intSettings, floatSettings = ModelSettings(), ModelSettings()
+    intSettings.set_model("weibull")
+    floatSettings.set_model("weibull")
+    intSettings.set_weibull_parameters(10, 100, ((0, 1000), (0, 2)))
+    floatSettings.set_weibull_parameters(10, 100, ((0.0, 1000.0), (0.0, 2.0)))
+    assert resultCache.get_key(ISOPACHS, intSettings) == resultCache.get_key(ISOPACHS, floatSettings)
+
+
+def test_unreadable_entries_are_misses(resultCache):
+    resultCache.put("corrupt", 1)
+    with open(resultCache._get_path("corrupt"), "wb") as f:
+        f.write(b"not a pickle")
+    assert resultCache.get("corrupt") is None
+
+    resultCache.put("truncated", list(range(100)))
+    with open(resultCache._get_path("truncated"), "rb") as f:
+        data = f.read()
+    with open(resultCache._get_path("truncated"), "wb") as f:
+        f.write(data[:len(data)//2])
+    assert resultCache.get("truncated") is None
+
+
+@pytest.mark.parametrize("module, name", [("core.results", "RenamedResults"), ("core.renamed_module", "Results")])
+def test_stale_classes_are_misses(resultCache, module, name):
+    resultCache.put("stale", 1)
+    with open(resultCache._get_path("stale"), "wb") as f:
+        f.write(b"\x80\x02c" + module.encode() + b"\n" + name.encode() + b"\n)\x81.")
+    with pytest.raises((AttributeError, ImportError)):
+        with open(resultCache._get_path("stale"), "rb") as f:
+            pickle.load(f)
+    assert resultCache.get("stale") is None
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    resultCache = ResultCache(str(tmp_path), 4000)
+    for i, key in enumerate(["a", "b", "c"]):
+        resultCache.put(key, bytes(1000))
+        os.utime(resultCache._get_path(key), (i, i))
+    resultCache.get("a")
+
+    resultCache.put("d", bytes(1000))
+    assert resultCache.get("b") is None
+    assert all(resultCache.get(key) is not None for key in ["a", "c", "d"])
+
+
+@pytest.mark.skipif(os.name != "posix", reason="Permissions are only checked on posix")
+def test_directory_is_private(resultCache):
+    resultCache.put("a", 1)
+    assert os.stat(resultCache.directory).st_mode & 0o077 == 0
+
+
+def test_clear(resultCache):
+    resultCache.put("a", 1)
+    resultCache.clear()
+    assert resultCache.get("a") is None
@@ -0,0 +1,158 @@
+'''
+Tests of the command line processing of several files.
+'''
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from command_line import cli
+from core import isopach, regression_methods
+from core.models import exponential, power_law
+
+ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
+ISOPACH_FILE = os.path.join(ROOT, 'test_isopachs.csv')
+
+
+@pytest.fixture
+def filelist(tmp_path):
+    return [ISOPACH_FILE, str(tmp_path / 'missing.csv'), ISOPACH_FILE]
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_results_are_in_file_order(filelist, jobs):
+    model_settings = cli.ModelSettings()
+    file_results = list(cli.process_files(filelist, model_settings, jobs=jobs))
+
+    assert [result.filename for result in file_results] == filelist
+    good, bad = file_results[0], file_results[1]
+    assert good.error is None and bad.results is None
+    assert isinstance(bad.error, OSError)
+    assert file_results[2].results['estimatedTotalVolume'] == \
+        pytest.approx(good.results['estimatedTotalVolume'])
+
+
+def test_unordered_results_cover_every_file(filelist):
+    model_settings = cli.ModelSettings()
+    file_results = list(cli.process_files(filelist, model_settings, jobs=2,
+                                          ordered=False))
+
+    assert sorted(result.filename for result in file_results) == \
+        sorted(filelist)
+    assert sum(result.error is not None for result in file_results) == 1
+
+
+def test_jobs_must_be_positive(filelist):
+    with pytest.raises(ValueError):
+        list(cli.process_files(filelist, cli.ModelSettings(), jobs=0))
+
+
+@pytest.mark.parametrize('segments', [1, 2, 3])
+def test_all_models_share_the_regression_table(monkeypatch, segments):
+    isopachs, _ = isopach.read_isopach_file(ISOPACH_FILE)
+    model_settings = cli.ModelSettings()
+    model_settings.set_model('all')
+    model_settings.set_exponential_parameters(segments)
+    model_settings.set_weibull_parameters(2, 20, ((0, 1000), (0, 2)))
+
+    tables = []
+    calculate_table = regression_methods.calculateRegressionTable
+    monkeypatch.setattr(regression_methods, 'calculateRegressionTable',
+                        lambda xs, ys: tables.append(1) or
+                        calculate_table(xs, ys))
+    results = cli.fit_all_models(isopachs, model_settings)
+    suggested_proximal_limit = results['power_law']['suggestedProximalLimit']
+    assert len(tables) == 1
+
+    monkeypatch.setattr(regression_methods, 'calculateRegressionTable',
+                        calculate_table)
+    expected = power_law.powerLawModelAnalysis(
+        isopachs, *model_settings.get_params('power_law'))
+    assert suggested_proximal_limit == \
+        pytest.approx(expected['suggestedProximalLimit'])
+    assert results['exponential']['estimatedTotalVolume'] == pytest.approx(
+        exponential.exponentialModelAnalysis(
+            isopachs, segments)['estimatedTotalVolume'])
+    assert results['bestModel'] == results['mrseRanking'][0]
+
+
+def run_ashcalc(arguments):
+    return subprocess.run(
+        [sys.executable, 'ashcalc.py', '--no-cache'] + arguments, cwd=ROOT,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+
+
+def test_failed_file_sets_exit_status(filelist):
+    process = run_ashcalc(['--jobs', '2'] + filelist)
+
+    assert process.returncode == 1
+    assert 'missing.csv' in process.stderr
+    assert process.stdout.count(ISOPACH_FILE) == 2
+
+
+def test_failed_file_gives_jsonl_error_record(filelist):
+    process = run_ashcalc(['--jobs', '2', '--output', 'jsonl'] + filelist)
+
+    assert process.returncode == 1
+    records = [json.loads(line) for line in process.stdout.splitlines()]
+    assert [record['filename'] for record in records] == filelist
+    assert set(records[1]) == {'filename', 'error'}
+    assert 'estimatedTotalVolume' in records[0]
+    assert 'estimatedTotalVolume' in records[2]
+
+
+def test_json_output_gives_every_weibull_setting():
+    process = run_ashcalc(['--model', 'weibull', '--runs', '2',
+                           '--iterations_per_run', '50',
+                           '--lambda_lower', '1', '--lambda_upper', '500',
+                           '--k_lower', '0.5', '--k_upper', '2', '--json',
+                           ISOPACH_FILE])
+
+    assert process.returncode == 0
+    record = json.loads(process.stdout)
+    settings = {name: value for name, value in record.items()
+                if name.startswith('wei_')}
+    assert settings == {'wei_number_of_runs': 2,
+                        'wei_iterations_per_run': 50,
+                        'wei_lambda_lower_bound': 1,
+                        'wei_lambda_upper_bound': 500,
+                        'wei_k_lower_bound': 0.5,
+                        'wei_k_upper_bound': 2}
+
+
+def test_fields_select_output(filelist):
+    process = run_ashcalc(['--jobs', '2', '--output', 'jsonl', '--fields',
+                           'mrse'] + filelist)
+
+    records = [json.loads(line) for line in process.stdout.splitlines()]
+    assert 'mrse' in records[0]
+    assert 'estimatedTotalVolume' not in records[0]
+
+
+def test_unknown_fields_are_refused():
+    process = run_ashcalc(['--fields', 'mrse,unknown', ISOPACH_FILE])
+
+    assert process.returncode == 2
+    assert 'unknown' in process.stderr
+    assert 'segmentVolumes' in process.stderr
+
+
+def test_telemetry_is_valid_json():
+    process = run_ashcalc(['--model', 'weibull', '--runs', '2',
+                           '--iterations_per_run', '50',
+                           '--lambda_lower', '1', '--lambda_upper', '500',
+                           '--k_lower', '0.5', '--k_upper', '2', '--json',
+                           '--telemetry', ISOPACH_FILE])
+
+    assert process.returncode == 0
+
+    def refuse_constant(name):
+        raise ValueError('{} is not valid json'.format(name))
+
+    record = json.loads(process.stdout, parse_constant=refuse_constant)
+    assert record['wei_telemetry'] is True
+    assert len(record['telemetry']['evaluations']) == 2
@@ -0,0 +1,138 @@
+'''
+Tests of core.error_surface against the error of each point calculated one at a time.
+'''
+
+import math
+import os
+
+import numpy as np
+import pytest
+
+from core import error_surface, regression_methods
+from core.isopach import read_isopach_file
+from core.models.weibull import calculateTheta
+
+ISOPACH_FILE = os.path.join(os.path.dirname(__file__), os.pardir, "test_isopachs.csv")
+
+
+@pytest.fixture(scope="module")
+def data():
+    isopachs, _ = read_isopach_file(ISOPACH_FILE)
+    return [isopach.sqrtAreaKM for isopach in isopachs], [isopach.thicknessM for isopach in isopachs]
+
+
+def _scalarLogError(model, xs, ts, x, y):
+    """ The log mean relative squared error of a single point, as the error surface was previously drawn """
+    if model == "power_law":
+        thicknessFunction = lambda sqrtArea : x*sqrtArea**-y
+    else:
+        theta = calculateTheta(xs, ts, x, y)
+        thicknessFunction = lambda sqrtArea : np.exp(np.log(theta)+(y-2)*np.log(sqrtArea/x)-(sqrtArea/x)**y)
+    # The desktop application ignores floating point errors
+    with np.errstate(all="ignore"):
+        mrse = regression_methods.meanRelativeSquaredError(xs, ts, thicknessFunction)
+    if not np.isfinite(mrse) or mrse <= 0:
+        return np.nan
+    error = math.log(mrse)
+    return np.nan if error > error_surface.MAX_SURFACE_ERROR else error
+
+
+def _scalarSurface(model, xs, ts, X, Y):
+    return np.array([[_scalarLogError(model, xs, ts, x, y) for x, y in zip(rowX, rowY)] for rowX, rowY in zip(X, Y)])
+
+
+GRIDS = {"power_law" : ((1, 200), (0.1, 4)),
+         "weibull" : ((0.5, 40), (0.05, 2))}
+
+
+@pytest.mark.parametrize("model", error_surface.MODEL_NAMES)
+def test_matches_scalar_errors(data, model):
+    xs, ts = data
+    (startX, endX), (startY, endY) = GRIDS[model]
+    X, Y = np.meshgrid(np.linspace(startX, endX, 23), np.linspace(startY, endY, 17))
+    Z = error_surface.errorSurface(model, xs, ts, X, Y)
+    expected = _scalarSurface(model, xs, ts, X, Y)
+    assert Z.shape == X.shape
+    np.testing.assert_array_equal(np.isnan(Z), np.isnan(expected))
+    np.testing.assert_allclose(Z, expected, rtol=1e-10, atol=1e-12)
+
+
+@pytest.mark.parametrize("model", error_surface.MODEL_NAMES)
+def test_chunks_do_not_change_surface(data, model, monkeypatch):
+    xs, ts = data
+    (startX, endX), (startY, endY) = GRIDS[model]
+    X, Y = np.meshgrid(np.linspace(startX, endX, 30), np.linspace(startY, endY, 30))
+    expected = error_surface.errorSurface(model, xs, ts, X, Y)
+    monkeypatch.setattr(error_surface, "MAX_CHUNK_ELEMENTS", 1)
+    np.testing.assert_array_equal(error_surface.errorSurface(model, xs, ts, X, Y), expected)
+
+
+def test_bad_points_are_nan(data):
+    xs, ts = data
+    # The first point's thicknesses overflow
+    Z = error_surface.errorSurface("power_law", xs, ts, np.array([10.0, 10.0]), np.array([-1000.0, 1.0]))
+    assert np.isnan(Z[0]) and np.isfinite(Z[1])
+
+
+def test_unknown_model(data):
+    xs, ts = data
+    with pytest.raises(ValueError):
+        error_surface.errorSurface("exponential", xs, ts, np.ones(2), np.ones(2))
+
+
+def test_progressive_levels():
+    finest = (error_surface.latticeLevel(0, 1000, 100), error_surface.latticeLevel(0, 2, 100))
+    levels = error_surface.progressiveLevels(0, 1000, 0, 2, 100, startResolution=25)
+    assert levels == [(finest[0]+i, finest[1]+i) for i in (2, 1, 0)]
+
+    # A resolution below the starting one is calculated in a single pass
+    single = (error_surface.latticeLevel(0, 1000, 20), error_surface.latticeLevel(0, 2, 20))
+    assert error_surface.progressiveLevels(0, 1000, 0, 2, 20, startResolution=25) == [single]
+
+
+@pytest.mark.parametrize("model", error_surface.MODEL_NAMES)
+def test_tiles_match_error_surface(data, model):
+    xs, ts = data
+    (startX, endX), (startY, endY) = GRIDS[model]
+    levelX, levelY = error_surface.latticeLevel(startX, endX, 50), error_surface.latticeLevel(startY, endY, 50)
+    X, Y, Z = error_surface.ErrorSurfaceTiles().surface(model, xs, ts, startX, endX, startY, endY, levelX, levelY)
+    assert X.min() >= startX and X.max() <= endX and Y.min() >= startY and Y.max() <= endY
+    np.testing.assert_array_equal(Z, error_surface.errorSurface(model, xs, ts, X, Y))
+
+
+def test_refining_reuses_coarser_points(data):
+    xs, ts = data
+    (startX, endX), (startY, endY) = GRIDS["weibull"]
+    coarseLevels, fineLevels = error_surface.progressiveLevels(startX, endX, startY, endY, 100)[-2:]
+
+    freshTiles = error_surface.ErrorSurfaceTiles()
+    freshTiles.surface("weibull", xs, ts, startX, endX, startY, endY, *fineLevels)
+
+    tiles = error_surface.ErrorSurfaceTiles()
+    tiles.surface("weibull", xs, ts, startX, endX, startY, endY, *coarseLevels)
+    pointsCalculated = tiles.pointsCalculated
+    X, Y, Z = tiles.surface("weibull", xs, ts, startX, endX, startY, endY, *fineLevels)
+
+    np.testing.assert_array_equal(Z, error_surface.errorSurface("weibull", xs, ts, X, Y))
+    assert tiles.pointsCalculated - pointsCalculated < freshTiles.pointsCalculated
+
+
+def test_moving_bounds_reuses_tiles(data):
+    xs, ts = data
+    tiles = error_surface.ErrorSurfaceTiles()
+    tiles.surface("power_law", xs, ts, 1, 200, 0.1, 4, 2, -5)
+    tilesCalculated = tiles.tilesCalculated
+    tiles.surface("power_law", xs, ts, 1, 200, 0.1, 4, 2, -5)
+    assert tiles.tilesCalculated == tilesCalculated
+    tiles.surface("power_law", xs, ts, 1, 300, 0.1, 4, 2, -5)
+    assert tilesCalculated < tiles.tilesCalculated < 2*tilesCalculated
+
+
+def test_least_recently_used_tiles_are_evicted(data):
+    xs, ts = data
+    tiles = error_surface.ErrorSurfaceTiles(maxTiles=2)
+    X, Y, Z = tiles.surface("power_law", xs, ts, 1, 200, 0.1, 4, 0, -6)
+    assert len(tiles) == 2 and tiles.tilesCalculated > 2
+    np.testing.assert_array_equal(Z, error_surface.errorSurface("power_law", xs, ts, X, Y))
+    tiles.clear()
+    assert len(tiles) == 0
@@ -0,0 +1,92 @@
+'''
+Tests of core.memory and the --memory and --memory_limit options.
+'''
+
+import io
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from core import memory
+from core.exceptions import MemoryLimitExceeded
+
+ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
+ISOPACH_FILE = os.path.join(ROOT, "test_isopachs.csv")
+
+
+@pytest.fixture
+def tracking():
+    memory.takeRecords()
+    yield
+    memory.disable()
+    memory.takeRecords()
+
+
+def test_disabled_tracking_records_nothing():
+    memory.takeRecords()
+    assert not memory.isEnabled()
+    with memory.track("a"):
+        memory.checkpoint("stage")
+    assert memory.getRecords() == []
+
+
+def test_checkpoints_record_each_deposit(tracking):
+    memory.enable()
+    with memory.track("a"):
+        values = np.ones(10**6)
+        memory.checkpoint("allocate")
+        del values
+
+    records = memory.takeRecords()
+    assert [(record.deposit, record.stage) for record in records] == [("a", "start"), ("a", "allocate"), ("a", "end")]
+    assert records[1].peak >= records[1].current >= records[0].current + 8*10**6
+
+    summary = memory.summarise(records)
+    assert summary["peak"] >= 8*10**6
+    assert summary["deposits"]["a"]["peak"] == max(record.peak for record in records)
+    assert summary["deposits"]["a"]["retained"] < 10**6
+    for format in memory.MEMORY_FORMATS:
+        report = io.StringIO()
+        memory.writeReport(report, format, records)
+        assert report.getvalue()
+
+
+def test_limit_is_checked_at_checkpoints(tracking):
+    memory.enable(limitBytes=10**6)
+    with pytest.raises(MemoryLimitExceeded):
+        with memory.track("a"):
+            values = np.ones(10**6)
+            memory.checkpoint("allocate")
+    del values
+    # A deposit that stopped early is not recorded as finished
+    assert [record.stage for record in memory.takeRecords()] == ["start", "allocate"]
+
+
+def _runAshcalc(arguments):
+    return subprocess.run([sys.executable, "ashcalc.py", "--no-cache"] + arguments, cwd=ROOT,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_memory_limit_stops_the_batch(tmp_path, jobs):
+    output = tmp_path / "memory.json"
+    process = _runAshcalc(["--jobs", jobs, "--memory", "json", "--memory_limit", "0.001", "--memory_output",
+                           str(output), ISOPACH_FILE, ISOPACH_FILE])
+    assert process.returncode == 2
+    assert "Stopping" in process.stderr
+    summary = json.loads(output.read_text())
+    assert summary["limit"] == int(0.001*1024*1024)
+    assert summary["peak"] > summary["limit"]
+
+
+def test_memory_report(tmp_path):
+    output = tmp_path / "memory.json"
+    process = _runAshcalc(["--memory", "json", "--memory_output", str(output), ISOPACH_FILE, ISOPACH_FILE])
+    assert process.returncode == 0
+    summary = json.loads(output.read_text())
+    assert summary["limit"] is None
+    assert set(summary["deposits"]) == {ISOPACH_FILE}
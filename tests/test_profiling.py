@@ -0,0 +1,125 @@
+'''
+Tests of core.profiling and the --profile option.
+'''
+
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from core import profiling
+
+ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
+ISOPACH_FILE = os.path.join(ROOT, "test_isopachs.csv")
+
+
+@pytest.fixture
+def enabled():
+    profiling.takeSpans()
+    profiling.enable()
+    yield
+    profiling.disable()
+    profiling.takeSpans()
+
+
+@profiling.timed("decorated")
+def _decorated(value):
+    return value
+
+
+def test_disabled_spans_record_nothing():
+    profiling.takeSpans()
+    assert not profiling.isEnabled()
+    with profiling.span("stage", deposit="a"):
+        assert _decorated(1) == 1
+    assert profiling.getSpans() == []
+
+
+def test_spans_are_attributed_to_deposits(enabled):
+    with profiling.span("outer", deposit="a"):
+        with profiling.span("inner"):
+            _decorated(1)
+    with profiling.span("other"):
+        pass
+
+    spans = {span.name : span for span in profiling.takeSpans()}
+    assert set(spans) == {"outer", "inner", "decorated", "other"}
+    assert [spans[name].deposit for name in ["outer", "inner", "decorated"]] == ["a", "a", "a"]
+    assert spans["other"].deposit is None
+    assert spans["outer"].start <= spans["inner"].start <= spans["inner"].end <= spans["outer"].end
+    assert profiling.getSpans() == []
+
+
+def test_deposits_are_tracked_per_thread(enabled):
+    barrier = threading.Barrier(2, timeout=5)
+
+    def process(deposit):
+        with profiling.span("outer", deposit=deposit):
+            # Both threads are inside their outer spans before either inner one starts,
+            # and inside their inner spans before either ends
+            barrier.wait()
+            with profiling.span("inner"):
+                barrier.wait()
+
+    threads = [threading.Thread(target=process, args=(deposit,)) for deposit in "ab"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    spans = profiling.takeSpans()
+    assert sorted((span.name, span.deposit) for span in spans) == [("inner", "a"), ("inner", "b"),
+                                                                   ("outer", "a"), ("outer", "b")]
+    assert all(span.deposit == "a" for span in spans if span.tid == threads[0].ident)
+
+
+def test_spans_from_elsewhere_are_added(enabled):
+    with profiling.span("stage", deposit="a"):
+        pass
+    spans = profiling.takeSpans()
+    profiling.addSpans([tuple(span) for span in spans])
+    assert profiling.getSpans() == spans
+
+
+def test_summary(enabled):
+    spans = [profiling.Span("fit", "a", 0.0, 1.0, 1, 1), profiling.Span("fit", "b", 1.0, 4.0, 1, 1),
+             profiling.Span("read", "a", 0.0, 0.5, 1, 1)]
+    summary = profiling.summarise(spans)
+    assert summary["stages"]["fit"] == {"count" : 2, "total" : 4.0, "max" : 3.0, "mean" : 2.0}
+    assert summary["deposits"] == {"a" : {"fit" : 1.0, "read" : 0.5}, "b" : {"fit" : 3.0}}
+    # Stages are listed by total time
+    lines = profiling.formatSummary(summary).splitlines()
+    assert lines[1].startswith("fit") and lines[2].startswith("read")
+
+    trace = profiling.toChromeTrace(spans)
+    assert [event["dur"] for event in trace["traceEvents"]] == [1e6, 3e6, 0.5e6]
+    assert trace["traceEvents"][1]["ts"] == 1e6
+
+
+@pytest.mark.parametrize("format", profiling.PROFILE_FORMATS)
+def test_report_formats(enabled, format):
+    with profiling.span("stage", deposit="a"):
+        pass
+    report = io.StringIO()
+    profiling.writeReport(report, format)
+    if format != "text":
+        json.loads(report.getvalue())
+    with pytest.raises(ValueError):
+        profiling.writeReport(report, "unknown")
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_profile_option_includes_worker_spans(tmp_path, jobs):
+    output = tmp_path / "profile.json"
+    process = subprocess.run([sys.executable, "ashcalc.py", "--no-cache", "--jobs", jobs, "--profile", "json",
+                              "--profile_output", str(output), ISOPACH_FILE, ISOPACH_FILE],
+                             cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert process.returncode == 0
+    summary = json.loads(output.read_text())
+    assert summary["stages"]["process_file"]["count"] == 2
+    assert summary["stages"]["fit_isopachs"]["count"] == 2
+    assert set(summary["deposits"]) == {ISOPACH_FILE}
@@ -0,0 +1,161 @@
+'''
+Tests of the result objects returned by the model analyses.
+'''
+
+import json
+import math
+import pickle
+
+import numpy as np
+import pytest
+
+from core import regression_methods
+from core.isopach import Isopach
+from core.models.exponential import exponentialModelAnalysis
+from core.models.power_law import powerLawModelAnalysis
+from core.models.weibull import weibullModelAnalysis
+from core.results import ModelResults, PowerLawResults, WeibullTelemetry
+
+ISOPACHS = [Isopach(t, x) for t, x in [(12.0, 2.0), (8.0, 3.5), (4.0, 6.0), (2.5, 9.0), (1.0, 15.0), (0.3, 30.0)]]
+
+
+def _analyses():
+    return {"exponential" : lambda : exponentialModelAnalysis(ISOPACHS, 2),
+            "power_law" : lambda : powerLawModelAnalysis(ISOPACHS, 1.0, 300),
+            "weibull" : lambda : weibullModelAnalysis(ISOPACHS, 2, 200, [[0, 1000], [0, 2]])}
+
+
+@pytest.fixture(params=["exponential", "power_law", "weibull"])
+def results(request):
+    return _analyses()[request.param]()
+
+
+def _assertSameResults(results, other):
+    assert type(other) is type(results)
+    assert other.toDict() == results.toDict()
+    xs = np.linspace(2, 30, 50)
+    np.testing.assert_array_equal(other.thickness(xs), results.thickness(xs))
+
+
+def test_thickness_matches_thickness_function(results):
+    xs = [isopach.sqrtAreaKM for isopach in ISOPACHS]
+    np.testing.assert_allclose(results.thickness(np.array(xs)), [results["thicknessFunction"](x) for x in xs],
+                               rtol=1e-12)
+    assert isinstance(results.thickness(xs[0]), float)
+
+
+def test_mrse_matches_scalar_calculation(results):
+    xs = [isopach.sqrtAreaKM for isopach in ISOPACHS]
+    ts = [isopach.thicknessM for isopach in ISOPACHS]
+    expected = regression_methods.meanRelativeSquaredError(xs, ts, results["thicknessFunction"])
+    assert math.isclose(results["mrse"], expected, rel_tol=1e-12)
+
+
+def test_json_round_trip(results):
+    results.mrse
+    _assertSameResults(results, ModelResults.fromJSON(results.toJSON()))
+
+
+def test_bytes_round_trip(results):
+    results.mrse
+    _assertSameResults(results, ModelResults.fromBytes(results.toBytes()))
+
+
+def test_from_bytes_rejects_other_objects():
+    with pytest.raises(ValueError):
+        ModelResults.fromBytes(pickle.dumps({}))
+
+
+def test_dictionary_access(results):
+    assert list(results) == results.keys()
+    assert len(results) == len(results.keys())
+    assert "isopachs" in results and "unknown" not in results
+    assert results["isopachs"] is results.isopachs
+    assert results.get("unknown", 1) == 1
+    with pytest.raises(KeyError):
+        results["unknown"]
+    with pytest.raises(KeyError):
+        results["thicknessFunction"] = None
+
+    copy = results.copy()
+    assert isinstance(copy, dict) and copy["estimatedTotalVolume"] == results["estimatedTotalVolume"]
+    results["estimatedTotalVolume"] = 1.0
+    assert results.estimatedTotalVolume == 1.0
+
+
+def test_fields_select_keys(results):
+    results.fields = ["estimatedTotalVolume"]
+    assert list(results.toDict()) == ["estimatedTotalVolume"]
+    # Lazy values not included are never calculated
+    assert results._mrse is None
+
+    results.fields = ["mrse"]
+    assert results.calculateFields()
+    assert results._mrse is not None
+    assert not results.calculateFields()
+
+
+def test_unknown_fields_are_rejected(results):
+    results.fields = ["estimatedTotalVolume", "unknown"]
+    with pytest.raises(ValueError):
+        results.toDict()
+    assert "unknown" not in ModelResults.fieldNames(results.model)
+
+
+def test_domain():
+    results = powerLawModelAnalysis(ISOPACHS, 1.0, 300)
+    assert math.isnan(results.thickness(0.5))
+    with pytest.raises(ValueError):
+        results.thicknessFunction(0.5)
+
+
+def test_suggested_proximal_limit_is_lazy():
+    results = powerLawModelAnalysis(ISOPACHS, 1.0, 300)
+    assert results._suggestedProximalLimit is None
+    assert results["suggestedProximalLimit"] == ModelResults.fromJSON(results.toJSON())["suggestedProximalLimit"]
+    assert PowerLawResults(ISOPACHS[:3], **dict(results.toDict(), suggestedProximalLimit=None)
+                           ).suggestedProximalLimit == "N/A"
+
+
+def test_model_results_is_abstract():
+    with pytest.raises(TypeError):
+        ModelResults(ISOPACHS)
+
+
+def test_telemetry():
+    numberOfRuns, iterationsPerRun = 3, 50
+    results = weibullModelAnalysis(ISOPACHS, numberOfRuns, iterationsPerRun, [[0, 1000], [0, 2]], telemetry=True)
+    telemetry = results["telemetry"]
+    assert telemetry.bestScoreTrajectory.shape == (numberOfRuns, iterationsPerRun+1)
+    assert np.all(telemetry.evaluations > 0)
+    assert np.all(telemetry.acceptedMoves+telemetry.rejectedMoves == iterationsPerRun)
+    assert telemetry.bestScores.min() == results["bestScore"]
+    # The best score of a run never gets worse
+    assert np.all(np.diff(telemetry.bestScoreTrajectory, axis=1) <= 0)
+    assert np.all(telemetry.iterationsToBest() <= iterationsPerRun)
+
+    copy = ModelResults.fromJSON(results.toJSON())["telemetry"]
+    for name in WeibullTelemetry.__slots__:
+        np.testing.assert_array_equal(getattr(copy, name), getattr(telemetry, name))
+
+
+def test_telemetry_is_only_given_when_recorded():
+    results = weibullModelAnalysis(ISOPACHS, 2, 50, [[0, 1000], [0, 2]])
+    assert results["telemetry"] is None
+    assert "telemetry" not in results.toDict()
+
+
+def test_telemetry_is_valid_json():
+    results = weibullModelAnalysis(ISOPACHS, 3, 50, [[0, 1000], [0, 2]], telemetry=True)
+    telemetry = results["telemetry"]
+    assert telemetry.evaluations.sum() > 0
+    # A run that never started has an infinite best score and a nan trajectory
+    unstarted = WeibullTelemetry(1, 5)
+    assert unstarted.toDict()["bestScores"] == [None]
+
+    for values in [telemetry, unstarted]:
+        copy = WeibullTelemetry.fromDict(json.loads(json.dumps(values.toDict(), allow_nan=False)))
+        for name in WeibullTelemetry.__slots__:
+            original = getattr(values, name)
+            expected = np.where(np.isfinite(original), original, np.nan) if original.dtype.kind == "f" else original
+            np.testing.assert_array_equal(getattr(copy, name), expected)
@@ -0,0 +1,91 @@
+'''
+Tests of the local fitting service.
+'''
+
+import json
+import threading
+from http.client import HTTPConnection
+
+import pytest
+
+from command_line import server
+from command_line.cli import ModelSettings, fit_isopachs
+from core.isopach import Isopach
+
+ISOPACHS = [[10.0, 2.0], [5.0, 4.0], [2.0, 8.0], [0.5, 16.0]]
+
+
+@pytest.fixture(scope='module')
+def service():
+    service = server.FittingService(workers=1, queue_size=0)
+    yield service
+    service.shutdown()
+
+
+@pytest.fixture(scope='module')
+def address(service):
+    httpd = server.create_server(service, port=0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address[:2]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def request(address, method, path, body=None):
+    connection = HTTPConnection(*address, timeout=60)
+    try:
+        connection.request(method, path, body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read().decode('utf-8'))
+    finally:
+        connection.close()
+
+
+def test_health(address):
+    status, data = request(address, 'GET', '/health')
+    assert status == 200
+    assert data == {'status': 'ok', 'workers': 1, 'queue_size': 0}
+
+
+def test_fit(address):
+    body = json.dumps({'isopachs': ISOPACHS, 'filename': 'deposit',
+                       'settings': {'model': 'power_law'}})
+    status, record = request(address, 'POST', '/fit', body)
+
+    model_settings = ModelSettings()
+    model_settings.set_model('power_law')
+    expected = fit_isopachs([Isopach(*i) for i in ISOPACHS], model_settings)
+    assert status == 200
+    assert record['filename'] == 'deposit'
+    assert record['pow_proximal_limit'] == model_settings.pow_proximal_limit
+    assert record['estimatedTotalVolume'] == \
+        pytest.approx(expected['estimatedTotalVolume'])
+
+
+@pytest.mark.parametrize('body', [
+    '{"isopachs": ',
+    '{"settings": {}}',
+    '{"isopachs": [[10.0, 2.0]], "settings": {"model": "unknown"}}'])
+def test_bad_requests(address, body):
+    status, data = request(address, 'POST', '/fit', body)
+    assert status == 400
+    assert 'error' in data
+
+
+def test_unknown_path(address):
+    assert request(address, 'GET', '/unknown')[0] == 404
+    assert request(address, 'POST', '/unknown', '{}')[0] == 404
+
+
+def test_busy_service_refuses_requests(service, address):
+    body = json.dumps({'isopachs': ISOPACHS})
+    # Take the only slot, as a request being fitted would
+    assert service._slots.acquire(blocking=False)
+    try:
+        status, data = request(address, 'POST', '/fit', body)
+    finally:
+        service._slots.release()
+
+    assert status == 503
+    assert request(address, 'POST', '/fit', body)[0] == 200
@@ -0,0 +1,97 @@
+'''
+Tests of the parameter sweep subcommand.
+'''
+
+import os
+
+import pytest
+
+from command_line import cli, sweep
+from core.models import exponential
+
+ISOPACH_FILE = os.path.join(os.path.dirname(__file__), os.pardir,
+                            'test_isopachs.csv')
+
+
+def test_grid_and_listed_scenarios_are_expanded():
+    spec = {'base': {'model': 'power_law', 'pow_distal_limit': 100},
+            'grid': {'exp_segments': [1, 2], 'model': ['exponential',
+                                                       'power_law']},
+            'scenarios': [{'name': 'wide', 'pow_distal_limit': 500},
+                          {'model': 'weibull'}]}
+    scenarios = sweep.expand_scenarios(spec)
+
+    assert [name for name, _ in scenarios] == [
+        'exp_segments=1,model=exponential', 'exp_segments=1,model=power_law',
+        'exp_segments=2,model=exponential', 'exp_segments=2,model=power_law',
+        'wide', 'scenario_1']
+    assert scenarios[0][1] == {'model': 'exponential', 'exp_segments': 1,
+                               'pow_distal_limit': 100}
+    assert scenarios[4][1] == {'model': 'power_law', 'pow_distal_limit': 500}
+    assert scenarios[5][1] == {'model': 'weibull', 'pow_distal_limit': 100}
+
+
+def test_empty_spec_is_the_base_scenario():
+    assert sweep.expand_scenarios({}) == [('base', {})]
+
+
+@pytest.mark.parametrize('spec', [
+    {'unknown': {}},
+    {'grid': {'unknown_setting': [1]}},
+    {'scenarios': [{'name': 'bad', 'model': 'unknown'}]},
+    {'grid': {'exp_segments': [1, 100]}}])
+def test_bad_scenarios_are_rejected(spec):
+    with pytest.raises(ValueError):
+        sweep.expand_scenarios(spec)
+
+
+def test_fits_are_shared_between_scenarios(monkeypatch):
+    tables = []
+    calculate_table = exponential.calculateIsopachRegressionTable
+    monkeypatch.setattr(exponential, 'calculateIsopachRegressionTable',
+                        lambda isopachs: tables.append(1) or
+                        calculate_table(isopachs))
+    deposit = sweep.Deposit(ISOPACH_FILE)
+
+    model_settings = cli.ModelSettings()
+    first = deposit.fit('exponential', model_settings)
+    assert deposit.fit('exponential', model_settings) is first
+    model_settings.set_exponential_parameters(3)
+    assert deposit.fit('exponential', model_settings) is not first
+    # The power law's suggested proximal limit reuses the 2 segment fit
+    deposit.fit('power_law', model_settings)
+    assert len(deposit._fits) == 3
+    assert len(tables) == 1
+
+
+def test_weibull_fits_are_only_shared_when_seeded():
+    model_settings = cli.ModelSettings()
+    model_settings.set_weibull_parameters(2, 20, ((0, 1000), (0, 2)))
+
+    deposit = sweep.Deposit(ISOPACH_FILE)
+    assert deposit.fit('weibull', model_settings) is not \
+        deposit.fit('weibull', model_settings)
+    seeded = sweep.Deposit(ISOPACH_FILE, seed=1)
+    assert seeded.fit('weibull', model_settings) is \
+        seeded.fit('weibull', model_settings)
+
+
+def test_rows_are_the_same_for_any_number_of_jobs(tmp_path):
+    scenarios = sweep.expand_scenarios(
+        {'base': {'model': 'all', 'wei_number_of_runs': 2,
+                  'wei_iterations_per_run': 20},
+         'grid': {'exp_segments': [1, 2, 3]}})
+    filelist = [ISOPACH_FILE, str(tmp_path / 'missing.csv')]
+
+    rows = list(sweep.run_sweep(filelist, scenarios, seed=1))
+    assert len(rows) == 2
+    assert len(rows[0]) == 3 * len(cli.MODEL_NAMES)
+    assert not any(row.get('error') for row in rows[0])
+    assert [row['scenario'] for row in rows[1]] == \
+        [name for name, _ in scenarios]
+    assert all(row['error'] for row in rows[1])
+
+    parallel_rows = [row for chunk in sweep.run_sweep(filelist, scenarios,
+                                                      jobs=4, seed=1)
+                     for row in chunk]
+    assert parallel_rows == rows[0] + rows[1]
@@ -0,0 +1,110 @@
+'''
+Tests of the calibration of Weibull time estimates.
+'''
+
+import json
+
+import pytest
+
+from desktop import timing_module
+from desktop.timing_module import WeibullTimingEstimator
+
+COEFFICIENTS = (0.01, 2e-6, 3e-7)
+
+
+@pytest.fixture
+def cacheFilename(tmp_path):
+    return str(tmp_path / "timing" / "weibull_timing.json")
+
+
+@pytest.fixture
+def quickCalibration(monkeypatch):
+    monkeypatch.setattr(timing_module, "CALIBRATION_FITS", [(5, 1, 10), (5, 2, 20), (20, 1, 10), (20, 2, 20)])
+    monkeypatch.setattr(timing_module, "CALIBRATION_REPEATS", 1)
+
+
+def test_cost_model_is_recovered():
+    sizes = [(5, 100), (5, 500), (20, 100), (20, 500), (100, 100), (100, 500)]
+    overhead, perIteration, perIsopach = COEFFICIENTS
+    times = [overhead + iterations*(perIteration + perIsopach*isopachs) for isopachs, iterations in sizes]
+    assert timing_module._fitCostModel(sizes, times) == pytest.approx(COEFFICIENTS, rel=1e-6)
+
+    # Coefficients are never negative
+    assert min(timing_module._fitCostModel(sizes, [1.0-0.001*iterations for _, iterations in sizes])) >= 0
+
+
+def test_estimate_needs_calibration(cacheFilename):
+    estimator = WeibullTimingEstimator(cacheFilename)
+    assert not estimator.isCalibrated()
+    with pytest.raises(ValueError):
+        estimator.estimate(10, 1000, 20)
+
+    estimator.coefficients = COEFFICIENTS
+    assert estimator.estimate(10, 1000, 20) == pytest.approx(0.01 + 20*1000*(2e-6 + 10*3e-7))
+
+
+def test_calibration_round_trip(cacheFilename, quickCalibration):
+    estimator = WeibullTimingEstimator(cacheFilename)
+    estimator.calibrate()
+    assert estimator.isCalibrated()
+
+    loaded = WeibullTimingEstimator(cacheFilename)
+    assert loaded.load()
+    assert loaded.coefficients == estimator.coefficients
+
+
+@pytest.mark.parametrize("change", [{"version" : timing_module.CALIBRATION_VERSION+1},
+                                    {"machine" : {"node" : "other"}}])
+def test_other_calibrations_are_not_loaded(cacheFilename, quickCalibration, change):
+    WeibullTimingEstimator(cacheFilename).calibrate()
+    with open(cacheFilename) as cacheFile:
+        data = json.load(cacheFile)
+    data.update(change)
+    with open(cacheFilename, "w") as cacheFile:
+        json.dump(data, cacheFile)
+    assert not WeibullTimingEstimator(cacheFilename).load()
+
+
+def test_unreadable_cache_is_not_loaded(cacheFilename, tmp_path):
+    estimator = WeibullTimingEstimator(cacheFilename)
+    assert not estimator.load()
+    (tmp_path / "timing").mkdir()
+    with open(cacheFilename, "w") as cacheFile:
+        cacheFile.write("{")
+    assert not estimator.load()
+    assert not estimator.isCalibrated()
+
+
+def test_calibrates_in_background_only_when_needed(cacheFilename, quickCalibration):
+    estimator = WeibullTimingEstimator(cacheFilename)
+    estimator.loadOrCalibrateInBackground()
+    estimator._thread.join(60)
+    assert estimator.isCalibrated()
+
+    assert not estimator.calibrationFailed()
+
+    loaded = WeibullTimingEstimator(cacheFilename)
+    loaded.loadOrCalibrateInBackground()
+    assert loaded._thread is None
+    assert loaded.coefficients == estimator.coefficients
+
+
+def test_failed_calibration_is_reported(cacheFilename, monkeypatch):
+    monkeypatch.setattr(timing_module, "CALIBRATION_FITS", [(5, 1, 10)])
+    estimator = WeibullTimingEstimator(cacheFilename)
+    monkeypatch.setattr(timing_module, "_fitCostModel", lambda sizes, times: 1/0)
+    estimator.loadOrCalibrateInBackground()
+    estimator._thread.join(60)
+    assert estimator.calibrationFailed()
+    assert isinstance(estimator.calibrationError, ZeroDivisionError)
+    assert not estimator.isCalibrated()
+
+
+def test_unwritable_cache_still_calibrates(tmp_path, quickCalibration):
+    # The cache directory cannot be created beneath a file
+    (tmp_path / "file").write_text("")
+    estimator = WeibullTimingEstimator(str(tmp_path / "file" / "weibull_timing.json"))
+    estimator.loadOrCalibrateInBackground()
+    estimator._thread.join(60)
+    assert estimator.isCalibrated()
+    assert not estimator.calibrationFailed()
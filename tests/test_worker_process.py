@@ -0,0 +1,121 @@
+'''
+Tests of core.worker_process and the desktop application's ThreadHandler.
+'''
+
+import math
+import os
+import time
+
+import pytest
+
+from core.exceptions import CalculationCancelled
+from core.isopach import Isopach
+from core.worker_process import WorkerProcess
+from desktop.thread_handlers import ThreadHandler
+from settings import Model
+
+ISOPACHS = [Isopach(t, x) for t, x in [(10.0, 2.0), (5.0, 4.0), (2.0, 8.0), (0.5, 16.0)]]
+
+
+@pytest.fixture
+def worker():
+    worker = WorkerProcess()
+    yield worker
+    worker.terminate()
+
+
+def _waitForResult(handler, timeout=30):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        result = handler.getCurrentCalculationResult()
+        if result is not None:
+            return result
+        time.sleep(0.01)
+    raise AssertionError("No result received")
+
+
+def test_results_and_errors_are_received(worker):
+    worker.submit(math.sqrt, (4.0,))
+    assert worker.busy
+    assert worker.receive() == ("result", 2.0)
+    assert not worker.busy
+
+    pid = worker._process.pid
+    worker.submit(math.sqrt, (-1.0,))
+    kind, value = worker.receive()
+    assert kind == "error" and isinstance(value, ValueError)
+    # The process is kept between calculations
+    assert worker._process.pid == pid
+
+
+def test_one_calculation_at_a_time(worker):
+    worker.submit(time.sleep, (0.2,))
+    with pytest.raises(RuntimeError):
+        worker.submit(math.sqrt, (4.0,))
+    assert worker.receive() == ("result", None)
+
+
+def test_terminate_stops_the_calculation(worker):
+    worker.submit(time.sleep, (60,))
+    process = worker._process
+    assert not worker.poll(0.2)
+
+    start = time.monotonic()
+    worker.terminate()
+    assert time.monotonic() - start < 5
+    assert not process.is_alive() and not worker.busy
+
+    # A new process is started for the next calculation
+    worker.submit(os.getpid)
+    kind, pid = worker.receive()
+    assert kind == "result" and pid != process.pid
+
+
+def test_receive_after_the_process_dies(worker):
+    worker.submit(time.sleep, (60,))
+    worker._process.terminate()
+    kind, value = worker.receive()
+    assert kind == "error" and isinstance(value, CalculationCancelled)
+
+
+def test_shutdown(worker):
+    worker.submit(math.sqrt, (4.0,))
+    worker.receive()
+    process = worker._process
+    worker.shutdown()
+    assert not process.is_alive()
+    assert process.exitcode == 0
+
+
+@pytest.fixture
+def handler():
+    handler = ThreadHandler()
+    yield handler
+    handler.shutdown()
+
+
+def test_handler_returns_the_calculation_type(handler):
+    handler.startCalculation(Model.EXP, (ISOPACHS, 2))
+    calculationType, results = _waitForResult(handler)
+    assert calculationType == Model.EXP
+    assert results["estimatedTotalVolume"] > 0
+
+
+def test_handler_cancels_the_previous_calculation(handler):
+    handler.startCalculation(Model.WEI, (ISOPACHS, 20, 10**7, ((0, 1000), (0, 2))))
+    process = handler._worker._process
+    time.sleep(0.2)
+    handler.startCalculation(Model.POW, (ISOPACHS, 1.0, 300))
+    assert not process.is_alive()
+    assert _waitForResult(handler)[0] == Model.POW
+
+
+def test_handler_reports_errors(handler):
+    handler.startCalculation(Model.EXP, (ISOPACHS[:1], 2))
+    calculationType, error = _waitForResult(handler)
+    assert calculationType == "Error" and isinstance(error, Exception)
+
+    handler.startCalculation(Model.WEI, (ISOPACHS, 20, 10**7, ((0, 1000), (0, 2))))
+    handler._worker._process.terminate()
+    calculationType, error = _waitForResult(handler)
+    assert calculationType == "Error" and isinstance(error, RuntimeError)